@@ -0,0 +1,76 @@
+"""
+Benchmark: building an ADK Runner per request vs. sharing one per agent via RunnerRegistry.
+
+Measures only the per-request cost of obtaining a runner, which is all that the registry changes.
+No model calls are made.
+
+Usage:
+    PYTHONPATH=src python scripts/benchmark_runners.py [--iterations 2000]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from google.adk.agents import Agent
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.tools.agent_tool import AgentTool
+
+from rickbot_agent.runners import RunnerRegistry
+
+APP_NAME = "rickbot_benchmark"
+
+
+def make_agent():
+    """An agent shaped like the app's: an LLM agent with an AgentTool, without any network setup."""
+    search_agent = Agent(name="SearchAgent", model="gemini-2.5-flash", instruction="Search the web.")
+    return Agent(
+        name="rickbot_Rick",
+        model="gemini-2.5-flash",
+        instruction="You are Rick.",
+        tools=[AgentTool(agent=search_agent)],
+    )
+
+
+def bench(label, get_runner, iterations):
+    get_runner()  # Warm up
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        get_runner()
+    elapsed = time.perf_counter() - started
+
+    # Measure allocations in a separate pass, since tracing slows everything down
+    tracemalloc.start()
+    for _ in range(iterations):
+        get_runner()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<28} {elapsed / iterations * 1e6:>10.2f} us/request {peak / 1024:>10.1f} KiB peak traced")
+    return elapsed
+
+
+def main(iterations):
+    agent = make_agent()
+    session_service = InMemorySessionService()
+    artifact_service = InMemoryArtifactService()
+
+    def build_runner(agent=agent):
+        return Runner(agent=agent, app_name=APP_NAME, session_service=session_service, artifact_service=artifact_service)
+
+    registry = RunnerRegistry(build_runner)
+
+    print(f"{iterations} iterations")
+    per_request = bench("New Runner per request", build_runner, iterations)
+    shared = bench("Shared runner (registry)", lambda: registry.get(agent), iterations)
+    print(f"\nSpeed-up: {per_request / shared:.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-request vs shared ADK runners.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.iterations)
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark: SSE frame encoding for a typical /chat_stream turn.
+
+Compares the previous encoding (json.dumps into f-strings, plus a debug frame per ADK event)
+with rickbot_utils.sse (precomputed prefixes, orjson when installed, debug frames off by default),
+with and without chunk coalescing. Reports turns and frames per second, and frames and bytes on the wire per turn.
+
+Usage:
+    PYTHONPATH=src python scripts/benchmark_sse.py [--turns 2000] [--chunks 200]
+"""
+
+import argparse
+import itertools
+import json
+import re
+import time
+from datetime import datetime
+
+from rickbot_utils import sse
+
+# Typical token-level chunks: a word or so at a time
+SAMPLE_TOKENS = re.findall(r"\S+\s*", "Listen, Morty, I'm gonna need you to grab the portal gun. We're going on an adventure! ")
+
+
+def sample_tokens(chunks):
+    return itertools.islice(itertools.cycle(SAMPLE_TOKENS), chunks)
+
+
+def legacy_turn(chunks):
+    """The frames sent for one turn before the SSE encoder was introduced."""
+    yield f"data: {json.dumps({'session_id': '6f1c1f6e-6f4e-4a53-9a4c-0b7f3f7f1e2a'})}\n\n".encode()
+    events = [("tool_call", {"name": "SearchAgent", "args": {"query": "portal fluid"}})]
+    events += [("chunk", token) for token in sample_tokens(chunks)]
+    for kind, value in events:
+        ts = datetime.now().isoformat()
+        yield f"data: {json.dumps({'debug': {'event_type': 'Event', 'ts': ts}})}\n\n".encode()
+        if kind == "chunk":
+            yield f"data: {json.dumps({'chunk': value})}\n\n".encode()
+        else:
+            yield f"data: {json.dumps({kind: value})}\n\n".encode()
+    yield f"data: {json.dumps({'done': True})}\n\n".encode()
+
+
+def encoder_turn(chunks):
+    """The frames sent for one turn by rickbot_utils.sse, with debug frames off."""
+    yield sse.encode_event({"session_id": "6f1c1f6e-6f4e-4a53-9a4c-0b7f3f7f1e2a"})
+    yield sse.encode_event({"tool_call": {"name": "SearchAgent", "args": {"query": "portal fluid"}}})
+    for token in sample_tokens(chunks):
+        yield sse.encode_chunk(token)
+    yield sse.DONE_FRAME
+
+
+def coalesced_turn(chunks):
+    """As encoder_turn, with chunks coalesced. Tokens arrive faster than the delay here, so this shows the
+    frames saved by the size and sentence-boundary limits alone."""
+    coalescer = sse.ChunkCoalescer(max_delay=60)
+    yield sse.encode_event({"session_id": "6f1c1f6e-6f4e-4a53-9a4c-0b7f3f7f1e2a"})
+    yield sse.encode_event({"tool_call": {"name": "SearchAgent", "args": {"query": "portal fluid"}}})
+    for token in sample_tokens(chunks):
+        if frames := coalescer.chunk(token):
+            yield frames
+    if frame := coalescer.flush():
+        yield frame
+    yield sse.DONE_FRAME
+
+
+def bench(label, turn, turns, chunks):
+    frames = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    for _ in range(turns):
+        for frame in turn(chunks):
+            frames += 1
+            total_bytes += len(frame)
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{label:<34} {turns / elapsed:>8,.0f} turns/s {frames / elapsed:>12,.0f} frames/s {frames // turns:>6} frames/turn "
+        f"{total_bytes // turns:>8,} bytes/turn"
+    )
+
+
+def main(turns, chunks):
+    serialiser = "orjson" if hasattr(sse, "orjson") else "json"
+    print(f"{turns} turns of {chunks} chunks. JSON serialiser: {serialiser}")
+    bench("json.dumps + debug frames", legacy_turn, turns, chunks)
+    bench("rickbot_utils.sse (no debug frames)", encoder_turn, turns, chunks)
+    bench("rickbot_utils.sse + coalescing", coalesced_turn, turns, chunks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SSE frame encoding.")
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=200, help="Text chunks per turn")
+    args = parser.parse_args()
+    main(args.turns, args.chunks)
@@ -0,0 +1,138 @@
+"""
+Migrate user documents to the deterministic `{provider}:{id}` document ID format.
+
+User documents used to be created with the ID `{SafeName}:{provider}:{id}`, which includes the user's display name.
+This script rewrites each such document to `{provider}:{id}`, and deletes the old document in the same batch.
+If a user has more than one old document (e.g. because they changed their name), they are merged,
+keeping the highest role and the most recent login.
+
+The migration is resumable: the ID of the last migrated document is saved to a checkpoint file after each batch,
+and a later run continues from there. Re-running over documents that have already been migrated is harmless.
+
+Usage:
+    python scripts/migrate_user_keys.py [--project PROJECT] [--dry-run] [--batch-size 200] [--checkpoint FILE]
+"""
+
+import argparse
+import os
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import google.auth
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+ROLE_RANK = {"standard": 0, "supporter": 1, "admin": 2}
+DEFAULT_CHECKPOINT = ".migrate_user_keys.checkpoint"
+NEVER = datetime.min.replace(tzinfo=UTC)
+
+
+def target_doc_id(data):
+    """The new document ID for a user, or None if the document lacks the fields needed to derive it."""
+    if not data.get("provider") or not data.get("id"):
+        return None
+    return f"{data['provider']}:{data['id']}"
+
+
+def merge_user(existing, incoming):
+    """Combine two documents for the same user, keeping the highest role and the most recent login."""
+    if not existing:
+        return dict(incoming)
+
+    newer, older = existing, incoming
+    if (incoming.get("last_logged_in") or NEVER) > (existing.get("last_logged_in") or NEVER):
+        newer, older = incoming, existing
+
+    merged = {**older, **newer}
+    roles = [r for r in (existing.get("role"), incoming.get("role")) if r]
+    if roles:
+        merged["role"] = max(roles, key=lambda r: ROLE_RANK.get(r, 0))
+    return merged
+
+
+def migrate_page(db, docs, dry_run):
+    """Migrate one page of user documents. Returns the number of documents rewritten."""
+    merged: dict[str, dict[str, Any]] = {}  # target ID -> merged data
+    legacy_refs = []
+
+    for doc in docs:
+        data = doc.to_dict() or {}
+        target_id = target_doc_id(data)
+        if target_id is None:
+            print(f"  Skipping {doc.id}: missing 'provider' or 'id'")
+            continue
+        if doc.id == target_id:
+            continue  # Already migrated
+
+        merged[target_id] = merge_user(merged.get(target_id), data)
+        legacy_refs.append(doc.reference)
+        print(f"  {doc.id} -> {target_id}")
+
+    if not legacy_refs or dry_run:
+        return len(legacy_refs)
+
+    # Fold in any document already at the target ID, e.g. created by the new code since it was deployed
+    target_refs = [db.collection("users").document(target_id) for target_id in merged]
+    for snapshot in db.get_all(target_refs):
+        if snapshot.exists:
+            merged[snapshot.id] = merge_user(snapshot.to_dict(), merged[snapshot.id])
+
+    batch = db.batch()
+    for ref in target_refs:
+        batch.set(ref, merged[ref.id])
+    for ref in legacy_refs:
+        batch.delete(ref)
+    batch.commit()
+
+    return len(legacy_refs)
+
+
+def migrate_user_keys(project_id, batch_size, checkpoint_path, dry_run):
+    db = firestore.Client(project=project_id)
+    checkpoint = Path(checkpoint_path)
+    last_doc_id = checkpoint.read_text().strip() if checkpoint.exists() and not dry_run else None
+    if last_doc_id:
+        print(f"Resuming after document {last_doc_id}")
+
+    migrated = 0
+    while True:
+        query = db.collection("users").order_by(FieldPath.document_id()).limit(batch_size)
+        if last_doc_id:
+            query = query.start_after({FieldPath.document_id(): db.collection("users").document(last_doc_id)})
+
+        docs = list(query.stream())
+        if not docs:
+            break
+
+        migrated += migrate_page(db, docs, dry_run)
+        last_doc_id = docs[-1].id
+        if not dry_run:
+            checkpoint.write_text(last_doc_id)
+
+    verb = "Would migrate" if dry_run else "Migrated"
+    print(f"\n{verb} {migrated} user documents.")
+    if not dry_run and checkpoint.exists():
+        checkpoint.unlink()
+
+
+if __name__ == "__main__":
+    _, default_project_id = google.auth.default()
+    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT", default_project_id)
+
+    parser = argparse.ArgumentParser(description="Rewrite user documents to use {provider}:{id} document IDs.")
+    parser.add_argument("--project", default=project_id, help="Google Cloud Project ID")
+    parser.add_argument("--batch-size", type=int, default=200, help="Documents per page (at most 250)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="File recording progress, for resuming")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    if not args.project:
+        print("Error: GOOGLE_CLOUD_PROJECT environment variable not set and --project not provided.")
+        exit(1)
+
+    if not 0 < args.batch_size <= 250:
+        print("Error: --batch-size must be between 1 and 250.")  # Each document needs a set and a delete in the batch
+        exit(1)
+
+    migrate_user_keys(args.project, args.batch_size, args.checkpoint, args.dry_run)
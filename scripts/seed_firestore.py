@@ -27,7 +27,7 @@ def seed_firestore(project_id):
         print(f"  Set {persona_id} -> {required_role}")
 
     # 2. Seed users (for testing)
-    # Using readable document ID format: {name}:{provider}:{id}
+    # Using document ID format: {provider}:{id}
     users = [
         {
             "id": "derailed-dash",
@@ -54,8 +54,7 @@ def seed_firestore(project_id):
 
     print("\nSeeding users collection...")
     for user in users:
-        safe_name = "".join(c for c in user["name"] if c.isalnum()) or f"user-{user['id'][:8]}"
-        doc_id = f"{safe_name}:{user['provider']}:{user['id']}"
+        doc_id = f"{user['provider']}:{user['id']}"
         doc_ref = db.collection("users").document(doc_id)
         doc_ref.set({
             "id": user["id"],
@@ -21,40 +21,102 @@ Notes:
 """
 
 import asyncio
-import json
 import uuid
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Awaitable, Callable, Hashable
+from contextlib import aclosing, asynccontextmanager, nullcontext
 from datetime import datetime
 from os import getenv
-from typing import Annotated, Any
+from typing import Annotated, Any, NamedTuple
 
-from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
-from rickbot_agent.agent import get_agent
-from rickbot_agent.auth import verify_token
+from rickbot_agent.agent import get_agent, save_pending_summaries
+from rickbot_agent.auth import verify_admin_key, verify_token
+from rickbot_agent.auth_github import get_github_verifier
+from rickbot_agent.auth_google import get_google_verifier
 from rickbot_agent.auth_middleware import AuthMiddleware
 from rickbot_agent.auth_models import AuthUser, PersonaAccessDeniedException
+from rickbot_agent.auth_session import SESSION_TOKEN_HEADER
 from rickbot_agent.personality import get_personalities
-from rickbot_agent.services import get_artifact_service, get_session_service, get_required_role, get_user_role
+from rickbot_agent.response_cache import RESPONSE_CACHE_STREAM_DELAY_MS, ResponseCacheKey, stream_pieces
+from rickbot_agent.runners import RunnerRegistry
+from rickbot_agent.services import (
+    get_artifact_service,
+    get_persona_tier_table,
+    get_required_role,
+    get_response_cache,
+    get_session_service,
+    get_user_metadata_writer,
+    get_user_role,
+    invalidate_user_role,
+    watch_user_role_changes,
+)
 
 # ADK imports MUST happen after agent patch
+from google.adk.agents.invocation_context import new_invocation_context_id
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.events import Event
 from google.adk.runners import Runner
+from google.adk.sessions import Session
 from google.genai.types import Content, Part
 
+from rickbot_utils.admission import AdmissionController, AdmissionRejectedException, Permit
 from rickbot_utils.config import logger
+from rickbot_utils.deadline import Deadline, deadline_scope
+from rickbot_utils.heartbeat import HEARTBEAT, HeartbeatScheduler
+from rickbot_utils.idempotency import IdempotencyKeyReusedException, IdempotencyRegistry
+from rickbot_utils.keyed_lock import KeyedLock
+from rickbot_utils.metrics import metrics
 from rickbot_utils.rate_limit import limiter
+from rickbot_utils.sse import DONE_FRAME, HEARTBEAT_FRAME, ChunkCoalescer, encode_chunk, encode_event, with_id
+from rickbot_utils.turn_stream import (
+    StreamGoneException,
+    StreamStalledException,
+    TurnStream,
+    TurnStreamRegistry,
+    format_event_id,
+)
 
 APP_NAME = getenv("APP_NAME", "rickbot_api")
 
-# SSE (Server-Sent Events) padding constant
-# This forces network buffers to flush immediately, ensuring the UI receives
-# "Thinking..." indicators without delay. 4KB is a common buffer size threshold.
-SSE_FLUSH_PADDING_BYTES = 4096
+# Stream the model's response token by token, as partial events, rather than a whole response at a time
+STREAMING_RUN_CONFIG = RunConfig(streaming_mode=StreamingMode.SSE)
+
+# Send a debug frame for every ADK event on every stream, not just when a request asks for them with `debug=true`
+SSE_DEBUG_FRAMES = getenv("SSE_DEBUG_FRAMES", "false").lower() == "true"
+
+# The most ADK events buffered per stream, waiting to be sent. Past this, the agent run waits for the client.
+SSE_EVENT_QUEUE_MAX_EVENTS = int(getenv("SSE_EVENT_QUEUE_MAX_EVENTS", "64"))
+# How long the agent run waits for a client that has stopped reading before the run is cancelled
+SSE_SLOW_CLIENT_TIMEOUT_SECONDS = float(getenv("SSE_SLOW_CLIENT_TIMEOUT_SECONDS", "30"))
+
+# The time budget of a turn, from when its request arrives. Once it has passed, the agent run is stopped,
+# and the reply so far is sent, ending with DEADLINE_EXCEEDED_NOTE.
+CHAT_DEADLINE_SECONDS = float(getenv("CHAT_DEADLINE_SECONDS", "60"))
+CHAT_STREAM_DEADLINE_SECONDS = float(getenv("CHAT_STREAM_DEADLINE_SECONDS", "120"))
+# Personas in the supporter tier are given this many times the budget
+SUPPORTER_TIER_DEADLINE_FACTOR = float(getenv("SUPPORTER_TIER_DEADLINE_FACTOR", "1.5"))
+DEADLINE_EXCEEDED_NOTE = "I ran out of time before I could finish this answer. Try again, or ask something narrower."
+
+# Limits the agent runs in progress on this instance, across /chat and /chat_stream
+admission_controller = AdmissionController()
+# Shared by all streams. Started by the lifespan.
+heartbeat_scheduler = HeartbeatScheduler()
+# The frames of live and recently finished turns, so that a dropped stream can be resumed
+turn_streams = TurnStreamRegistry()
+# Turns for one session run one at a time, in the order they arrive. Keyed by (user, session), as sessions are per user.
+session_locks: KeyedLock[tuple[str, str]] = KeyedLock("session_locks")
+
+stream_backpressure_waits = metrics.counter("chat_stream.backpressure_waits")
+aborted_slow_client = metrics.counter("chat_stream.aborted.slow_client")
+stream_disconnects = metrics.counter("chat_stream.disconnects")
+stream_resumes = metrics.counter("chat_stream.resumes")
+deadlines_exceeded = metrics.counter("chat.deadline_exceeded")
 
 
 def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> JSONResponse:
@@ -68,6 +130,14 @@ def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> JSO
     return response
 
 
+def admission_rejected_handler(request: Request, exc: AdmissionRejectedException) -> JSONResponse:
+    """Custom handler for requests turned away because the instance is too busy."""
+    logger.warning(f"Admission rejected for {request.url.path}: {exc.reason}")
+    response = JSONResponse(status_code=503, content={"detail": "The server is busy. Please try again shortly."})
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response
+
+
 def persona_access_denied_handler(request: Request, exc: PersonaAccessDeniedException) -> JSONResponse:
     """Custom handler for persona access denial."""
     return JSONResponse(
@@ -105,13 +175,61 @@ class Persona(BaseModel):
     prompt_question: str
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    """Starts background tasks when the app starts, and stops them on shutdown."""
+    background_tasks: list[asyncio.Task] = []
+
+    # Keep Google's token signing certs fresh, so verifying Google tokens needs no network call
+    if google_verifier := get_google_verifier():
+        background_tasks.append(asyncio.create_task(google_verifier.run_refresh_loop()))
+
+    # Hold persona tiers in memory, so the RBAC check doesn't read Firestore on every chat request
+    persona_tier_table = get_persona_tier_table()
+    persona_tier_table.start()
+
+    # Drop cached user roles as soon as they change, e.g. when a user is upgraded to supporter
+    stop_watching_user_roles = None
+    try:
+        stop_watching_user_roles = watch_user_role_changes()
+    except Exception as e:
+        logger.error(f"Unable to watch for user role changes. Cached roles will expire after their TTL: {e}")
+
+    # One ticker sends heartbeats to every idle /chat_stream stream
+    background_tasks.append(asyncio.create_task(heartbeat_scheduler.run()))
+
+    # Write user metadata to Firestore in the background, rather than inside /personas requests
+    user_metadata_writer = get_user_metadata_writer()
+    background_tasks.append(asyncio.create_task(user_metadata_writer.run()))
+
+    # Reload the semantic cache saved by the previous instance
+    if response_cache and response_cache.semantic is not None:
+        await asyncio.to_thread(response_cache.semantic.load)
+
+    yield
+
+    if response_cache and response_cache.semantic is not None:
+        await asyncio.to_thread(response_cache.semantic.save)
+    # Summaries of long sessions are otherwise lost with this instance, and written again on another
+    await save_pending_summaries(session_service)
+    if stop_watching_user_roles:
+        stop_watching_user_roles()
+    persona_tier_table.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await user_metadata_writer.drain()
+    await get_github_verifier().aclose()
+
+
 logger.debug("Initialising FastAPI app...")
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add Rate Limiting
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)  # type: ignore[arg-type]
 app.add_exception_handler(PersonaAccessDeniedException, persona_access_denied_handler)
+app.add_exception_handler(AdmissionRejectedException, admission_rejected_handler)
 app.add_middleware(SlowAPIMiddleware)
 # Note on Middleware Order:
 # FastAPI/Starlette middlewares are executed LIFO (Last Added = First Executed).
@@ -129,6 +247,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[SESSION_TOKEN_HEADER],  # Lets browser clients read the API session token
 )
 
 
@@ -136,15 +255,20 @@ async def check_persona_access(
     personality: Annotated[str, Form()] = "Rick",
     user: AuthUser = Depends(verify_token),
 ) -> None:
-    """Dependency to check if the user has access to the requested persona."""
-    required_role = get_required_role(personality)
-    user_role = "standard"
+    """Check that the user has access to the requested persona. Raises PersonaAccessDeniedException if not."""
+    required_role: str
+    user_role: str = "standard"
     if user:
-        user_role = get_user_role(user.id, user.provider)
+        # The two lookups are independent, so make them concurrently
+        required_role, user_role = await asyncio.gather(
+            get_required_role(personality), get_user_role(user.id, user.provider)
+        )
         logger.info(
             f"RBAC Check: user_id='{user.id}', provider='{user.provider}', "
             f"role='{user_role}', persona='{personality}', required='{required_role}'"
         )
+    else:
+        required_role = await get_required_role(personality)
 
     if required_role == "supporter" and user_role != "supporter":
         logger.warning(
@@ -155,7 +279,7 @@ async def check_persona_access(
 
 
 @app.get("/personas")
-def get_personas(request: Request, user: AuthUser = Depends(verify_token)) -> list[Persona]:
+async def get_personas(request: Request, user: AuthUser = Depends(verify_token)) -> list[Persona]:
     """Returns a list of available chatbot personalities."""
     # Sync user metadata on persona list load (usually happens right after login)
     from rickbot_agent.services import sync_user_metadata
@@ -180,278 +304,544 @@ def get_personas(request: Request, user: AuthUser = Depends(verify_token)) -> li
 logger.debug("Initialising services...")
 session_service = get_session_service()
 artifact_service = get_artifact_service()
+# Replies to first turns, or None if not enabled
+response_cache = get_response_cache()
 
+# One runner per agent, shared by all requests.
+# Module globals are looked up when a runner is built, rather than captured now.
+runner_registry = RunnerRegistry(
+    lambda agent: Runner(
+        agent=agent,
+        app_name=APP_NAME,
+        session_service=session_service,
+        artifact_service=artifact_service,
+    )
+)
 
-async def _process_files(
-    files: list[UploadFile],
-    user_id: str,
-    session_id: str,
-    artifact_service,
-) -> list[Part]:
-    """Helper function to process uploaded files."""
-    parts = []
-    if files:
-        for f in files:
-            if not f.filename:
-                continue
-            logger.debug(f"Processing uploaded file: {f.filename} ({f.content_type})")
-            file_content = await f.read()
-
-            # Save as Artifact (User-scoped)
-            # Note: if user uploads a file with the same name, it will be overwritten.
-            artifact_filename = f"user:{f.filename}"
-            mime_type = f.content_type or "application/octet-stream"
-            artifact_part = Part.from_bytes(data=file_content, mime_type=mime_type)
-            await artifact_service.save_artifact(
+
+class PreparedTurn(NamedTuple):
+    """Everything needed to run the agent for one chat turn."""
+
+    session_id: str
+    agent: Any
+    new_message: Content
+    uploads: list[tuple[str, Part]]  # (artifact filename, part) for each uploaded file
+    session: Session
+
+
+response_cache_hits = metrics.counter("response_cache.served")
+
+
+async def _get_or_create_session(session_id: str, user_id: str) -> Session:
+    """Get the session, or create it if it doesn't exist."""
+    session = await session_service.get_session(session_id=session_id, user_id=user_id, app_name=APP_NAME)
+    if not session:
+        logger.debug(f"Creating new session: {session_id}")
+        return await session_service.create_session(session_id=session_id, user_id=user_id, app_name=APP_NAME)
+
+    logger.debug(f"Found existing session: {session_id}")
+    return session
+
+
+async def _read_files(files: list[UploadFile]) -> list[tuple[str, Part]]:
+    """Read the uploaded files concurrently, returning the artifact filename and content of each."""
+
+    async def read(f: UploadFile) -> tuple[str, Part]:
+        logger.debug(f"Processing uploaded file: {f.filename} ({f.content_type})")
+        file_content = await f.read()
+        # User-scoped artifact. Note: if user uploads a file with the same name, it will be overwritten.
+        mime_type = f.content_type or "application/octet-stream"
+        return f"user:{f.filename}", Part.from_bytes(data=file_content, mime_type=mime_type)
+
+    return list(await asyncio.gather(*(read(f) for f in files or [] if f.filename)))
+
+
+async def _save_artifacts(uploads: list[tuple[str, Part]], user_id: str, session_id: str) -> None:
+    """Save the uploaded files as artifacts, concurrently."""
+    await asyncio.gather(
+        *(
+            artifact_service.save_artifact(
                 app_name=APP_NAME,
                 user_id=user_id,
                 session_id=session_id,
                 filename=artifact_filename,
                 artifact=artifact_part,
             )
+            for artifact_filename, artifact_part in uploads
+        )
+    )
 
-            # Create a Part object for the agent to process
-            parts.append(artifact_part)
-    # No warning needed for empty list, only if files is explicitly None (which shouldn't happen with default=[])
 
-    return parts
+# Holds references to fire-and-forget tasks, so they aren't garbage collected before they finish
+_background_tasks: set[asyncio.Task] = set()
 
 
-@app.post("/chat", dependencies=[Depends(check_persona_access)])
-@limiter.limit("5 per minute")
-async def chat(
-    request: Request,
-    prompt: Annotated[str, Form()],
-    session_id: Annotated[str | None, Form()] = None,
-    personality: Annotated[str, Form()] = "Rick",
-    user: AuthUser = Depends(verify_token),
-    files: list[UploadFile] = File(default=[]),
-) -> ChatResponse:
-    """Chat endpoint to interact with the Rickbot agent."""
-    user_id = user.email  # Use email as user_id for ADK sessions
-    logger.debug(
-        f"Received chat request - "
-        f"Personality: {personality}, User: {user.email}, Session ID: {session_id if session_id else 'None'}"
-    )
+def _start_saving_artifacts(uploads: list[tuple[str, Part]], user_id: str, session_id: str) -> asyncio.Task | None:
+    """
+    Save the uploads in the background, so that persisting them overlaps with the model run.
+    The model is given the file bytes inline, so it doesn't need to wait for them to be saved.
+    """
+    if not uploads:
+        return None
 
-    current_session_id = session_id if session_id else str(uuid.uuid4())
+    task = asyncio.create_task(_save_artifacts(uploads, user_id, session_id))
+    _background_tasks.add(task)
 
-    # Get the session, or create it if it doesn't exist
-    session = await session_service.get_session(session_id=current_session_id, user_id=user_id, app_name=APP_NAME)
-    if not session:
-        logger.debug(f"Creating new session: {current_session_id}")
-        session = await session_service.create_session(session_id=current_session_id, user_id=user_id, app_name=APP_NAME)
-    else:
-        logger.debug(f"Found existing session: {current_session_id}")
+    def done(t: asyncio.Task) -> None:
+        _background_tasks.discard(t)
+        if not t.cancelled() and (e := t.exception()):
+            logger.error(f"Error saving uploaded files for session {session_id}: {e}")
 
-    # Get the correct agent personality (lazily loaded and cached)
-    logger.debug(f"Loading agent for personality: '{personality}'")
-    agent = get_agent(personality)
+    task.add_done_callback(done)
+    return task
 
-    # Construct the message parts
-    parts = [Part.from_text(text=prompt)]
 
-    # Add any files to the message
-    file_parts = await _process_files(files, user_id, current_session_id, artifact_service)
-    parts.extend(file_parts)
+async def _prepare_turn(
+    prompt: str, session_id: str | None, personality: str, user: AuthUser, files: list[UploadFile]
+) -> PreparedTurn:
+    """
+    Do everything needed before the agent can run, with the independent stages running concurrently:
+    the access check then getting or creating the session, loading the agent, and reading the uploaded files.
+    If any stage fails, the others are cancelled and the first error is raised.
+    Neither the session nor the uploads are written until access has been granted; see _start_saving_artifacts().
+    """
+    user_id = user.email  # Use email as user_id for ADK sessions
+    current_session_id = session_id if session_id else str(uuid.uuid4())
 
-    # Associate the role with the message
+    async def get_session_once_allowed() -> Session:
+        # A denied request must not leave a new, empty session behind
+        await check_persona_access(personality, user)
+        return await _get_or_create_session(current_session_id, user_id)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            session_task = tg.create_task(get_session_once_allowed())
+            # Get the correct agent personality (lazily loaded and cached). The first load may call out to
+            # the network, so it is kept off the event loop.
+            logger.debug(f"Loading agent for personality: '{personality}'")
+            agent_task = tg.create_task(asyncio.to_thread(get_agent, personality))
+            files_task = tg.create_task(_read_files(files))
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0] from None
+
+    # Construct the message parts, with any files, and associate the role with the message
+    uploads = files_task.result()
+    parts = [Part.from_text(text=prompt), *(part for _, part in uploads)]
     new_message = Content(role="user", parts=parts)
 
-    # Create the runner
-    runner = Runner(
-        agent=agent,
-        app_name=APP_NAME,
-        session_service=session_service,
-        artifact_service=artifact_service,
-    )
+    return PreparedTurn(current_session_id, agent_task.result(), new_message, uploads, session_task.result())
 
-    # Run the agent and extract response and attachments
-    logger.debug(f"Running agent for session: {current_session_id}")
-    final_msg = ""
-    response_attachments: list[Part] = []
-    async for event in runner.run_async(
-        user_id=user_id,
-        session_id=current_session_id,
-        new_message=new_message,
-    ):
-        # Log tool calls and transfers
-        if function_calls := event.get_function_calls():
-            for fc in function_calls:
-                logger.debug(f"Session {current_session_id} calling tool: {fc.name}")
-        if event.actions and event.actions.transfer_to_agent:
-            logger.debug(f"Session {current_session_id} transferring to agent: {event.actions.transfer_to_agent}")
-
-        if event.is_final_response() and event.content and event.content.parts:
-            for part in event.content.parts:
-                if part.text:
-                    final_msg += part.text
-                elif part.inline_data:  # Check for other types of parts (e.g., images)
-                    response_attachments.append(part)
 
-    logger.debug(f"Agent for session {current_session_id} finished.")
-    logger.debug(f"Final message snippet: {final_msg[:100]}...")
+def _response_cache_key(prepared: PreparedTurn, prompt: str) -> ResponseCacheKey | None:
+    """The response cache key for this turn, or None if its reply can't be cached (or the cache is off)."""
+    if response_cache is None or prepared.uploads or prepared.session.events:
+        return None  # Only the first turn of a session, with no attachments, depends on nothing but the prompt
+    return response_cache.key_for(prepared.agent, prompt)
 
-    return ChatResponse(
-        response=final_msg,
-        session_id=current_session_id,
-        attachments=response_attachments if response_attachments else None,
+
+async def _record_cached_turn(prepared: PreparedTurn, reply: str) -> None:
+    """
+    Write the prompt and a cached reply to the session, as if the agent had run,
+    so that later turns in the conversation see the exchange.
+    """
+    invocation_id = new_invocation_context_id()
+    reply_content = Content(role="model", parts=[Part.from_text(text=reply)])
+    await session_service.append_event(
+        prepared.session, Event(invocation_id=invocation_id, author="user", content=prepared.new_message)
     )
+    await session_service.append_event(
+        prepared.session, Event(invocation_id=invocation_id, author=prepared.agent.name, content=reply_content)
+    )
+
+
+async def _admission_priority(user: AuthUser) -> bool:
+    """Whether the user is admitted ahead of others when the instance is busy: supporters are."""
+    # The role is cached from the access check, so this doesn't read Firestore again
+    return await get_user_role(user.id, user.provider) == "supporter"
+
+
+async def _request_deadline(seconds: float, personality: str) -> Deadline:
+    """The deadline of a request to an endpoint with a budget of seconds, adjusted for the persona's tier."""
+    # The tier is served from the in-memory persona tier table
+    if await get_required_role(personality) == "supporter":
+        seconds *= SUPPORTER_TIER_DEADLINE_FACTOR
+    return Deadline(seconds)
+
+
+def _with_deadline_note(reply: str) -> str:
+    """End a reply that was cut short by its deadline with a note saying so."""
+    return f"{reply}\n\n_{DEADLINE_EXCEEDED_NOTE}_" if reply else f"_{DEADLINE_EXCEEDED_NOTE}_"
 
 
-@app.post("/chat_stream", dependencies=[Depends(check_persona_access)])
+async def _pump_events(events: AsyncGenerator[Any, None], queue: asyncio.Queue[Any], session_id: str) -> None:
+    """
+    Move the events of an agent run onto a stream's queue, then put None when the run completes,
+    or the exception if it fails.
+
+    The queue is bounded, so a client that reads slowly holds back the run. If the client makes no room for
+    SSE_SLOW_CLIENT_TIMEOUT_SECONDS, the run is cancelled, so that we stop generating (and paying for) output
+    nobody is reading, and "aborted" is put in place of None.
+    """
+    try:
+        aborted = False
+        async with aclosing(events):  # Closing the run's generator cancels the run
+            async for event in events:
+                if queue.full():
+                    stream_backpressure_waits.inc()
+                try:
+                    await asyncio.wait_for(queue.put(event), SSE_SLOW_CLIENT_TIMEOUT_SECONDS)
+                except TimeoutError:
+                    aborted = True
+                    break
+
+        if aborted:
+            aborted_slow_client.inc()
+            logger.warning(f"Client stopped reading the stream for session {session_id}. Cancelled the agent run.")
+            await queue.put("aborted")
+        else:
+            await queue.put(None)  # Signal completion
+    except Exception as e:
+        logger.error(f"Error in runner.run_async: {e}", exc_info=True)
+        await queue.put(e)
+
+
+# Submissions with an idempotency key, so that repeats of them can be given the same result
+idempotent_chats: IdempotencyRegistry[ChatResponse] = IdempotencyRegistry("idempotency.chat")
+idempotent_streams: IdempotencyRegistry[TurnStream] = IdempotencyRegistry("idempotency.chat_stream")
+
+
+def _request_fingerprint(prompt: str, session_id: str | None, personality: str, files: list[UploadFile]) -> Hashable:
+    """Identifies a chat request, so that an idempotency key reused for a different request is caught."""
+    return prompt, session_id, personality, tuple((f.filename, f.size) for f in files)
+
+
+async def _run_once[V](
+    registry: IdempotencyRegistry[V], user: AuthUser, key: str, fingerprint: Hashable, fn: Callable[[], Awaitable[V]]
+) -> V:
+    """Run a submission with an idempotency key, unless it has been submitted already. Reusing a key is a 422."""
+    try:
+        return await registry.run_once(user.email, key, fingerprint, fn)
+    except IdempotencyKeyReusedException as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+
+@app.post("/chat")
 @limiter.limit("5 per minute")
-async def chat_stream(
+async def chat(
     request: Request,
     prompt: Annotated[str, Form()],
     session_id: Annotated[str | None, Form()] = None,
     personality: Annotated[str, Form()] = "Rick",
+    idempotency_key: Annotated[str | None, Form()] = None,
     user: AuthUser = Depends(verify_token),
     files: list[UploadFile] = File(default=[]),
-) -> StreamingResponse:
-    """Streaming chat endpoint to interact with the Rickbot agent."""
-    logger.debug(f"DEBUG: chat_stream ENTERED. user={user.id}, personality={personality}")
-    user_id = user.email  # Use email as user_id for ADK sessions
+) -> ChatResponse:
+    """
+    Chat endpoint to interact with the Rickbot agent.
+
+    A request sent again with the same `idempotency_key` (e.g. a double-submit, or a retry after a timeout)
+    is given the first request's response, rather than running the agent again.
+    """
     logger.debug(
-        f"Received chat stream request - "
+        f"Received chat request - "
         f"Personality: {personality}, User: {user.email}, Session ID: {session_id if session_id else 'None'}"
     )
 
-    current_session_id = session_id if session_id else str(uuid.uuid4())
+    deadline = await _request_deadline(CHAT_DEADLINE_SECONDS, personality)
 
-    # Get the session, or create it if it doesn't exist
-    session = await session_service.get_session(session_id=current_session_id, user_id=user_id, app_name=APP_NAME)
-    if not session:
-        logger.debug(f"Creating new session: {current_session_id}")
-        session = await session_service.create_session(session_id=current_session_id, user_id=user_id, app_name=APP_NAME)
-    else:
-        logger.debug(f"Found existing session: {current_session_id}")
+    async def run() -> ChatResponse:
+        # A new session has no earlier turns to wait for
+        async with session_locks.hold((user.email, session_id)) if session_id else nullcontext():
+            return await _chat_turn(prompt, session_id, personality, user, files, deadline)
 
-    # Get the correct agent personality (lazily loaded and cached)
-    logger.debug(f"Loading agent for personality: '{personality}'")
-    agent = get_agent(personality)
+    if idempotency_key:
+        fingerprint = _request_fingerprint(prompt, session_id, personality, files)
+        return await _run_once(idempotent_chats, user, idempotency_key, fingerprint, run)
+    return await run()
 
-    # Construct the message parts
-    parts = [Part.from_text(text=prompt)]
 
-    # Add any files to the message
-    file_parts = await _process_files(files, user_id, current_session_id, artifact_service)
-    parts.extend(file_parts)
+async def _chat_turn(
+    prompt: str, session_id: str | None, personality: str, user: AuthUser, files: list[UploadFile], deadline: Deadline
+) -> ChatResponse:
+    """Run one non-streaming chat turn. If the deadline passes, the run is stopped, and the reply so far returned."""
+    user_id = user.email  # Use email as user_id for ADK sessions
+    prepared = await _prepare_turn(prompt, session_id, personality, user, files)
+    current_session_id, agent, new_message, uploads, _ = prepared
+
+    cache_key = _response_cache_key(prepared, prompt)
+    if cache_key and response_cache and (cached := await response_cache.get(cache_key)):
+        logger.debug(f"Serving cached reply for session: {current_session_id}")
+        response_cache_hits.inc()
+        await _record_cached_turn(prepared, cached)
+        return ChatResponse(response=cached, session_id=current_session_id)
+
+    # Get the shared runner for this agent
+    runner = runner_registry.get(agent)
+
+    # Wait for a permit to run, or raise AdmissionRejectedException if the instance is too busy
+    async with admission_controller.admit(await _admission_priority(user)) as permit:
+        save_artifacts_task = _start_saving_artifacts(uploads, user_id, current_session_id)
+
+        # Run the agent and extract response and attachments
+        logger.debug(f"Running agent for session: {current_session_id}")
+        final_msg = ""
+        response_attachments: list[Part] = []
+        timed_out = False
+        events = runner.run_async(
+            user_id=user_id,
+            session_id=current_session_id,
+            new_message=new_message,
+        )
+        try:
+            # Closing the run's generator cancels the run. The tools it calls see the deadline.
+            with deadline_scope(deadline):
+                async with aclosing(events), asyncio.timeout(deadline.remaining()):
+                    async for event in events:
+                        # Log tool calls and transfers
+                        if function_calls := event.get_function_calls():
+                            for fc in function_calls:
+                                logger.debug(f"Session {current_session_id} calling tool: {fc.name}")
+                        if event.actions and event.actions.transfer_to_agent:
+                            logger.debug(
+                                f"Session {current_session_id} transferring to agent: {event.actions.transfer_to_agent}"
+                            )
+
+                        if event.is_final_response() and event.content and event.content.parts:
+                            for part in event.content.parts:
+                                if part.text:
+                                    final_msg += part.text
+                                elif part.inline_data:  # Check for other types of parts (e.g., images)
+                                    response_attachments.append(part)
+        except TimeoutError:
+            timed_out = True
+            deadlines_exceeded.inc()
+            logger.warning(f"Chat turn for session {current_session_id} passed its deadline of {deadline.seconds}s")
+            permit.release(False)  # Too slow, so the instance may be over capacity
 
-    # Associate the role with the message
-    new_message = Content(role="user", parts=parts)
+    logger.debug(f"Agent for session {current_session_id} finished.")
+    logger.debug(f"Final message snippet: {final_msg[:100]}...")
 
-    # Create the runner
-    runner = Runner(
-        agent=agent,
-        app_name=APP_NAME,
-        session_service=session_service,
-        artifact_service=artifact_service,
+    if save_artifacts_task:
+        await asyncio.wait([save_artifacts_task])  # Errors are logged by the task itself
+
+    if timed_out:
+        final_msg = _with_deadline_note(final_msg)
+    elif cache_key and response_cache and not response_attachments:
+        await response_cache.put(cache_key, final_msg)
+
+    return ChatResponse(
+        response=final_msg,
+        session_id=current_session_id,
+        attachments=response_attachments if response_attachments else None,
     )
 
-    async def event_generator() -> AsyncGenerator[str, None]:
-        # Yield the session ID first
-        yield f"data: {json.dumps({'session_id': current_session_id})}\n\n"
 
+async def _run_turn(
+    turn: TurnStream,
+    events: AsyncGenerator[Any, None],
+    session_id: str,
+    send_debug_frames: bool,
+    save_artifacts_task: asyncio.Task | None,
+    cache_key: ResponseCacheKey | None = None,
+    permit: Permit | None = None,
+    deadline: Deadline | None = None,
+) -> None:
+    """
+    Run a streaming chat turn, publishing its frames to the turn's stream.
+    This runs in the background, independently of the connections following the turn, so that the turn
+    carries on if a connection drops, and the client can resume it.
+    If a cache key is given, the reply is cached once the turn completes.
+    If an admission permit is given, it is released when the run ends.
+    If a deadline is given, the run is stopped when it passes, and the reply so far ended with a note.
+    """
+    succeeded = None  # Whether the run succeeded, for the admission controller. None if it was stopped.
+    # Model text is sent in coalesced chunks. Everything else is sent straight away, after any buffered text.
+    coalescer = ChunkCoalescer()
+
+    async def publish(frame: bytes) -> None:
+        # Waits while the stream is full of frames no connection has been sent
+        await turn.publish(frame, SSE_SLOW_CLIENT_TIMEOUT_SECONDS)
+
+    async def send(frame: bytes) -> None:
+        if text := coalescer.flush():
+            await publish(text)
+        await publish(frame)
+
+    # Create a bounded queue for the events
+    queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=SSE_EVENT_QUEUE_MAX_EVENTS)
+    event_task = asyncio.create_task(_pump_events(events, queue, session_id))
+
+    try:
+        await publish(encode_event({"session_id": session_id}))
+
+        streamed_partial_text = False  # Whether partial text has been sent since the last final response
+        final_msg = ""
+        # Whether the reply had parts other than text and tool calls (e.g. images), which the cache can't hold
+        has_attachments = False
         try:
-            # Create a queue for the events and the heartbeat
-            queue: asyncio.Queue[Any] = asyncio.Queue()
-
-            async def push_events():
+            while True:
+                if deadline and deadline.expired:
+                    succeeded = False  # Too slow, so the instance may be over capacity
+                    deadlines_exceeded.inc()
+                    logger.warning(f"Chat turn for session {session_id} passed its deadline of {deadline.seconds}s")
+                    await send(encode_chunk(f"\n\n_{DEADLINE_EXCEEDED_NOTE}_"))
+                    break
+
+                # Wake up when buffered text is due, or the deadline passes, even if no more events have arrived
+                wait = coalescer.time_until_flush()
+                if deadline:
+                    wait = min(wait, deadline.remaining()) if wait is not None else deadline.remaining()
                 try:
-                    async for event in runner.run_async(
-                        user_id=user_id,
-                        session_id=current_session_id,
-                        new_message=new_message,
-                    ):
-                        await queue.put(event)
-                    await queue.put(None)  # Signal completion
-                except Exception as e:
-                    logger.error(f"Error in runner.run_async: {e}", exc_info=True)
-                    await queue.put(e)
-
-            async def heartbeat():
-                while True:
-                    await asyncio.sleep(15)
-                    await queue.put("heartbeat")
-
-            # Start background tasks
-            event_task = asyncio.create_task(push_events())
-            heartbeat_task = asyncio.create_task(heartbeat())
-
-            try:
-                while True:
-                    item = await queue.get()
-                    if item is None:  # Done
-                        break
-                    if isinstance(item, Exception):
-                        raise item
-                    if item == "heartbeat":
-                        # Send a comment as a heartbeat to keep the connection alive
-                        logger.debug(f"[{datetime.now().isoformat()}] Sending SSE heartbeat")
-                        yield ": heartbeat\n\n"
-                        continue
-
-                    event = item
-                    timestamp = datetime.now().isoformat()
-                    # Debug logging for event type
-                    logger.debug(f"[{timestamp}] Received ADK event: {type(event).__name__}")
-                    yield f"data: {json.dumps({'debug': {'event_type': type(event).__name__, 'ts': timestamp}})}\n\n"
-
-                    if hasattr(event, "finish_reason") and event.finish_reason:
-                        logger.debug(f"Event finish reason: {event.finish_reason}")
-
-                    # Check for tool calls
-                    if function_calls := event.get_function_calls():
-                        for fc in function_calls:
-                            logger.debug(f"Tool Call: {fc.name} Args: {fc.args}")
-                            yield f"data: {json.dumps({'tool_call': {'name': fc.name, 'args': fc.args}})}\n\n"
-
-                    # Check for tool responses
-                    if function_responses := event.get_function_responses():
-                        for fr in function_responses:
-                            logger.debug(f"Tool Response: {fr.name}")
-                            yield f"data: {json.dumps({'tool_response': {'name': fr.name}})}\n\n"
-
-                    # Check for agent transfers
-                    if event.actions and event.actions.transfer_to_agent:
-                        logger.debug(f"Agent Transfer: {event.actions.transfer_to_agent}")
-                        yield f"data: {json.dumps({'agent_transfer': event.actions.transfer_to_agent})}\n\n"
-
-                    # For model responses, we want to stream the chunks
-                    if event.content and event.content.parts:
-                        for part in event.content.parts:
-                            if part.text:
-                                yield f"data: {json.dumps({'chunk': part.text})}\n\n"
-                            elif not (part.function_call or part.function_response):
-                                logger.debug("Received part with no text data.")
-                    else:
-                        logger.debug("Event contained no content parts.")
-
-            finally:
-                heartbeat_task.cancel()
+                    item = await asyncio.wait_for(queue.get(), wait)
+                except TimeoutError:
+                    if text := coalescer.flush():
+                        await publish(text)
+                    continue
+
+                if item is None:  # Done
+                    succeeded = True
+                    if text := coalescer.flush():
+                        await publish(text)
+                    if cache_key and response_cache and not has_attachments:
+                        await response_cache.put(cache_key, final_msg)
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if item == "aborted":
+                    await send(encode_event({"error": "The stream was too slow to keep up, and was stopped"}))
+                    break
+
+                event = item
+                logger.debug(f"Received ADK event: {type(event).__name__}")
+                if send_debug_frames:
+                    debug_info = {"event_type": type(event).__name__, "ts": datetime.now().isoformat()}
+                    await send(encode_event({"debug": debug_info}))
+
+                if hasattr(event, "finish_reason") and event.finish_reason:
+                    logger.debug(f"Event finish reason: {event.finish_reason}")
+
+                # Check for tool calls
+                if function_calls := event.get_function_calls():
+                    for fc in function_calls:
+                        logger.debug(f"Tool Call: {fc.name} Args: {fc.args}")
+                        await send(encode_event({"tool_call": {"name": fc.name, "args": fc.args}}))
+
+                # Check for tool responses
+                if function_responses := event.get_function_responses():
+                    for fr in function_responses:
+                        logger.debug(f"Tool Response: {fr.name}")
+                        await send(encode_event({"tool_response": {"name": fr.name}}))
+
+                # Check for agent transfers
+                if event.actions and event.actions.transfer_to_agent:
+                    logger.debug(f"Agent Transfer: {event.actions.transfer_to_agent}")
+                    await send(encode_event({"agent_transfer": event.actions.transfer_to_agent}))
+
+                # For model responses, we want to stream the chunks
+                if event.content and event.content.parts:
+                    # In SSE streaming mode, text arrives as partial events carrying just the new tokens,
+                    # followed by a final event repeating the whole text. Don't send that text twice.
+                    partial = getattr(event, "partial", None) is True
+                    has_text = any(part.text for part in event.content.parts)
+                    skip_text = has_text and not partial and streamed_partial_text
+                    if has_text:
+                        streamed_partial_text = partial
+
+                    final_response = event.is_final_response()
+                    for part in event.content.parts:
+                        if part.text:
+                            if final_response:
+                                final_msg += part.text
+                            if not skip_text and (frames := coalescer.chunk(part.text)):
+                                await publish(frames)
+                        elif part.inline_data:
+                            has_attachments = True
+                        elif not (part.function_call or part.function_response):
+                            logger.debug("Received part with no text data.")
+                else:
+                    logger.debug("Event contained no content parts.")
+
+        finally:
+            if not event_task.done():
+                event_task.cancel()
                 try:
-                    await heartbeat_task
+                    await event_task
                 except asyncio.CancelledError:
                     pass
-                if not event_task.done():
-                    event_task.cancel()
-                    try:
-                        await event_task
-                    except asyncio.CancelledError:
-                        pass
-
-        except asyncio.CancelledError:
-            logger.info(f"Client disconnected or request cancelled for session: {current_session_id}")
-            raise
-        except Exception as e:
-            logger.error(f"Error in event generator: {e}", exc_info=True)
-            yield f"data: {json.dumps({'error': 'An internal error occurred'})}\n\n"
-
-        yield f"data: {json.dumps({'done': True})}\n\n"
 
+    except StreamStalledException:
+        # Not one connection has kept up, and the stream is full, so stop paying for output nobody is reading
+        aborted_slow_client.inc()
+        logger.warning(f"No client is reading the stream for session {session_id}. Cancelled the agent run.")
+        turn.publish_nowait(encode_event({"error": "The stream was too slow to keep up, and was stopped"}))
+    except asyncio.CancelledError:
+        logger.info(f"Chat turn cancelled for session: {session_id}")
+        raise
+    except Exception as e:
+        succeeded = False
+        logger.error(f"Error in event generator: {e}", exc_info=True)
+        turn.publish_nowait(encode_event({"error": "An internal error occurred"}))
+    finally:
+        if permit:
+            permit.release(succeeded)
+
+    try:
+        if save_artifacts_task:
+            await asyncio.wait([save_artifacts_task])  # Errors are logged by the task itself
+        turn.publish_nowait(DONE_FRAME)
+    finally:
+        turn_streams.finish(turn)
+
+
+async def _replay_cached_turn(turn: TurnStream, session_id: str, reply: str) -> None:
+    """Publish a cached reply to the turn's stream, in pieces, so that it streams like a live reply."""
+    try:
+        await turn.publish(encode_event({"session_id": session_id}), SSE_SLOW_CLIENT_TIMEOUT_SECONDS)
+        for i, piece in enumerate(stream_pieces(reply)):
+            if i:
+                await asyncio.sleep(RESPONSE_CACHE_STREAM_DELAY_MS / 1000)
+            await turn.publish(encode_chunk(piece), SSE_SLOW_CLIENT_TIMEOUT_SECONDS)
+    except StreamStalledException:
+        logger.warning(f"No client is reading the cached reply for session {session_id}. Stopped sending it.")
+    finally:
+        turn.publish_nowait(DONE_FRAME)
+        turn_streams.finish(turn)
+
+
+async def _follow_turn(turn: TurnStream, after_seq: int = 0) -> AsyncGenerator[bytes, None]:
+    """
+    Send the frames of a turn to a connection, starting after after_seq (the Last-Event-ID of a resumed stream),
+    then following the live turn until it finishes. Idle connections are sent heartbeats.
+    """
+    wake: asyncio.Queue[Any] = asyncio.Queue(maxsize=1)
+    seq = after_seq
+    try:
+        with turn.follow(wake), heartbeat_scheduler.register(wake) as heartbeat:
+            while True:
+                for next_seq, frame in turn.frames_after(seq):
+                    yield with_id(format_event_id(turn.turn_id, next_seq), frame)
+                    seq = next_seq
+                    turn.ack(seq)
+                    heartbeat.touch()
+
+                if turn.finished and seq >= turn.last_seq:
+                    break
+
+                if await wake.get() == HEARTBEAT:
+                    # Send a comment as a heartbeat to keep the connection alive
+                    logger.debug(f"[{datetime.now().isoformat()}] Sending SSE heartbeat")
+                    yield HEARTBEAT_FRAME
+    except StreamGoneException as e:
+        logger.warning(f"Connection fell too far behind, and was closed: {e}")
+    finally:
+        if seq < turn.last_seq or not turn.finished:
+            stream_disconnects.inc()
+            logger.info(f"Client disconnected from turn {turn.turn_id}. The turn carries on, and can be resumed.")
+
+
+def _streaming_response(frames: AsyncGenerator[bytes, None]) -> StreamingResponse:
     return StreamingResponse(
-        event_generator(),
+        frames,
         media_type="text/event-stream",
         headers={
             # Prevent caching by browsers and proxies
@@ -463,12 +853,156 @@ async def chat_stream(
         },
     )
 
+
+@app.post("/chat_stream")
+@limiter.limit("5 per minute")
+async def chat_stream(
+    request: Request,
+    prompt: Annotated[str, Form()],
+    session_id: Annotated[str | None, Form()] = None,
+    personality: Annotated[str, Form()] = "Rick",
+    debug: Annotated[bool, Form()] = False,
+    idempotency_key: Annotated[str | None, Form()] = None,
+    last_event_id: Annotated[str | None, Header()] = None,
+    user: AuthUser = Depends(verify_token),
+    files: list[UploadFile] = File(default=[]),
+) -> StreamingResponse:
+    """
+    Streaming chat endpoint to interact with the Rickbot agent.
+
+    Each frame has an `id:`. A client that loses the connection mid-turn can send the same request again,
+    with the last ID it received as the `Last-Event-ID` header, to be sent the rest of that turn
+    rather than starting a new one. If the turn can no longer be resumed, the response is 410 Gone.
+
+    A request sent again with the same `idempotency_key` is sent the first request's turn from the start,
+    rather than running the agent again. If the start of that turn is no longer held, the response is 409.
+    """
+    logger.debug(f"DEBUG: chat_stream ENTERED. user={user.id}, personality={personality}")
+    user_id = user.email  # Use email as user_id for ADK sessions
+
+    if last_event_id:
+        try:
+            turn, after_seq = turn_streams.resume(last_event_id, owner=user_id)
+        except StreamGoneException as e:
+            raise HTTPException(status_code=410, detail="This stream can no longer be resumed") from e
+        logger.debug(f"Resuming turn {turn.turn_id} for {user.email} after frame {after_seq}")
+        stream_resumes.inc()
+        return _streaming_response(_follow_turn(turn, after_seq))
+
+    logger.debug(
+        f"Received chat stream request - "
+        f"Personality: {personality}, User: {user.email}, Session ID: {session_id if session_id else 'None'}"
+    )
+
+    deadline = await _request_deadline(CHAT_STREAM_DEADLINE_SECONDS, personality)
+
+    async def start() -> TurnStream:
+        # A new session has no earlier turns to wait for
+        release_session = await session_locks.acquire((user.email, session_id)) if session_id else None
+        try:
+            turn, task = await _start_stream_turn(prompt, session_id, personality, debug, user, files, deadline)
+        except BaseException:
+            if release_session:
+                release_session()
+            raise
+        if release_session:
+            task.add_done_callback(lambda _: release_session())
+        return turn
+
+    if not idempotency_key:
+        return _streaming_response(_follow_turn(await start()))
+
+    fingerprint = _request_fingerprint(prompt, session_id, personality, files)
+    turn = await _run_once(idempotent_streams, user, idempotency_key, fingerprint, start)
+    try:
+        turn.frames_after(0)
+    except StreamGoneException as e:
+        raise HTTPException(
+            status_code=409, detail="This request was already answered, and its stream can no longer be replayed"
+        ) from e
+    return _streaming_response(_follow_turn(turn))
+
+
+async def _start_stream_turn(
+    prompt: str,
+    session_id: str | None,
+    personality: str,
+    debug: bool,
+    user: AuthUser,
+    files: list[UploadFile],
+    deadline: Deadline,
+) -> tuple[TurnStream, asyncio.Task]:
+    """Start a streaming chat turn in the background. Returns the turn's stream, and the task running it."""
+    user_id = user.email  # Use email as user_id for ADK sessions
+    prepared = await _prepare_turn(prompt, session_id, personality, user, files)
+    current_session_id, agent, new_message, uploads, _ = prepared
+
+    cache_key = _response_cache_key(prepared, prompt)
+    if cache_key and response_cache and (cached := await response_cache.get(cache_key)):
+        logger.debug(f"Serving cached reply for session: {current_session_id}")
+        response_cache_hits.inc()
+        await _record_cached_turn(prepared, cached)
+        turn = turn_streams.start(owner=user_id)
+        replay_task = asyncio.create_task(_replay_cached_turn(turn, current_session_id, cached))
+        _background_tasks.add(replay_task)
+        replay_task.add_done_callback(_background_tasks.discard)
+        return turn, replay_task
+
+    # Get the shared runner for this agent
+    runner = runner_registry.get(agent)
+
+    # Wait for a permit before the turn starts, so that a busy instance can still answer 503
+    permit = await admission_controller.acquire(await _admission_priority(user))
+    try:
+        turn = turn_streams.start(owner=user_id)
+        save_artifacts_task = _start_saving_artifacts(uploads, user_id, current_session_id)
+        events = runner.run_async(
+            user_id=user_id,
+            session_id=current_session_id,
+            new_message=new_message,
+            run_config=STREAMING_RUN_CONFIG,
+        )
+
+        # Per-event debug frames roughly double the frames sent, so are only sent on request
+        send_debug_frames = debug or SSE_DEBUG_FRAMES
+
+        # Run the turn in the background. Connections follow its stream. The tools it calls see the deadline.
+        with deadline_scope(deadline):
+            turn_task = asyncio.create_task(
+                _run_turn(turn, events, current_session_id, send_debug_frames, save_artifacts_task, cache_key, permit, deadline)
+            )
+    except BaseException:
+        # From here on, _run_turn releases the permit. Until then, nothing would.
+        permit.release(None)
+        raise
+    _background_tasks.add(turn_task)
+    turn_task.add_done_callback(_background_tasks.discard)
+    return turn, turn_task
+
+
 @app.get("/")
 def read_root(request: Request):
     """Root endpoint for the API."""
     return {"Hello": "World"}
 
 
+@app.get("/metrics")
+def get_metrics(request: Request) -> dict[str, Any]:
+    """Returns a snapshot of this instance's in-process metrics, e.g. auth cache hits and misses."""
+    return metrics.snapshot()
+
+
+@app.delete("/admin/role_cache/{provider}/{user_id}", status_code=204, dependencies=[Depends(verify_admin_key)])
+def invalidate_role_cache(provider: str, user_id: str) -> Response:
+    """
+    Drops a user's cached role on this instance, e.g. straight after upgrading them to supporter.
+    Role changes are normally picked up automatically; this is for when that notification is delayed or missed.
+    """
+    invalidate_user_role(user_id, provider)
+    logger.info(f"Invalidated cached role for user_id '{user_id}' ({provider})")
+    return Response(status_code=204)
+
+
 @app.get("/artifacts/{filename}")
 async def get_artifact(filename: str, request: Request, user: AuthUser = Depends(verify_token)) -> Response:
     """Retrieves a saved artifact for the user."""
@@ -124,6 +124,60 @@ describe('Chat', () => {
     await waitForBotResponse()
   })
 
+  it('includes X-Auth-Provider header when the session has a provider', async () => {
+    ;(useSession as jest.Mock).mockReturnValue({
+        ...mockSession,
+        data: { ...mockSession.data, idToken: undefined, accessToken: 'gho_token', provider: 'github' }
+    })
+    await renderChatAndWait()
+
+    await waitFor(() => {
+        expect(axios.get).toHaveBeenCalledWith(
+            expect.stringContaining('/personas'),
+            expect.objectContaining({
+                headers: {
+                    Authorization: 'Bearer gho_token',
+                    'X-Auth-Provider': 'github'
+                }
+            })
+        )
+    })
+  })
+
+  it('sends the API session token issued by the backend on subsequent requests', async () => {
+    ;(axios.get as jest.Mock).mockResolvedValueOnce({
+        headers: { 'x-session-token': 'rbs1.k1.payload.sig' },
+        data: [{
+            name: 'Rick',
+            description: 'Rick Sanchez',
+            avatar: '/avatars/rick.png',
+            title: "Test Rickbot Title",
+            overview: "Smartest man",
+            welcome: "Whatever",
+            prompt_question: "What do you want?"
+        }]
+    })
+    await renderChatAndWait()
+
+    const input = screen.getByPlaceholderText('What do you want?')
+    fireEvent.change(input, { target: { value: 'Hi' } })
+    fireEvent.click(screen.getByText('Send'))
+
+    await waitFor(() => {
+        expect(global.fetch).toHaveBeenCalledWith(
+            expect.stringContaining('/chat_stream'),
+            expect.objectContaining({
+                headers: {
+                    Authorization: 'Bearer mock-id-token',
+                    'X-Session-Token': 'rbs1.k1.payload.sig'
+                }
+            })
+        )
+    })
+
+    await waitForBotResponse()
+  })
+
   it('clears messages and session_id when Clear Chat is clicked', async () => {
     await renderChatAndWait()
     
@@ -184,6 +238,61 @@ describe('Chat', () => {
     })
   })
 
+  it('resumes the stream from the last event ID when the connection drops', async () => {
+    const firstRead = jest.fn()
+        .mockResolvedValueOnce({ done: false, value: new TextEncoder().encode('id: turn1:1\ndata: {"chunk": "Wubba lubba "}\n\n') })
+        .mockRejectedValueOnce(new TypeError('network error'))
+    const resumedRead = jest.fn()
+        .mockResolvedValueOnce({ done: false, value: new TextEncoder().encode('id: turn1:2\ndata: {"chunk": "dub dub"}\n\n') })
+        .mockResolvedValueOnce({ done: true })
+
+    ;(global.fetch as jest.Mock)
+        .mockResolvedValueOnce({ status: 200, ok: true, body: { getReader: () => ({ read: firstRead }) } })
+        .mockResolvedValueOnce({ status: 200, ok: true, body: { getReader: () => ({ read: resumedRead }) } })
+
+    await renderChatAndWait()
+    const input = screen.getByPlaceholderText('What do you want?')
+    fireEvent.change(input, { target: { value: 'Hi' } })
+    fireEvent.click(screen.getByText('Send'))
+
+    await waitFor(() => {
+        expect(screen.getByText('Wubba lubba dub dub')).toBeInTheDocument()
+    })
+    expect(global.fetch).toHaveBeenLastCalledWith(
+        expect.stringContaining('/chat_stream'),
+        expect.objectContaining({
+            headers: expect.objectContaining({ 'Last-Event-ID': 'turn1:1' })
+        })
+    )
+  })
+
+  it('submits the message again with the same idempotency key when the stream drops before any event', async () => {
+    const firstRead = jest.fn()
+        .mockRejectedValueOnce(new TypeError('network error'))
+    const resubmittedRead = jest.fn()
+        .mockResolvedValueOnce({ done: false, value: new TextEncoder().encode('id: turn1:1\ndata: {"chunk": "Wubba lubba dub dub"}\n\n') })
+        .mockResolvedValueOnce({ done: true })
+
+    ;(global.fetch as jest.Mock)
+        .mockResolvedValueOnce({ status: 200, ok: true, body: { getReader: () => ({ read: firstRead }) } })
+        .mockResolvedValueOnce({ status: 200, ok: true, body: { getReader: () => ({ read: resubmittedRead }) } })
+
+    await renderChatAndWait()
+    const input = screen.getByPlaceholderText('What do you want?')
+    fireEvent.change(input, { target: { value: 'Hi' } })
+    fireEvent.click(screen.getByText('Send'))
+
+    await waitFor(() => {
+        expect(screen.getByText('Wubba lubba dub dub')).toBeInTheDocument()
+    })
+    const submissions = (global.fetch as jest.Mock).mock.calls
+        .filter(([url]) => String(url).includes('/chat_stream'))
+        .map(([, init]) => (init.body as FormData).get('idempotency_key'))
+    expect(submissions).toHaveLength(2)
+    expect(submissions[0]).toBeTruthy()
+    expect(submissions[1]).toBe(submissions[0])
+  })
+
   it('displays RagAgent status when RagAgent tool_call is received', async () => {
     const readMock = jest.fn()
         .mockResolvedValueOnce({ done: false, value: new TextEncoder().encode('data: {"tool_call": {"name": "RagAgent"}}\n\n') })
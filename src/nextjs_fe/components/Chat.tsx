@@ -28,6 +28,9 @@ import Header from './Header';
 import Thinking from './Thinking';
 import { Personality, Message, ToolCall, ToolResponse } from '../types/chat';
 
+// How many times a dropped /chat_stream connection is resumed before giving up
+const MAX_STREAM_RESUMES = 3;
+
 const initialPersonalities: Personality[] = [
     { 
         name: 'Rick', 
@@ -100,18 +103,41 @@ export default function Chat() {
         scrollToBottom();
     }, [messages, streamingText, botAction]);
 
+    // Short-lived API session token, issued by the backend after it first verifies our provider token.
+    // Tied to the provider token it was issued for, so it is never sent on behalf of a different sign-in.
+    const apiSessionToken = useRef<{ providerToken: string, token: string } | null>(null);
+
+    const providerToken = () => session?.idToken || session?.accessToken || "";
+
+    // Auth headers for API calls. X-Auth-Provider lets the backend send the token straight to the right verifier.
+    const authHeaders = (): Record<string, string> => {
+        const token = providerToken();
+        const headers: Record<string, string> = { Authorization: `Bearer ${token}` };
+        if (session?.provider) {
+            headers['X-Auth-Provider'] = session.provider;
+        }
+        if (apiSessionToken.current?.providerToken === token) {
+            headers['X-Session-Token'] = apiSessionToken.current.token;
+        }
+        return headers;
+    };
+
+    const rememberSessionToken = (issued?: string | null) => {
+        if (issued) {
+            apiSessionToken.current = { providerToken: providerToken(), token: issued };
+        }
+    };
+
     useEffect(() => {
         let isMounted = true;
         let retryTimeout: NodeJS.Timeout;
 
         const fetchPersonalities = async () => {
-            const token = session?.idToken || session?.accessToken || "";
             try {
                 const response = await axios.get(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/personas`, {
-                    headers: {
-                        Authorization: `Bearer ${token}`
-                    }
+                    headers: authHeaders()
                 });
+                rememberSessionToken(response.headers?.['x-session-token']);
                 if (isMounted) {
                     if (response.data && Array.isArray(response.data)) {
                         setPersonalities(response.data);
@@ -149,11 +175,13 @@ export default function Chat() {
     const handleSendMessage = async () => {
         if (!inputValue.trim() && files.length === 0) return;
 
+        const messageId = Date.now().toString();
         const newMessage: Message = {
-            id: Date.now().toString(),
+            id: messageId,
             text: inputValue,
             sender: 'user',
-            attachments: files.length > 0 ? [...files] : []
+            attachments: files.length > 0 ? [...files] : [],
+            idempotencyKey: `${messageId}-${Math.random().toString(36).slice(2)}`
         };
 
         setMessages(prev => [...prev, newMessage]);
@@ -167,27 +195,29 @@ export default function Chat() {
         setTimeout(() => setShowPortal(false), process.env.NODE_ENV === 'test' ? 10 : 1000);
 
         try {
-            const token = session?.idToken || session?.accessToken || "";
-            
             const formData = new FormData();
             formData.append('prompt', newMessage.text);
             formData.append('personality', selectedPersonality.name);
             if (sessionId) {
                 formData.append('session_id', sessionId);
             }
+            // Lets the backend recognise a repeat of this submission, and answer it without running the agent again
+            formData.append('idempotency_key', newMessage.idempotencyKey!);
             if (newMessage.attachments) {
                 newMessage.attachments.forEach(f => {
                     formData.append('files', f);
                 });
             }
 
-            const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/chat_stream`, {
+            const chatStreamUrl = `${process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"}/chat_stream`;
+            // Every submission of this message sends the same form, and so the same idempotency key
+            const submit = () => fetch(chatStreamUrl, {
                 method: 'POST',
-                headers: {
-                    Authorization: `Bearer ${token}`
-                },
+                headers: authHeaders(),
                 body: formData,
             });
+            const response = await submit();
+            rememberSessionToken(response.headers?.get?.('x-session-token'));
 
             if (response.status === 401 || response.status === 403) {
                 if (response.status === 403) {
@@ -211,11 +241,9 @@ export default function Chat() {
 
             if (!response.body) return;
 
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
             let accumulatedText = '';
             let currentSessionId = sessionId;
-            let buffer = '';
+            let lastEventId = null as string | null;  // Assigned in processEvent, so not narrowed to null
 
             const processLine = (line: string) => {
                 if (!line.trim()) return;
@@ -258,26 +286,76 @@ export default function Chat() {
                 }
             };
 
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
+            // Each event is an `id:` line followed by a `data:` line
+            const processEvent = (event: string) => {
+                for (const line of event.split('\n')) {
+                    if (line.startsWith('id: ')) {
+                        lastEventId = line.slice(4);
+                    } else {
+                        processLine(line);
+                    }
+                }
+            };
+
+            const readStream = async (body: ReadableStream<Uint8Array>) => {
+                const reader = body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+
+                    buffer += decoder.decode(value, { stream: true });
 
-                buffer += decoder.decode(value, { stream: true });
-                
-                // Split on double newline (standard SSE delimiter)
-                const parts = buffer.split(/\n\n/);
-                
-                // The last part is either incomplete or empty (if stream ended with \n\n)
-                buffer = parts.pop() || '';
+                    // Split on double newline (standard SSE delimiter)
+                    const parts = buffer.split(/\n\n/);
 
-                for (const part of parts) {
-                     processLine(part);
+                    // The last part is either incomplete or empty (if stream ended with \n\n)
+                    buffer = parts.pop() || '';
+
+                    for (const part of parts) {
+                         processEvent(part);
+                    }
+                }
+
+                // Process any remaining buffer content
+                if (buffer.trim()) {
+                    processEvent(buffer);
+                }
+            };
+
+            // If the connection drops mid-answer, pick up the same turn from the last event received,
+            // rather than asking again
+            let body: ReadableStream<Uint8Array> | null = response.body;
+            for (let resumes = 0; body; resumes++) {
+                try {
+                    await readStream(body);
+                    break;
+                } catch (streamError) {
+                    if (resumes >= MAX_STREAM_RESUMES) throw streamError;
+
+                    let resumed: Response;
+                    if (lastEventId) {
+                        console.warn("Stream interrupted, resuming after event", lastEventId, streamError);
+                        // Files were uploaded with the original request, so aren't sent again
+                        const resumeData = new FormData();
+                        resumeData.append('prompt', newMessage.text);
+                        resumeData.append('personality', selectedPersonality.name);
+                        resumed = await fetch(chatStreamUrl, {
+                            method: 'POST',
+                            headers: { ...authHeaders(), 'Last-Event-ID': lastEventId },
+                            body: resumeData,
+                        });
+                    } else {
+                        // Nothing was received, so submit the message again. With the same idempotency key,
+                        // the backend sends the turn it already started, rather than running the agent again.
+                        console.warn("Stream interrupted before any events, submitting again", streamError);
+                        resumed = await submit();
+                    }
+                    if (!resumed.ok) throw streamError;
+                    body = resumed.body;
                 }
-            }
-            
-            // Process any remaining buffer content
-            if (buffer.trim()) {
-                processLine(buffer);
             }
 
              const botMessage: Message = {
@@ -14,6 +14,7 @@ export interface Message {
     sender: 'user' | 'bot';
     personality?: string;
     attachments?: any[];
+    idempotencyKey?: string;  // Sent with every submission of a user message, so the backend answers it once
 }
 
 export interface ToolCall {
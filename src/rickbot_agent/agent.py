@@ -4,19 +4,24 @@ It initializes a set of Google Gemini-powered agent, each loaded from a specific
 We then cache these agents for fast retrieval.
 """
 
+import asyncio
 import functools
 import os
+import threading
 from textwrap import dedent
 from typing import Any
 
 from google import genai
 from google.adk.agents import Agent
-from google.adk.tools import AgentTool, google_search
+from google.adk.sessions import BaseSessionService
+from google.adk.tools import google_search
 from google.genai.types import GenerateContentConfig
 
 from rickbot_utils.config import config, logger
 
+from .history import HISTORY_POLICY, HistoryCompactor, HistoryPolicy
 from .personality import Personality, get_personalities
+from .tool_guard import GuardedAgentTool
 from .tools_custom import FileSearchTool
 
 client = genai.Client(
@@ -27,6 +32,13 @@ if not client:
     logger.error("Could not initialize GenAI client.")
     raise ValueError("Could not initialize GenAI client.")
 
+# The history compactor of every agent created, so that their pending summaries can be saved on shutdown
+_history_compactors: list[HistoryCompactor] = []
+# functools.cache doesn't stop concurrent first calls from each creating the agent, so creation is serialised per
+# personality. (A second agent would register a second compactor, and be given a runner of its own.)
+_agent_locks: dict[str, threading.Lock] = {}
+_agent_locks_lock = threading.Lock()
+
 
 @functools.cache
 def get_store(store_name: str):
@@ -115,7 +127,7 @@ def create_agent(personality: Personality) -> Agent:
             personality.file_search_description
         )
         if rag_agent:
-            tools.append(AgentTool(agent=rag_agent))
+            tools.append(GuardedAgentTool(agent=rag_agent))
             logger.debug(f"Added {rag_agent.name}")
 
             kb_topic = personality.file_search_description or "reference materials"
@@ -150,7 +162,11 @@ def create_agent(personality: Personality) -> Agent:
     instruction += f"""{personality.system_instruction}"""
 
     # SearchAgent is always added as a fallback
-    tools.append(AgentTool(agent=search_agent))
+    tools.append(GuardedAgentTool(agent=search_agent))
+
+    # Trims the session history sent with each model request, so long conversations don't grow without limit
+    history_compactor = HistoryCompactor(HistoryPolicy(personality.history_policy or HISTORY_POLICY))
+    _history_compactors.append(history_compactor)
 
     return Agent(
         name=f"{config.agent_name}_{personality.name}",  # Make agent name unique
@@ -158,7 +174,8 @@ def create_agent(personality: Personality) -> Agent:
         model=config.model,
         instruction=instruction,
         tools=tools,
-        generate_content_config=GenerateContentConfig(temperature=personality.temperature, top_p=1, max_output_tokens=8192)
+        generate_content_config=GenerateContentConfig(temperature=personality.temperature, top_p=1, max_output_tokens=8192),
+        before_model_callback=history_compactor.before_model,
     )
 
 
@@ -186,8 +203,16 @@ def get_agent(personality_name: str) -> Agent:
         if not personality:
             raise ValueError("Default 'Rick' personality not found. Cannot initialize agent.")
 
-    # Call the cached helper function
-    return _get_cached_agent_for_personality(personality)
+    with _agent_locks_lock:
+        agent_lock = _agent_locks.setdefault(personality.name, threading.Lock())
+    # Call the cached helper function. Once the agent is cached, the lock is only held while it is looked up.
+    with agent_lock:
+        return _get_cached_agent_for_personality(personality)
+
+
+async def save_pending_summaries(session_service: BaseSessionService) -> None:
+    """Wait for the history summaries being written by every agent, and save them to their sessions."""
+    await asyncio.gather(*(compactor.drain(session_service) for compactor in _history_compactors))
 
 
 # For backwards compatibility or direct access if needed, though get_agent is preferred.
@@ -1,87 +1,178 @@
+import asyncio
+import hashlib
+import hmac
 import os
+import re
+import time
+from typing import NamedTuple
 
-import requests
-from fastapi import Depends, HTTPException, Request
+from fastapi import Depends, Header, HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from google.auth.transport import requests as google_requests
-from google.oauth2 import id_token
 
+from rickbot_agent.auth_github import GitHubTokenRejected, get_github_verifier
+from rickbot_agent.auth_google import get_google_verifier
 from rickbot_agent.auth_models import AuthUser
 from rickbot_utils.config import logger
+from rickbot_utils.ttl_cache import TTLCache
 
 security = HTTPBearer()
 
+# Credential cache settings.
+# Google ID tokens are cached until their own expiry. GitHub access tokens carry no expiry,
+# so we cache them for a fixed period; a revoked GitHub token may be honoured for up to this long.
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_GITHUB_TTL_SECONDS = float(os.getenv("AUTH_CACHE_GITHUB_TTL_SECONDS", "300"))
+AUTH_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL_SECONDS", "30"))
 
-def verify_credentials(token: str) -> AuthUser | None:
+
+# Prefixes of GitHub's current token formats: OAuth, personal, user-to-server, server-to-server, refresh, fine-grained
+GITHUB_TOKEN_PREFIXES = ("gho_", "ghp_", "ghu_", "ghs_", "ghr_", "github_pat_")
+_LEGACY_GITHUB_TOKEN_PATTERN = re.compile(r"[0-9a-f]{40}")
+_JWT_PATTERN = re.compile(r"[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+")
+
+
+class VerificationResult(NamedTuple):
+    """The outcome of verifying a token, and how long (in seconds) that outcome may be cached for."""
+
+    user: AuthUser | None
+    ttl: float
+
+
+# Keyed by a hash of the token, so raw tokens are never held in the cache
+credential_cache: TTLCache[str, VerificationResult] = TTLCache("auth_cache", max_entries=AUTH_CACHE_MAX_ENTRIES)
+
+
+def _verify_mock_token(token: str) -> AuthUser | None:
+    """Verifies a development-only mock token. Format: mock:id:email:name"""
+    allow_mock = os.getenv("BACKEND_ALLOW_MOCK_AUTH")
+    if allow_mock != "true":
+        logger.warning(f"Mock auth failed. ALLOW_MOCK={allow_mock}")
+        return None
+
+    try:
+        parts = token.split(":")
+        if len(parts) < 4:
+            logger.warning(f"Mock token malformed: {token}")
+            return None
+
+        return AuthUser(id=parts[1], email=parts[2], name=parts[3], provider="mock")
+    except Exception as e:
+        logger.error(f"Mock auth exception: {e}")
+        return None
+
+
+def _verify_google_token(token: str) -> VerificationResult:
+    """Verifies a Google ID token issued for our client."""
+    try:
+        verifier = get_google_verifier()
+        if verifier:
+            idinfo = verifier.verify(token)
+            user = AuthUser(
+                id=idinfo["sub"], email=idinfo["email"], name=idinfo.get("name", idinfo["email"]), provider="google"
+            )
+            return VerificationResult(user, idinfo["exp"] - time.time())
+    except ValueError:
+        # Malformed, forged, expired or issued for someone else
+        return VerificationResult(None, AUTH_CACHE_NEGATIVE_TTL_SECONDS)
+    except Exception as e:
+        logger.error(f"Error verifying Google token: {e}")
+
+    return VerificationResult(None, 0)
+
+
+async def _verify_github_token(token: str) -> VerificationResult:
+    """Verifies a GitHub access token by asking GitHub who it belongs to."""
+    try:
+        user = await get_github_verifier().get_user(token)
+        return VerificationResult(user, AUTH_CACHE_GITHUB_TTL_SECONDS)
+    except GitHubTokenRejected:
+        return VerificationResult(None, AUTH_CACHE_NEGATIVE_TTL_SECONDS)
+    except Exception as e:
+        # Timeouts, rate limiting and outages may be transient, so don't cache them
+        logger.error(f"Error verifying GitHub token: {e!r}")
+        return VerificationResult(None, 0)
+
+
+async def _verify(token: str, provider: str) -> VerificationResult:
+    """Verifies the token with the given provider only."""
+    if provider == "mock":
+        # Cheap to parse, so never cached
+        return VerificationResult(_verify_mock_token(token), 0)
+
+    if provider == "google":
+        # Normally CPU-only, but may need to fetch certs on a cold start, so keep it off the event loop.
+        return await asyncio.to_thread(_verify_google_token, token)
+
+    if provider == "github":
+        return await _verify_github_token(token)
+
+    return VerificationResult(None, 0)
+
+
+def classify_token(token: str, provider_hint: str | None = None) -> str | None:
+    """
+    Work out which provider issued a token, so that it is only sent to that provider's verifier.
+
+    Google ID tokens are JWTs, whereas GitHub access tokens are opaque strings with well-known prefixes.
+    The optional provider hint (the frontend's X-Auth-Provider header) is only used for tokens whose shape
+    doesn't tell us, e.g. a GitHub token in a format we don't recognise.
+    Returns None if the token can't belong to any provider, so it can be rejected without any further work.
+    """
+    if token.startswith("mock:"):
+        return "mock"
+    if _JWT_PATTERN.fullmatch(token):
+        return "google"
+    if token.startswith(GITHUB_TOKEN_PREFIXES) or _LEGACY_GITHUB_TOKEN_PATTERN.fullmatch(token):
+        return "github"
+    if provider_hint == "github":
+        return "github"
+
+    return None
+
+
+async def verify_credentials(token: str, provider_hint: str | None = None) -> AuthUser | None:
     """
     Verifies the authentication token and returns an AuthUser object or None if invalid.
     """
     if not token or token == "undefined":
         return None
 
-    user = None
+    provider = classify_token(token, provider_hint)
+    if not provider:
+        return None
 
-    # 1. Check for Mock Token (Development Only)
-    if token.startswith("mock:"):
-        allow_mock = os.getenv("BACKEND_ALLOW_MOCK_AUTH")
-        if allow_mock != "true":
-            logger.warning(f"Mock auth failed. ALLOW_MOCK={allow_mock}")
-            return None
+    return (await _verify(token, provider)).user
 
-        try:
-            # Format: mock:id:email:name
-            parts = token.split(":")
-            if len(parts) < 4:
-                logger.warning(f"Mock token malformed: {token}")
-                return None
 
-            user = AuthUser(id=parts[1], email=parts[2], name=parts[3], provider="mock")
-        except Exception as e:
-            logger.error(f"Mock auth exception: {e}")
-            return None
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
 
-    # 2. Try Google ID Token Verification
-    if not user:
-        try:
-            google_client_id = os.getenv("GOOGLE_CLIENT_ID")
-            if google_client_id:
-                idinfo = id_token.verify_oauth2_token(
-                    token, google_requests.Request(), google_client_id, clock_skew_in_seconds=10
-                )
-                user = AuthUser(
-                    id=idinfo["sub"], email=idinfo["email"], name=idinfo.get("name", idinfo["email"]), provider="google"
-                )
-        except ValueError:
-            pass
-        except Exception as e:
-            logger.error(f"Error verifying Google token: {e}")
-
-    # 3. Try GitHub Access Token Verification
-    if not user:
-        try:
-            github_response = requests.get("https://api.github.com/user", headers={"Authorization": f"token {token}"}, timeout=5)
-            if github_response.status_code == 200:
-                user_data = github_response.json()
-                email = user_data.get("email")
-                if not email:
-                    emails_resp = requests.get(
-                        "https://api.github.com/user/emails", headers={"Authorization": f"token {token}"}, timeout=5
-                    )
-                    if emails_resp.status_code == 200:
-                        emails = emails_resp.json()
-                        primary_email = next((e["email"] for e in emails if e["primary"]), emails[0]["email"] if emails else None)
-                        email = primary_email
-
-                user = AuthUser(
-                    id=str(user_data["id"]),
-                    email=email or f"{user_data['login']}@github.com",
-                    name=user_data.get("name") or user_data["login"],
-                    provider="github",
-                )
-        except Exception as e:
-            logger.error(f"Error verifying GitHub token: {e}")
-
-    return user
+
+async def authenticate(token: str, provider: str | None = None) -> AuthUser | None:
+    """
+    Cached front for verify_credentials(), used on the request path.
+
+    Successful verifications are cached until the token expires (Google) or for AUTH_CACHE_GITHUB_TTL_SECONDS (GitHub).
+    Rejected tokens are cached for AUTH_CACHE_NEGATIVE_TTL_SECONDS.
+    Concurrent requests with the same uncached token share a single verification.
+
+    Args:
+        token: The bearer token.
+        provider: The provider, as returned by classify_token(). Classified here if not supplied.
+    """
+    if not token or token == "undefined":
+        return None
+
+    provider = provider or classify_token(token)
+    if not provider:
+        return None
+
+    result = await credential_cache.get_or_load(
+        _token_cache_key(token),
+        lambda: _verify(token, provider),
+        ttl=lambda r: r.ttl,
+    )
+    return result.user
 
 
 async def verify_token(request: Request, creds: HTTPAuthorizationCredentials = Depends(security)) -> AuthUser:
@@ -94,3 +185,16 @@ async def verify_token(request: Request, creds: HTTPAuthorizationCredentials = D
         return user
 
     raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+
+
+async def verify_admin_key(x_admin_key: str | None = Header(default=None)) -> None:
+    """
+    Dependency that restricts an endpoint to administrators, who must send the ADMIN_API_KEY in an X-Admin-Key header.
+    Admin endpoints are disabled if ADMIN_API_KEY is not set.
+    """
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    if not x_admin_key or not hmac.compare_digest(x_admin_key.encode(), admin_key.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
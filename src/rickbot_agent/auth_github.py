@@ -0,0 +1,117 @@
+"""
+Non-blocking verification of GitHub access tokens.
+
+GitHub tokens are opaque, so the only way to verify one is to ask GitHub who it belongs to.
+We do that with a shared async HTTP client, so calls reuse pooled keep-alive connections and never block
+the event loop, and every call has a hard deadline so a slow GitHub can't stall in-flight requests.
+A user's primary email rarely changes, so the extra `/user/emails` lookup is made once per user and cached.
+"""
+
+import asyncio
+from functools import cache
+from os import getenv
+
+import httpx
+
+from rickbot_agent.auth_models import AuthUser
+from rickbot_utils.config import logger
+from rickbot_utils.ttl_cache import TTLCache
+
+GITHUB_API_URL = getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_TIMEOUT_SECONDS = float(getenv("GITHUB_TIMEOUT_SECONDS", "3"))
+GITHUB_EMAIL_CACHE_TTL_SECONDS = float(getenv("GITHUB_EMAIL_CACHE_TTL_SECONDS", "86400"))
+GITHUB_MAX_CONNECTIONS = int(getenv("GITHUB_MAX_CONNECTIONS", "50"))
+
+
+class GitHubTokenRejected(Exception):
+    """Raised when GitHub definitively rejects a token (as opposed to a transient failure)."""
+
+
+class GitHubTokenVerifier:
+    """Resolves GitHub access tokens to users, using a shared pool of keep-alive connections."""
+
+    def __init__(
+        self,
+        base_url: str = GITHUB_API_URL,
+        timeout: float = GITHUB_TIMEOUT_SECONDS,
+        email_cache_ttl: float = GITHUB_EMAIL_CACHE_TTL_SECONDS,
+    ):
+        """
+        Args:
+            base_url: The GitHub REST API root. Overridable, so tests can point at a stub server.
+            timeout: The deadline, in seconds, for each call to GitHub.
+            email_cache_ttl: How long to cache each user's primary email.
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.email_cache_ttl = email_cache_ttl
+        self._client: httpx.AsyncClient | None = None
+        self._emails: TTLCache[str, str | None] = TTLCache("github_email_cache", max_entries=10000)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared HTTP client, created on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                headers={"Accept": "application/vnd.github+json"},
+                limits=httpx.Limits(max_connections=GITHUB_MAX_CONNECTIONS, max_keepalive_connections=GITHUB_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, path: str, token: str) -> httpx.Response:
+        # httpx timeouts apply per network operation; asyncio.timeout gives us an overall deadline per call
+        async with asyncio.timeout(self.timeout):
+            return await self.client.get(path, headers={"Authorization": f"token {token}"})
+
+    async def _fetch_primary_email(self, token: str) -> str | None:
+        response = await self._get("/user/emails", token)
+        if response.status_code != 200:
+            return None
+
+        emails = response.json()
+        return next((e["email"] for e in emails if e["primary"]), emails[0]["email"] if emails else None)
+
+    async def get_user(self, token: str) -> AuthUser:
+        """
+        Return the user that owns the token.
+
+        Raises:
+            GitHubTokenRejected: If GitHub rejects the token.
+            httpx.HTTPError, TimeoutError: If GitHub could not be reached in time, or returned an unexpected response.
+        """
+        response = await self._get("/user", token)
+        if response.status_code == 401:
+            raise GitHubTokenRejected()
+        response.raise_for_status()
+
+        user_data = response.json()
+        user_id = str(user_data["id"])
+        email = user_data.get("email")
+        if not email:
+            email = await self._emails.get_or_load(
+                user_id,
+                lambda: self._fetch_primary_email(token),
+                ttl=lambda e: self.email_cache_ttl if e else 0,
+            )
+
+        logger.debug(f"Verified GitHub token for user {user_data['login']}")
+        return AuthUser(
+            id=user_id,
+            email=email or f"{user_data['login']}@github.com",
+            name=user_data.get("name") or user_data["login"],
+            provider="github",
+        )
+
+
+@cache
+def get_github_verifier() -> GitHubTokenVerifier:
+    """Return the shared GitHub token verifier."""
+    return GitHubTokenVerifier()
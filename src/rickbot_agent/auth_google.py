@@ -0,0 +1,128 @@
+"""
+Local verification of Google ID tokens.
+
+`google.oauth2.id_token.verify_oauth2_token()` downloads Google's signing certificates on every call.
+Instead, we hold the certificates in memory, refresh them in the background as their Cache-Control max-age
+runs out, and check the token's signature, audience, issuer and expiry locally.
+In the steady state, verifying a Google token therefore needs no network call at all.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from collections.abc import Callable
+from functools import cache
+from os import getenv
+from typing import Any
+
+import requests
+from google.auth import jwt
+
+from rickbot_utils.config import logger
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+DEFAULT_CERTS_MAX_AGE_SECONDS = 3600  # Used if Google doesn't send a max-age
+CERTS_REFRESH_MARGIN_SECONDS = 300  # Refresh this long before the certs expire
+CERTS_MIN_REFRESH_INTERVAL_SECONDS = 60  # Limits forced refreshes caused by unknown key IDs
+CLOCK_SKEW_SECONDS = 10
+
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+# Returns a mapping of key ID to PEM certificate, and how many seconds the mapping may be cached for
+CertsFetcher = Callable[[], tuple[dict[str, str], float]]
+
+_http = requests.Session()  # Reuse connections across refreshes
+
+
+def fetch_google_certs() -> tuple[dict[str, str], float]:
+    """Fetch Google's current ID-token signing certificates."""
+    response = _http.get(GOOGLE_CERTS_URL, timeout=5)
+    response.raise_for_status()
+
+    match = _MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+    max_age = float(match.group(1)) if match else DEFAULT_CERTS_MAX_AGE_SECONDS
+    return response.json(), max_age
+
+
+class GoogleTokenVerifier:
+    """Verifies Google ID tokens against an in-memory copy of Google's signing certificates."""
+
+    def __init__(self, client_id: str, fetch_certs: CertsFetcher = fetch_google_certs, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            client_id: Our OAuth client ID. Tokens must have been issued for this audience.
+            fetch_certs: Retrieves the signing certificates. Overridable, so tests can supply a local key set.
+            clock: Returns the current time in seconds.
+        """
+        self.client_id = client_id
+        self._fetch_certs = fetch_certs
+        self._clock = clock
+        self._certs: dict[str, str] = {}
+        self._expires_at = 0.0
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def seconds_until_refresh(self) -> float:
+        """How long until the certs should next be refreshed."""
+        return max(0.0, self._expires_at - CERTS_REFRESH_MARGIN_SECONDS - self._clock())
+
+    def refresh(self) -> None:
+        """Fetch the latest certificates. Blocking, so call from a worker thread when on the event loop."""
+        with self._refresh_lock:
+            certs, max_age = self._fetch_certs()
+            now = self._clock()
+            self._certs = certs
+            self._expires_at = now + max_age
+            self._last_refresh = now
+            logger.debug(f"Refreshed Google signing certs. Key IDs: {list(certs)}. Max age: {max_age}s")
+
+    def _ensure_certs_for(self, key_id: str | None) -> None:
+        """Load the certs if we have none, or if the token was signed with a key we haven't seen (key rotation)."""
+        if not self._certs or self._expires_at <= self._clock():
+            self.refresh()
+        elif key_id and key_id not in self._certs:
+            if self._clock() - self._last_refresh >= CERTS_MIN_REFRESH_INTERVAL_SECONDS:
+                logger.info(f"Unknown Google key ID '{key_id}'. Refreshing certs.")
+                self.refresh()
+
+    def verify(self, token: str) -> dict[str, Any]:
+        """
+        Verify a Google ID token and return its claims.
+
+        Raises:
+            ValueError: If the token is malformed, has an invalid signature, or has the wrong audience, issuer or expiry.
+        """
+        header = jwt.decode_header(token)
+        self._ensure_certs_for(header.get("kid"))
+
+        claims = jwt.decode(token, certs=self._certs, audience=self.client_id, clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+
+        return claims
+
+    async def run_refresh_loop(self) -> None:
+        """Keep the certs fresh in the background, so that refreshes never land on the request path."""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                delay = self.seconds_until_refresh
+            except Exception as e:
+                logger.error(f"Failed to refresh Google signing certs: {e}")
+                delay = CERTS_MIN_REFRESH_INTERVAL_SECONDS
+
+            await asyncio.sleep(max(delay, CERTS_MIN_REFRESH_INTERVAL_SECONDS))
+
+
+@cache
+def get_google_verifier() -> GoogleTokenVerifier | None:
+    """Return the Google token verifier, or None if Google sign-in is not configured."""
+    client_id = getenv("GOOGLE_CLIENT_ID")
+    if not client_id:
+        return None
+
+    return GoogleTokenVerifier(client_id)
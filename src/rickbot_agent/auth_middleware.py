@@ -1,14 +1,24 @@
+import time
+
+from starlette.datastructures import MutableHeaders
 from starlette.requests import Request
-from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from rickbot_agent.auth import verify_credentials
+from rickbot_agent.auth import authenticate, classify_token
+from rickbot_agent.auth_session import SESSION_TOKEN_HEADER, get_session_signer
 from rickbot_utils.config import logger
+from rickbot_utils.metrics import metrics
 
 
 class AuthMiddleware:
     """
     Passive authentication middleware using ASGI interface.
     Sets 'user' in scope if token is valid.
+
+    A valid API session token (X-Session-Token) is checked first, since it needs no call to an identity provider.
+    If the request also has a bearer token, the session token is only accepted if it was issued for that bearer token.
+    Otherwise the bearer token is verified with its provider, and a fresh session token is returned
+    in the X-Session-Token response header for the client to send on subsequent requests.
     """
     def __init__(self, app: ASGIApp):
         self.app = app
@@ -19,15 +29,49 @@ class AuthMiddleware:
             return
 
         request = Request(scope)
+        signer = get_session_signer()
+        issue_session_token = False
+
         auth_header = request.headers.get("Authorization")
+        bearer_token = auth_header.split(" ")[1] if auth_header and auth_header.startswith("Bearer ") else None
+
+        if signer and (session_token := request.headers.get(SESSION_TOKEN_HEADER)):
+            started = time.perf_counter()
+            # A session token issued for a different bearer token is ignored, and the bearer token verified instead
+            if verified := signer.verify(session_token, bearer_token):
+                user, expires_at = verified
+                scope["user"] = user
+                issue_session_token = signer.needs_renewal(expires_at)
+            metrics.histogram("auth.verify_seconds.session").observe(time.perf_counter() - started)
 
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            try:
-                user = verify_credentials(token)
-                if user:
-                    scope["user"] = user
-            except Exception as e:
-                logger.error(f"AuthMiddleware: Token verification failed: {e}")
+        if "user" not in scope and bearer_token:
+            token = bearer_token
+            # Route the token straight to the one provider that could have issued it.
+            # Tokens that can't belong to any provider are rejected without further work.
+            provider = classify_token(token, request.headers.get("X-Auth-Provider"))
+            if provider:
+                started = time.perf_counter()
+                try:
+                    user = await authenticate(token, provider)
+                    if user:
+                        scope["user"] = user
+                        issue_session_token = signer is not None
+                except Exception as e:
+                    logger.error(f"AuthMiddleware: Token verification failed: {e}")
+                finally:
+                    metrics.histogram(f"auth.verify_seconds.{provider}").observe(time.perf_counter() - started)
+            else:
+                metrics.counter("auth.unclassified_tokens").inc()
+
+        if signer and issue_session_token:
+            new_session_token = signer.issue(scope["user"], bearer_token)
+
+            async def send_with_session_token(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message)[SESSION_TOKEN_HEADER] = new_session_token
+                await send(message)
+
+            await self.app(scope, receive, send_with_session_token)
+            return
 
         await self.app(scope, receive, send)
@@ -0,0 +1,145 @@
+"""
+Short-lived, HMAC-signed session tokens issued by the API.
+
+Once a user's Google or GitHub token has been verified, the API returns a session token carrying the AuthUser fields
+in the `X-Session-Token` response header. The frontend sends it back on later requests, and AuthMiddleware validates it
+with a local HMAC check, taking the identity providers off the per-request critical path entirely.
+
+Token format: `rbs1.<key_id>.<base64url(json claims)>.<base64url(hmac-sha256)>`
+
+A session token is bound to the provider token it was issued in exchange for. A request carrying both is only
+authenticated by the session token if they match, so a session token can't be paired with another user's bearer token.
+
+Signing keys are configured as `SESSION_TOKEN_KEYS="<key_id>:<secret>,<key_id>:<secret>,..."`.
+The first key signs new tokens; all listed keys are accepted, so a key can be rotated out by adding a new key
+at the front of the list and removing the old one once its tokens have expired.
+If no keys are configured, session tokens are disabled.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from collections.abc import Callable
+from functools import cache
+from os import getenv
+
+from rickbot_agent.auth_models import AuthUser
+from rickbot_utils.config import logger
+
+SESSION_TOKEN_HEADER = "X-Session-Token"
+SESSION_TOKEN_VERSION = "rbs1"
+SESSION_TOKEN_TTL_SECONDS = int(getenv("SESSION_TOKEN_TTL_SECONDS", "900"))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _token_binding(bearer_token: str) -> str:
+    """A short digest of a provider token, so a session token can be bound to it without carrying it."""
+    return _b64encode(hashlib.sha256(bearer_token.encode()).digest()[:16])
+
+
+def parse_session_keys(raw: str) -> dict[str, bytes]:
+    """Parse `key_id:secret` pairs, preserving their order."""
+    keys: dict[str, bytes] = {}
+    for entry in raw.split(","):
+        key_id, _, secret = entry.strip().partition(":")
+        if not key_id or not secret or "." in key_id:
+            if entry.strip():
+                logger.error("Ignoring malformed SESSION_TOKEN_KEYS entry (expected '<key_id>:<secret>').")
+            continue
+        keys[key_id] = secret.encode()
+    return keys
+
+
+class SessionTokenSigner:
+    """Issues and validates session tokens."""
+
+    def __init__(self, keys: dict[str, bytes], ttl: int = SESSION_TOKEN_TTL_SECONDS, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            keys: Signing keys by key ID. The first key is used to sign; all are accepted.
+            ttl: Lifetime of issued tokens, in seconds.
+            clock: Returns the current time in seconds.
+        """
+        if not keys:
+            raise ValueError("At least one session token key is required.")
+
+        self.keys = keys
+        self.active_key_id = next(iter(keys))
+        self.ttl = ttl
+        self._clock = clock
+
+    def _sign(self, key_id: str, signing_input: str) -> str:
+        return _b64encode(hmac.new(self.keys[key_id], signing_input.encode(), hashlib.sha256).digest())
+
+    def issue(self, user: AuthUser, bearer_token: str | None = None) -> str:
+        """Return a new session token for the user, bound to the provider token it was issued for, if given."""
+        now = int(self._clock())
+        claims = {
+            "sub": user.id,
+            "email": user.email,
+            "name": user.name,
+            "provider": user.provider,
+            "iat": now,
+            "exp": now + self.ttl,
+        }
+        if bearer_token:
+            claims["tbh"] = _token_binding(bearer_token)
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        signing_input = f"{SESSION_TOKEN_VERSION}.{self.active_key_id}.{payload}"
+        return f"{signing_input}.{self._sign(self.active_key_id, signing_input)}"
+
+    def verify(self, token: str, bearer_token: str | None = None) -> tuple[AuthUser, int] | None:
+        """
+        Validate a session token.
+
+        Args:
+            token: The session token.
+            bearer_token: The provider token sent with it, if any. The session token must have been issued for it.
+
+        Returns:
+            The user and the token's expiry time, or None if the token is malformed, forged, signed with an unknown key,
+            expired, or was issued for a different provider token than the one sent with it.
+        """
+        try:
+            version, key_id, payload, signature = token.split(".")
+            if version != SESSION_TOKEN_VERSION or key_id not in self.keys:
+                return None
+
+            expected = self._sign(key_id, f"{version}.{key_id}.{payload}")
+            if not hmac.compare_digest(signature, expected):
+                return None
+
+            claims = json.loads(_b64decode(payload))
+            if claims["exp"] <= self._clock():
+                return None
+            if bearer_token and not hmac.compare_digest(claims.get("tbh", ""), _token_binding(bearer_token)):
+                return None
+
+            user = AuthUser(id=claims["sub"], email=claims["email"], name=claims["name"], provider=claims["provider"])
+            return user, claims["exp"]
+        except Exception:
+            return None
+
+    def needs_renewal(self, expires_at: int) -> bool:
+        """Whether a token is past half its lifetime, and should be replaced with a fresh one."""
+        return expires_at - self._clock() < self.ttl / 2
+
+
+@cache
+def get_session_signer() -> SessionTokenSigner | None:
+    """Return the session token signer, or None if session tokens are not configured."""
+    keys = parse_session_keys(getenv("SESSION_TOKEN_KEYS", ""))
+    if not keys:
+        logger.info("SESSION_TOKEN_KEYS not set. API session tokens are disabled.")
+        return None
+
+    return SessionTokenSigner(keys)
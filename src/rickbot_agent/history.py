@@ -0,0 +1,262 @@
+"""
+Session history compaction.
+
+Every turn sends the session's whole history to the model, so without a limit, long conversations get steadily
+slower and more expensive. Each persona agent has a HistoryCompactor as its before-model callback, which trims
+the history sent in each model request (the session itself keeps every event), with one of two policies:
+- WINDOW: send only the last HISTORY_MAX_TURNS turns.
+- SUMMARY: once the earlier turns not yet summarised come to more than HISTORY_SUMMARY_THRESHOLD_TOKENS, fold all
+  but the last HISTORY_SUMMARY_KEEP_TURNS of them into a rolling summary. The summary is written in the background,
+  so no turn waits for it, and is saved to the session's state by the session's next model request
+  (or on shutdown, by drain()).
+  Requests send the summary, in the system instruction, followed by the turns after it.
+  HISTORY_MAX_TURNS still applies, as a backstop while a summary is being written.
+
+The policy is set per persona, with `history_policy` in personalities.yaml, defaulting to HISTORY_POLICY.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Sequence
+from enum import StrEnum
+from os import getenv
+from textwrap import dedent
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import new_invocation_context_id
+from google.adk.events import Event, EventActions
+from google.adk.models import LlmRequest
+from google.adk.sessions import BaseSessionService
+from google.genai.types import Content
+
+from rickbot_utils.config import config, logger
+from rickbot_utils.metrics import metrics
+from rickbot_utils.ttl_cache import TTLCache
+
+# The policy for personas that don't set their own: "window" or "summary"
+HISTORY_POLICY = getenv("HISTORY_POLICY", "window")
+# The most turns sent to the model, under either policy
+HISTORY_MAX_TURNS = int(getenv("HISTORY_MAX_TURNS", "20"))
+# Under the summary policy, earlier turns are summarised once they come to more than this many tokens
+HISTORY_SUMMARY_THRESHOLD_TOKENS = int(getenv("HISTORY_SUMMARY_THRESHOLD_TOKENS", "4000"))
+# Under the summary policy, the most recent turns are always sent as they are, rather than summarised
+HISTORY_SUMMARY_KEEP_TURNS = int(getenv("HISTORY_SUMMARY_KEEP_TURNS", "4"))
+HISTORY_SUMMARY_MODEL = getenv("HISTORY_SUMMARY_MODEL", config.model)
+
+# Where the summary, and the number of turns it covers, are kept in the session's state
+SUMMARY_STATE_KEY = "history:summary"
+SUMMARIZED_TURNS_STATE_KEY = "history:summarized_turns"
+
+# A rough estimate, so that history can be measured without calling the model's token counter
+_CHARS_PER_TOKEN = 4
+# Roughly what Gemini charges for an image
+_INLINE_DATA_TOKENS = 258
+_SUMMARY_MAX_OUTPUT_TOKENS = 1024
+_REQUEST_TOKEN_BUCKETS = (500.0, 1000.0, 2000.0, 4000.0, 8000.0, 16000.0, 32000.0, 64000.0)
+# How long a finished summary waits for its session's next model request to save it
+_PENDING_SUMMARY_TTL_SECONDS = 3600
+
+# Returns a summary of the turns, folded into the previous summary, if there is one
+Summarizer = Callable[[str | None, Sequence[Content]], Awaitable[str]]
+# (app name, user ID, session ID): session IDs are only unique per app and user
+SessionKey = tuple[str, str, str]
+
+
+class HistoryPolicy(StrEnum):
+    WINDOW = "window"
+    SUMMARY = "summary"
+
+
+def estimate_tokens(contents: Sequence[Content]) -> int:
+    """Estimate the tokens the contents would take up in a model request."""
+    chars = 0
+    tokens = 0
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                chars += len(part.text)
+            elif part.function_call:
+                chars += len(part.function_call.name or "") + len(str(part.function_call.args))
+            elif part.function_response:
+                chars += len(part.function_response.name or "") + len(str(part.function_response.response))
+            elif part.inline_data:
+                tokens += _INLINE_DATA_TOKENS
+    return tokens + chars // _CHARS_PER_TOKEN
+
+
+def split_turns(contents: Sequence[Content]) -> list[list[Content]]:
+    """
+    Split the contents of a model request into turns. Each turn starts with a user message, and runs up to the next,
+    including the tool calls and responses in between. (Tool responses also have the user role, but no text.)
+    """
+    turns: list[list[Content]] = []
+    for content in contents:
+        starts_turn = content.role == "user" and any(part.text or part.inline_data for part in content.parts or [])
+        if starts_turn or not turns:
+            turns.append([content])
+        else:
+            turns[-1].append(content)
+    return turns
+
+
+def _transcript(contents: Sequence[Content]) -> str:
+    lines = []
+    for content in contents:
+        text = "".join(part.text for part in content.parts or [] if part.text)
+        if text:
+            lines.append(f"{content.role}: {text}")
+    return "\n".join(lines)
+
+
+def genai_summarizer(model: str = HISTORY_SUMMARY_MODEL) -> Summarizer:
+    """A Summarizer that calls a Gemini model. The client is created on first use."""
+    client = None
+
+    async def summarize(summary: str | None, contents: Sequence[Content]) -> str:
+        nonlocal client
+        from google import genai
+        from google.genai.types import GenerateContentConfig
+
+        if client is None:
+            client = genai.Client()
+        prompt = dedent("""
+            Summarise this conversation between a user and a chatbot, so that the chatbot can carry on the
+            conversation from the summary alone. Keep the user's name and details, what they asked for,
+            what was decided or answered, and anything left open. Write in the third person, in under 300 words.
+        """)
+        if summary:
+            prompt += f"\n## SUMMARY OF THE CONVERSATION BEFORE THIS:\n{summary}\n"
+        prompt += f"\n## CONVERSATION:\n{_transcript(contents)}"
+
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=GenerateContentConfig(temperature=0.2, max_output_tokens=_SUMMARY_MAX_OUTPUT_TOKENS),
+        )
+        if not response.text:
+            raise ValueError(f"No summary returned by {model}")
+        return response.text
+
+    return summarize
+
+
+class HistoryCompactor:
+    """Trims the history sent in each model request of an agent, by its policy. Use before_model as the callback."""
+
+    def __init__(
+        self,
+        policy: HistoryPolicy,
+        summarizer: Summarizer | None = None,
+        max_turns: int = HISTORY_MAX_TURNS,
+        threshold_tokens: int = HISTORY_SUMMARY_THRESHOLD_TOKENS,
+        keep_turns: int = HISTORY_SUMMARY_KEEP_TURNS,
+    ):
+        """
+        Args:
+            policy: How history is trimmed.
+            summarizer: Writes the summaries, under the summary policy. Defaults to genai_summarizer().
+            max_turns: The most turns sent to the model.
+            threshold_tokens: Under the summary policy, the tokens of earlier turns that trigger a summary.
+            keep_turns: Under the summary policy, the recent turns sent as they are.
+        """
+        self.policy = policy
+        self.max_turns = max_turns
+        self.threshold_tokens = threshold_tokens
+        self.keep_turns = keep_turns
+        self._summarizer = summarizer
+        # Session -> (summary, the number of turns it covers), waiting to be saved to the session
+        self._pending: TTLCache[SessionKey, tuple[str, int]] = TTLCache("history.pending_summaries", max_entries=10000)
+        self._summarizing: set[SessionKey] = set()  # Sessions with a summary being written
+        self._tasks: set[asyncio.Task] = set()
+        self._summaries = metrics.counter("history.summaries")
+        self._summary_failures = metrics.counter("history.summary_failures")
+        self._request_tokens = metrics.histogram("history.request_tokens", _REQUEST_TOKEN_BUCKETS)
+
+    def before_model(self, callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+        """Trim the history in the request. Returns None, so the request goes ahead."""
+        turns = split_turns(llm_request.contents)
+        if self.policy is HistoryPolicy.SUMMARY:
+            turns = self._apply_summary(callback_context, llm_request, turns)
+        if len(turns) > self.max_turns:
+            turns = turns[-self.max_turns :]
+
+        llm_request.contents = [content for turn in turns for content in turn]
+        self._request_tokens.observe(estimate_tokens(llm_request.contents))
+
+    async def wait_for_summaries(self) -> None:
+        """Wait for the summaries being written."""
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    async def drain(self, session_service: BaseSessionService) -> None:
+        """
+        Wait for the summaries being written, then save every summary still waiting for its session's next model
+        request to the session. Called on shutdown, as those summaries are only held in memory.
+        """
+        await self.wait_for_summaries()
+        for (app_name, user_id, session_id), (summary, summarized) in self._pending.items():
+            try:
+                session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+                if session is None:
+                    continue
+                # An event with no content, so it adds nothing to the history sent to the model
+                actions = EventActions(state_delta={SUMMARY_STATE_KEY: summary, SUMMARIZED_TURNS_STATE_KEY: summarized})
+                event = Event(invocation_id=new_invocation_context_id(), author="user", actions=actions)
+                await session_service.append_event(session, event)
+            except Exception as e:
+                logger.warning(f"Could not save the summary of session {session_id}: {e}")
+        self._pending.clear()
+
+    def _apply_summary(
+        self, callback_context: CallbackContext, llm_request: LlmRequest, turns: list[list[Content]]
+    ) -> list[list[Content]]:
+        """Replace the summarised turns with the summary, and start a new summary if one is due."""
+        # CallbackContext has no public accessor for the session in this version of ADK
+        session = callback_context._invocation_context.session
+        session_key = (session.app_name, session.user_id, session.id)
+        state = callback_context.state
+
+        # Saved with this request's response event, so that the summary is kept with the session
+        if (pending := self._pending.get(session_key)) is not None:
+            self._pending.invalidate(session_key)
+            state[SUMMARY_STATE_KEY], state[SUMMARIZED_TURNS_STATE_KEY] = pending
+
+        summary: str | None = state.get(SUMMARY_STATE_KEY)
+        summarized = min(state.get(SUMMARIZED_TURNS_STATE_KEY, 0), len(turns) - 1)
+        recent = turns[summarized:]
+        if summary:
+            llm_request.append_instructions([f"## SUMMARY OF THE CONVERSATION SO FAR:\n{summary}"])
+
+        # The last turn is the one in progress
+        earlier = recent[:-1]
+        foldable = earlier[: len(earlier) - self.keep_turns]
+        if (
+            foldable
+            and session_key not in self._summarizing
+            and estimate_tokens([content for turn in earlier for content in turn]) > self.threshold_tokens
+        ):
+            contents = [content for turn in foldable for content in turn]
+            self._start_summary(session_key, summary, contents, summarized + len(foldable))
+
+        return recent
+
+    def _start_summary(self, session_key: SessionKey, summary: str | None, contents: list[Content], summarized: int) -> None:
+        self._summarizing.add(session_key)
+        task = asyncio.create_task(self._summarize(session_key, summary, contents, summarized))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session_key: SessionKey, summary: str | None, contents: list[Content], summarized: int) -> None:
+        session_id = session_key[2]
+        if self._summarizer is None:
+            self._summarizer = genai_summarizer()
+        try:
+            new_summary = await self._summarizer(summary, contents)
+            self._pending.set(session_key, (new_summary, summarized), _PENDING_SUMMARY_TTL_SECONDS)
+            self._summaries.inc()
+            logger.debug(f"Summarised the first {summarized} turns of session {session_id}")
+        except Exception as e:
+            # The turns stay unsummarised, and are tried again on a later turn
+            self._summary_failures.inc()
+            logger.warning(f"Could not summarise the history of session {session_id}: {e}")
+        finally:
+            self._summarizing.discard(session_key)
@@ -0,0 +1,100 @@
+"""
+In-memory copy of the `persona_tiers` collection.
+
+The collection holds one small document per persona, and is read on every chat request by the RBAC check.
+Rather than reading Firestore each time, we load the whole collection once and keep it current:
+- A snapshot listener pushes changes as soon as they are made.
+- A low-frequency poll reloads the collection anyway, in case the listener stream drops or misses an update.
+"""
+
+import threading
+from collections.abc import Callable
+from os import getenv
+
+from rickbot_utils.config import logger
+
+PERSONA_TIERS_POLL_SECONDS = float(getenv("PERSONA_TIERS_POLL_SECONDS", "300"))
+
+TierMap = dict[str, str]  # persona_id -> required_role
+TierLoader = Callable[[], TierMap]
+# Subscribes a callback to changes, and returns a function that unsubscribes it
+TierSubscriber = Callable[[Callable[[TierMap], None]], Callable[[], None]]
+
+
+class PersonaTierTable:
+    """Holds the required role for every persona in memory."""
+
+    def __init__(
+        self,
+        loader: TierLoader,
+        subscriber: TierSubscriber | None = None,
+        poll_interval: float = PERSONA_TIERS_POLL_SECONDS,
+    ):
+        """
+        Args:
+            loader: Reads the full collection.
+            subscriber: Registers a listener that is called with the full collection whenever it changes.
+            poll_interval: Seconds between fallback reloads.
+        """
+        self._loader = loader
+        self._subscriber = subscriber
+        self._poll_interval = poll_interval
+        self._tiers: TierMap | None = None
+        self._unsubscribe: Callable[[], None] | None = None
+        self._stop = threading.Event()
+        self._poller: threading.Thread | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._tiers is not None
+
+    def get(self, persona_id: str) -> str | None:
+        """Return the required role for a persona, or None if the table has not loaded yet."""
+        tiers = self._tiers
+        if tiers is None:
+            return None
+        return tiers.get(persona_id.lower(), "standard")
+
+    def replace(self, tiers: TierMap) -> None:
+        """Swap in a new copy of the collection."""
+        self._tiers = {persona_id.lower(): role for persona_id, role in tiers.items()}
+        logger.debug(f"Persona tiers updated: {self._tiers}")
+
+    def refresh(self) -> None:
+        """Reload the whole collection."""
+        self.replace(self._loader())
+
+    def start(self) -> None:
+        """Subscribe to changes and start the fallback poller. Does not block."""
+        if self._poller is not None:
+            return
+
+        if self._subscriber:
+            try:
+                self._unsubscribe = self._subscriber(self.replace)
+            except Exception as e:
+                logger.error(f"Unable to listen for persona tier changes. Falling back to polling: {e}")
+
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._poll, name="persona-tier-poller", daemon=True)
+        self._poller.start()
+
+    def stop(self) -> None:
+        """Unsubscribe and stop polling."""
+        self._stop.set()
+        if self._unsubscribe:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._poller:
+            self._poller.join(timeout=1)
+            self._poller = None
+
+    def _poll(self) -> None:
+        # Without a listener, load straight away; otherwise the listener's first snapshot will load the table.
+        delay = self._poll_interval if self._unsubscribe else 0
+        while not self._stop.wait(delay):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error reloading persona tiers: {e}")
+            delay = self._poll_interval
@@ -37,6 +37,7 @@ class Personality:
     temperature: float
     file_search_store_name: str | None = None
     file_search_description: str | None = None
+    history_policy: str | None = None  # "window" or "summary". See history.py.
     avatar: str = field(init=False)
     system_instruction: str = field(init=False)
 
@@ -0,0 +1,172 @@
+"""
+Data access for users and persona tiers.
+
+The API reads and writes the `users` and `persona_tiers` collections through the AccessRepository interface:
+- FirestoreAccessRepository uses the async Firestore client, so lookups on the request path never block the event loop.
+- InMemoryAccessRepository holds everything in dicts, for tests and local development without Firestore.
+
+User documents used to have the ID `{SafeName}:{provider}:{id}`, and are moved to `{provider}:{id}` by
+scripts/migrate_user_keys.py. Until that has run, a user with no document at the new ID is looked up by query among
+the legacy documents, and their role copied forward to the new ID, so that existing supporters keep their role.
+Set USER_LEGACY_DOC_FALLBACK=false once the migration is complete, to skip that query for new users.
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import UTC, datetime
+from os import getenv
+from typing import Any, NamedTuple
+
+from google.cloud import firestore  # type: ignore[attr-defined]
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from rickbot_utils.config import logger
+
+USER_LEGACY_DOC_FALLBACK = getenv("USER_LEGACY_DOC_FALLBACK", "true").lower() == "true"
+ROLE_RANK = {"standard": 0, "supporter": 1, "admin": 2}
+
+
+class UserMetadata(NamedTuple):
+    """The details recorded for a user when they sign in."""
+
+    user_id: str
+    provider: str
+    email: str
+    name: str
+
+
+def user_doc_id(user_id: str, provider: str) -> str:
+    """
+    The ID of a user's document: {provider}:{id}
+    Derived only from the provider and its stable subject ID, so a user's document can be read directly,
+    and a change of name doesn't create a second document.
+    """
+    return f"{provider}:{user_id}"
+
+
+class AccessRepository(ABC):
+    """Reads and writes the data needed for access control."""
+
+    @abstractmethod
+    async def get_user_role(self, user_id: str, provider: str) -> str | None:
+        """Return the user's role, or None if the user is not known."""
+
+    @abstractmethod
+    async def get_required_role(self, persona_id: str) -> str | None:
+        """Return the role required to use a persona, or None if the persona has no tier."""
+
+    @abstractmethod
+    async def upsert_users(self, users: list[UserMetadata]) -> None:
+        """Create each user with the 'standard' role, or update their details and last_logged_in time."""
+
+
+class FirestoreAccessRepository(AccessRepository):
+    """AccessRepository backed by Firestore, using the async client."""
+
+    def __init__(self, client: firestore.AsyncClient, legacy_fallback: bool = USER_LEGACY_DOC_FALLBACK):
+        """
+        Args:
+            client: The async Firestore client.
+            legacy_fallback: Whether users with no document at {provider}:{id} are looked for among legacy documents.
+        """
+        self.client = client
+        self.legacy_fallback = legacy_fallback
+
+    def _user_doc(self, user_id: str, provider: str):
+        return self.client.collection("users").document(user_doc_id(user_id, provider))
+
+    async def _legacy_role(self, user_id: str, provider: str) -> str | None:
+        """The highest role on the user's legacy documents, or None if they have none (or the fallback is off)."""
+        if not self.legacy_fallback:
+            return None
+
+        query = (
+            self.client.collection("users")
+            .where(filter=FieldFilter("id", "==", user_id))
+            .where(filter=FieldFilter("provider", "==", provider))
+        )
+        roles = [
+            (snapshot.to_dict() or {}).get("role", "standard")
+            async for snapshot in query.stream()
+            if snapshot.id != user_doc_id(user_id, provider)
+        ]
+        if not roles:
+            return None
+        return max(roles, key=lambda role: ROLE_RANK.get(role, 0))
+
+    async def get_user_role(self, user_id: str, provider: str) -> str | None:
+        doc = await self._user_doc(user_id, provider).get()
+        if not doc.exists:
+            role = await self._legacy_role(user_id, provider)
+            if role is not None:
+                # Copied forward, so the user's next lookup is a point read
+                logger.info(f"Copying role '{role}' for user_id '{user_id}' ({provider}) forward from a legacy document")
+                await self._user_doc(user_id, provider).set({"id": user_id, "provider": provider, "role": role}, merge=True)
+            return role
+
+        role = doc.to_dict().get("role", "standard")
+        logger.debug(f"Retrieved role '{role}' for user_id '{user_id}' ({provider}) from doc '{doc.id}'")
+        return role
+
+    async def get_required_role(self, persona_id: str) -> str | None:
+        doc = await self.client.collection("persona_tiers").document(persona_id.lower()).get()
+        if not doc.exists:
+            return None
+        return doc.to_dict().get("required_role", "standard")
+
+    async def upsert_users(self, users: list[UserMetadata]) -> None:
+        """Check which users already exist with one batched read, then write all users in a single batch."""
+        refs = [self._user_doc(u.user_id, u.provider) for u in users]
+        existing = {snapshot.id async for snapshot in self.client.get_all(refs, field_paths=["role"]) if snapshot.exists}
+        # New documents take the role of any legacy documents for the same user, rather than 'standard'
+        new_users = [u for u, ref in zip(users, refs, strict=True) if ref.id not in existing]
+        legacy_roles = await asyncio.gather(*(self._legacy_role(u.user_id, u.provider) for u in new_users))
+        new_roles = {user_doc_id(u.user_id, u.provider): role for u, role in zip(new_users, legacy_roles, strict=True)}
+
+        batch = self.client.batch()
+        for user, ref in zip(users, refs, strict=True):
+            data: dict[str, Any] = {
+                "id": user.user_id,
+                "provider": user.provider,
+                "email": user.email,
+                "name": user.name,
+                "last_logged_in": firestore.SERVER_TIMESTAMP,
+            }
+            if ref.id not in existing:
+                data["role"] = new_roles[ref.id] or "standard"
+            batch.set(ref, data, merge=True)
+
+        await batch.commit()
+        logger.debug(f"Synced metadata for {len(users)} users")
+
+
+class InMemoryAccessRepository(AccessRepository):
+    """AccessRepository held in memory. Documents are stored as dicts, keyed by document ID."""
+
+    def __init__(
+        self,
+        users: dict[str, dict[str, Any]] | None = None,
+        persona_tiers: dict[str, dict[str, Any]] | None = None,
+    ):
+        self.users = users if users is not None else {}
+        self.persona_tiers = persona_tiers if persona_tiers is not None else {}
+
+    async def get_user_role(self, user_id: str, provider: str) -> str | None:
+        user = self.users.get(user_doc_id(user_id, provider))
+        return user.get("role", "standard") if user else None
+
+    async def get_required_role(self, persona_id: str) -> str | None:
+        tier = self.persona_tiers.get(persona_id.lower())
+        return tier.get("required_role", "standard") if tier else None
+
+    async def upsert_users(self, users: list[UserMetadata]) -> None:
+        for u in users:
+            data = {
+                "id": u.user_id,
+                "provider": u.provider,
+                "email": u.email,
+                "name": u.name,
+                "last_logged_in": datetime.now(UTC),
+            }
+            user = self.users.setdefault(user_doc_id(u.user_id, u.provider), {"role": "standard"})
+            user.update(data)
@@ -0,0 +1,145 @@
+"""
+Exact-match cache of first-turn replies.
+
+Many conversations open with the same message, e.g. "Hello" or "Who are you?". The reply to the first turn
+of a conversation depends only on the persona, the prompt and the model settings, so it can be served from cache,
+skipping the model call and any tool calls.
+
+The cache is opt-in (RESPONSE_CACHE_ENABLED), and only used for turns with no earlier history in the session
+and no attachments. Replies are keyed by (persona, normalised prompt, model, temperature bucket).
+Storage is pluggable through the ResponseCacheBackend interface.
+Prompts with no exact match can also be matched by meaning: see semantic_cache.py.
+"""
+
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from os import getenv
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from rickbot_utils.ttl_cache import TTLCache
+
+if TYPE_CHECKING:
+    from rickbot_agent.semantic_cache import SemanticCache
+
+RESPONSE_CACHE_ENABLED = getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = float(getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Longer prompts are unlikely to be repeated word for word, so aren't worth caching
+RESPONSE_CACHE_MAX_PROMPT_CHARS = int(getenv("RESPONSE_CACHE_MAX_PROMPT_CHARS", "200"))
+# Temperatures are rounded to this many decimal places in the key
+RESPONSE_CACHE_TEMPERATURE_DECIMALS = 1
+
+# Cached replies are streamed in pieces of about this many characters, this many milliseconds apart
+RESPONSE_CACHE_STREAM_CHUNK_CHARS = 48
+RESPONSE_CACHE_STREAM_DELAY_MS = float(getenv("RESPONSE_CACHE_STREAM_DELAY_MS", "20"))
+
+_TRAILING_PUNCTUATION = " .!?…"
+_WORD = re.compile(r"\S+\s*")
+
+
+class ResponseCacheKey(NamedTuple):
+    """Identifies a first-turn reply."""
+
+    personality: str  # The agent's name, which is unique per persona
+    prompt: str  # Normalised: see normalize_prompt()
+    model: str
+    temperature: float | None  # Rounded to RESPONSE_CACHE_TEMPERATURE_DECIMALS
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalise a prompt so that trivially different phrasings match: case, whitespace and trailing punctuation."""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    return " ".join(text.split()).rstrip(_TRAILING_PUNCTUATION)
+
+
+def stream_pieces(text: str, piece_chars: int = RESPONSE_CACHE_STREAM_CHUNK_CHARS) -> list[str]:
+    """Split text into pieces of about piece_chars characters, on word boundaries, to stream a cached reply."""
+    pieces: list[str] = []
+    piece = ""
+    for word in _WORD.findall(text):
+        piece += word
+        if len(piece) >= piece_chars:
+            pieces.append(piece)
+            piece = ""
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+class ResponseCacheBackend(ABC):
+    """Stores cached replies."""
+
+    @abstractmethod
+    async def get(self, key: ResponseCacheKey) -> str | None:
+        """Return the cached reply, or None if there isn't one."""
+
+    @abstractmethod
+    async def set(self, key: ResponseCacheKey, response: str, ttl: float) -> None:
+        """Cache the reply for ttl seconds."""
+
+
+class InMemoryResponseCacheBackend(ResponseCacheBackend):
+    """ResponseCacheBackend held in memory, per instance, evicting the least recently used past max_entries."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self._cache: TTLCache[ResponseCacheKey, str] = TTLCache("response_cache", max_entries=max_entries)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get(self, key: ResponseCacheKey) -> str | None:
+        return self._cache.get(key)
+
+    async def set(self, key: ResponseCacheKey, response: str, ttl: float) -> None:
+        self._cache.set(key, response, ttl)
+
+
+class ResponseCache:
+    """Caches the replies to first turns."""
+
+    def __init__(
+        self,
+        backend: ResponseCacheBackend,
+        ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+        max_prompt_chars: int = RESPONSE_CACHE_MAX_PROMPT_CHARS,
+        semantic: "SemanticCache | None" = None,
+    ):
+        """
+        Args:
+            backend: Stores the replies.
+            ttl: Seconds a reply is cached for.
+            max_prompt_chars: Prompts longer than this are not cached.
+            semantic: Looks up prompts with no exact match by similarity, or None to only match exactly.
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.max_prompt_chars = max_prompt_chars
+        self.semantic = semantic
+
+    def key_for(self, agent: Any, prompt: str) -> ResponseCacheKey | None:
+        """The cache key for a first-turn prompt to this agent, or None if the prompt shouldn't be cached."""
+        normalized = normalize_prompt(prompt)
+        if not normalized or len(normalized) > self.max_prompt_chars:
+            return None
+
+        config = getattr(agent, "generate_content_config", None)
+        temperature = getattr(config, "temperature", None)
+        if temperature is not None:
+            temperature = round(temperature, RESPONSE_CACHE_TEMPERATURE_DECIMALS)
+        return ResponseCacheKey(agent.name, normalized, str(agent.model), temperature)
+
+    async def get(self, key: ResponseCacheKey) -> str | None:
+        """Return the cached reply to this prompt, or failing that, to a similar prompt."""
+        if (response := await self.backend.get(key)) is not None:
+            return response
+        if self.semantic is not None:
+            return await self.semantic.get(key)
+        return None
+
+    async def put(self, key: ResponseCacheKey, response: str) -> None:
+        """Cache a reply. Empty replies are not cached."""
+        if response.strip():
+            await self.backend.set(key, response, self.ttl)
+            if self.semantic is not None:
+                await self.semantic.put(key, response, self.ttl)
@@ -0,0 +1,61 @@
+"""
+Shared ADK runners, one per agent.
+
+A Runner holds no per-invocation state: each `run_async()` call creates its own invocation context, and all
+conversation state lives in the session service. So one Runner per agent can safely serve any number of
+concurrent requests and users, rather than constructing a new Runner for every request.
+"""
+
+import threading
+from collections.abc import Callable
+
+from google.adk.agents import BaseAgent
+from google.adk.runners import Runner
+
+from rickbot_utils.config import logger
+from rickbot_utils.metrics import metrics
+
+# Builds a runner for the given agent
+RunnerFactory = Callable[[BaseAgent], Runner]
+
+
+class RunnerRegistry:
+    """
+    Holds one runner per agent, keyed by agent name.
+
+    If the agent for a name changes (e.g. because the agent cache was cleared and the agent recreated),
+    the runner is rebuilt for the new agent.
+    """
+
+    def __init__(self, build_runner: RunnerFactory):
+        """
+        Args:
+            build_runner: Builds a runner for an agent, using the app name and services of the caller.
+        """
+        self._build_runner = build_runner
+        self._runners: dict[str, tuple[BaseAgent, Runner]] = {}  # agent name -> (agent, runner)
+        self._lock = threading.Lock()
+        self._builds = metrics.counter("runner_registry.builds")
+
+    def __len__(self) -> int:
+        return len(self._runners)
+
+    def get(self, agent: BaseAgent) -> Runner:
+        """Return the shared runner for this agent, building it if needed."""
+        entry = self._runners.get(agent.name)
+        if entry is not None and entry[0] is agent:
+            return entry[1]
+
+        with self._lock:
+            entry = self._runners.get(agent.name)
+            if entry is None or entry[0] is not agent:
+                logger.info(f"Building runner for agent: {agent.name}")
+                entry = (agent, self._build_runner(agent))
+                self._runners[agent.name] = entry
+                self._builds.inc()
+            return entry[1]
+
+    def clear(self) -> None:
+        """Drop all runners, so that each is rebuilt on next use."""
+        with self._lock:
+            self._runners.clear()
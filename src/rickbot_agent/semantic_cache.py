@@ -0,0 +1,374 @@
+"""
+Semantic cache of first-turn replies.
+
+The exact-match response cache only helps when a prompt is repeated word for word. Questions to the knowledge-base
+personas (e.g. "How do I create a GCS bucket?") are often asked in many slightly different ways, and each one costs
+a RagAgent round trip as well as the main model call. So prompts are also embedded, and a new prompt is answered
+with the reply to the most similar cached prompt, if their cosine similarity reaches SEMANTIC_CACHE_THRESHOLD.
+
+Each (persona, model, temperature) has its own namespace: a NumPy matrix holding one normalised embedding per row,
+so a lookup is a single matrix-vector product. Entries are evicted least recently used first, once the cache holds
+more than SEMANTIC_CACHE_MAX_MEMORY_MB of embeddings, prompts and replies.
+
+If SEMANTIC_CACHE_SNAPSHOT_PATH is set, the cache is saved there on shutdown and loaded on startup,
+so it survives restarts. The embedding function is pluggable: see Embedder.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass
+from os import getenv
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from rickbot_agent.response_cache import ResponseCacheKey
+from rickbot_utils.config import logger
+from rickbot_utils.metrics import metrics
+from rickbot_utils.ttl_cache import TTLCache
+
+SEMANTIC_CACHE_ENABLED = getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# The cosine similarity at which a cached prompt is treated as the same question
+SEMANTIC_CACHE_THRESHOLD = float(getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_MEMORY_MB = float(getenv("SEMANTIC_CACHE_MAX_MEMORY_MB", "64"))
+# Comma-separated agent names (e.g. "rickbot_Dazbo") whose replies are cached semantically. Empty means every persona.
+SEMANTIC_CACHE_PERSONAS = frozenset(name for name in getenv("SEMANTIC_CACHE_PERSONAS", "").split(",") if name.strip())
+# Directory to save the cache to on shutdown, and load it from on startup. Unset means the cache is not saved.
+SEMANTIC_CACHE_SNAPSHOT_PATH = getenv("SEMANTIC_CACHE_SNAPSHOT_PATH")
+SEMANTIC_CACHE_EMBEDDING_MODEL = getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "gemini-embedding-001")
+SEMANTIC_CACHE_EMBEDDING_DIMENSIONS = int(getenv("SEMANTIC_CACHE_EMBEDDING_DIMENSIONS", "768"))
+
+# A prompt is usually embedded twice: once to look it up, then again to cache its reply. The second is served from here.
+_EMBEDDING_CACHE_MAX_ENTRIES = 256
+_EMBEDDING_CACHE_TTL_SECONDS = 300
+_INITIAL_ROWS = 16
+
+# The vectors and entries are saved in one file, so that a single rename replaces the whole snapshot
+_SNAPSHOT_FILE = "snapshot.npz"
+_TOKEN = re.compile(r"\w+")
+
+# Returns the embedding of a prompt
+Embedder = Callable[[str], Awaitable[Sequence[float]]]
+# (personality, model, temperature): the parts of a ResponseCacheKey other than the prompt
+Namespace = tuple[str, str, float | None]
+
+
+def genai_embedder(
+    model: str = SEMANTIC_CACHE_EMBEDDING_MODEL, dimensions: int = SEMANTIC_CACHE_EMBEDDING_DIMENSIONS
+) -> Embedder:
+    """An Embedder that calls a Gemini embedding model. The client is created on first use."""
+    client = None
+
+    async def embed(text: str) -> Sequence[float]:
+        nonlocal client
+        from google import genai
+        from google.genai.types import EmbedContentConfig
+
+        if client is None:
+            client = genai.Client()
+        response = await client.aio.models.embed_content(
+            model=model,
+            contents=text,
+            config=EmbedContentConfig(task_type="SEMANTIC_SIMILARITY", output_dimensionality=dimensions),
+        )
+        if not response.embeddings or not response.embeddings[0].values:
+            raise ValueError(f"No embedding returned by {model}")
+        return response.embeddings[0].values
+
+    return embed
+
+
+def hashing_embedder(dimensions: int = 256) -> Embedder:
+    """
+    A deterministic Embedder that needs no model: each word is hashed into one of `dimensions` buckets.
+    Prompts sharing most of their words are similar. Useful for tests and local development.
+    """
+
+    async def embed(text: str) -> Sequence[float]:
+        vector = [0.0] * dimensions
+        for token in _TOKEN.findall(text.casefold()):
+            digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            vector[int.from_bytes(digest) % dimensions] += 1.0
+        return vector
+
+    return embed
+
+
+@dataclass(slots=True)
+class _Entry:
+    namespace: Namespace
+    prompt: str
+    reply: str
+    expires_at: float
+    size: int  # Bytes counted against the memory budget
+    row: int  # The entry's row in its namespace's matrix
+
+
+class _VectorIndex:
+    """The embeddings of one namespace, as the rows of a matrix, and the ID of the entry each row belongs to."""
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.zeros((_INITIAL_ROWS, dimensions), dtype=np.float32)
+        self.entry_ids: list[int] = []
+
+    def add(self, entry_id: int, vector: np.ndarray) -> int:
+        """Add a vector, returning its row."""
+        row = len(self.entry_ids)
+        if row == len(self.vectors):
+            grown = np.zeros((row * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:row] = self.vectors
+            self.vectors = grown
+        self.vectors[row] = vector
+        self.entry_ids.append(entry_id)
+        return row
+
+    def remove(self, row: int) -> int | None:
+        """Remove a row by moving the last row into its place. Returns the ID of the entry moved, if any."""
+        last = len(self.entry_ids) - 1
+        moved = self.entry_ids.pop()
+        if row == last:
+            return None
+        self.vectors[row] = self.vectors[last]
+        self.entry_ids[row] = moved
+        return moved
+
+    def nearest(self, vector: np.ndarray) -> tuple[int, float] | None:
+        """Return the (row, cosine similarity) of the closest vector, or None if the index is empty."""
+        count = len(self.entry_ids)
+        if not count:
+            return None
+        similarities = self.vectors[:count] @ vector
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+
+class SemanticCache:
+    """Caches replies, looking them up by the similarity of their prompt embeddings."""
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_bytes: int = int(SEMANTIC_CACHE_MAX_MEMORY_MB * 1024 * 1024),
+        personas: frozenset[str] = SEMANTIC_CACHE_PERSONAS,
+        snapshot_path: str | None = SEMANTIC_CACHE_SNAPSHOT_PATH,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            embedder: Embeds prompts.
+            threshold: The cosine similarity at which a cached prompt matches.
+            max_bytes: The memory budget, past which the least recently used entries are evicted.
+            personas: The agent names whose replies are cached. Empty means every agent.
+            snapshot_path: The directory save() and load() use, or None to not save the cache.
+            clock: Returns the current time in seconds. Wall-clock time, so that expiry survives a restart.
+        """
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.personas = personas
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._clock = clock
+        self._dimensions: int | None = None  # Set by the first embedding
+        self._indexes: dict[Namespace, _VectorIndex] = {}
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()  # Least recently used first
+        self._next_id = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._embeddings: TTLCache[str, np.ndarray] = TTLCache(
+            "semantic_cache_embeddings", max_entries=_EMBEDDING_CACHE_MAX_ENTRIES
+        )
+
+        self._hits = metrics.counter("semantic_cache.hits")
+        self._misses = metrics.counter("semantic_cache.misses")
+        self._evictions = metrics.counter("semantic_cache.evictions")
+        self._embedding_errors = metrics.counter("semantic_cache.embedding_errors")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def memory_bytes(self) -> int:
+        """The bytes counted against the memory budget."""
+        return self._bytes
+
+    def applies_to(self, key: ResponseCacheKey) -> bool:
+        return not self.personas or key.personality in self.personas
+
+    async def get(self, key: ResponseCacheKey) -> str | None:
+        """Return the reply to the most similar cached prompt, if it is similar enough."""
+        if not self.applies_to(key):
+            return None
+        vector = await self._embed(key.prompt)
+        if vector is None:
+            return None
+
+        with self._lock:
+            match = self._nearest(_namespace(key), vector)
+            if match is None or match[1] < self.threshold:
+                self._misses.inc()
+                return None
+            entry_id, similarity = match
+            self._entries.move_to_end(entry_id)
+            entry = self._entries[entry_id]
+
+        logger.debug(f"Semantic cache hit ({similarity:.3f}) for '{key.prompt}': cached prompt '{entry.prompt}'")
+        self._hits.inc()
+        return entry.reply
+
+    async def put(self, key: ResponseCacheKey, reply: str, ttl: float) -> None:
+        """
+        Cache a reply for ttl seconds.
+        If a cached prompt already matches this one, its reply is replaced, rather than adding a near-duplicate.
+        """
+        if ttl <= 0 or not self.applies_to(key):
+            return
+        vector = await self._embed(key.prompt)
+        if vector is None:
+            return
+
+        namespace = _namespace(key)
+        expires_at = self._clock() + ttl
+        with self._lock:
+            match = self._nearest(namespace, vector)
+            if match is not None and match[1] >= self.threshold:
+                self._remove(match[0])
+            self._add(namespace, key.prompt, reply, expires_at, vector)
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._indexes.clear()
+            self._entries.clear()
+            self._bytes = 0
+
+    async def _embed(self, prompt: str) -> np.ndarray | None:
+        """Return the normalised embedding of a prompt, or None if it can't be embedded."""
+        try:
+            return await self._embeddings.get_or_load(
+                prompt, lambda: self._load_embedding(prompt), ttl=lambda _: _EMBEDDING_CACHE_TTL_SECONDS
+            )
+        except Exception as e:
+            self._embedding_errors.inc()
+            logger.warning(f"Unable to embed prompt for the semantic cache: {e}")
+            return None
+
+    async def _load_embedding(self, prompt: str) -> np.ndarray:
+        vector = np.asarray(await self.embedder(prompt), dtype=np.float32)
+        if vector.ndim != 1 or (self._dimensions is not None and len(vector) != self._dimensions):
+            raise ValueError(f"Expected an embedding of {self._dimensions} dimensions, got shape {vector.shape}")
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            raise ValueError("Embedding has no magnitude")
+        self._dimensions = len(vector)
+        return vector / norm
+
+    def _nearest(self, namespace: Namespace, vector: np.ndarray) -> tuple[int, float] | None:
+        """Return the (entry ID, similarity) of the closest unexpired entry in the namespace, removing expired ones found."""
+        index = self._indexes.get(namespace)
+        now = self._clock()
+        while index is not None and (nearest := index.nearest(vector)) is not None:
+            row, similarity = nearest
+            entry_id = index.entry_ids[row]
+            if self._entries[entry_id].expires_at > now:
+                return entry_id, similarity
+            self._remove(entry_id)
+        return None
+
+    def _add(self, namespace: Namespace, prompt: str, reply: str, expires_at: float, vector: np.ndarray) -> None:
+        index = self._indexes.get(namespace)
+        if index is None:
+            index = self._indexes[namespace] = _VectorIndex(len(vector))
+        entry_id = self._next_id
+        self._next_id += 1
+        size = vector.nbytes + len(prompt.encode()) + len(reply.encode())
+        row = index.add(entry_id, vector)
+        self._entries[entry_id] = _Entry(namespace, prompt, reply, expires_at, size, row)
+        self._bytes += size
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._bytes -= entry.size
+        index = self._indexes[entry.namespace]
+        moved = index.remove(entry.row)
+        if moved is not None:
+            self._entries[moved].row = entry.row
+        if not index.entry_ids:
+            del self._indexes[entry.namespace]
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self._evictions.inc()
+
+    def save(self) -> None:
+        """Save the unexpired entries to the snapshot directory, replacing any earlier snapshot."""
+        if self.snapshot_path is None:
+            return
+
+        with self._lock:
+            now = self._clock()
+            entries = [entry for entry in self._entries.values() if entry.expires_at > now]
+            if not entries or self._dimensions is None:
+                return
+            vectors = np.stack([self._indexes[entry.namespace].vectors[entry.row] for entry in entries])
+            metadata: dict[str, Any] = {
+                "dimensions": self._dimensions,
+                "checksum": _checksum(vectors),  # Lets load() check the entries were saved with these vectors
+                "entries": [[list(e.namespace), e.prompt, e.reply, e.expires_at] for e in entries],
+            }
+
+        # Write alongside, then swap in with one rename, so that a crash mid-save leaves the previous snapshot intact
+        self.snapshot_path.mkdir(parents=True, exist_ok=True)
+        temp_path = self.snapshot_path / f"{_SNAPSHOT_FILE}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, vectors=vectors, metadata=np.array(json.dumps(metadata)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path / _SNAPSHOT_FILE)
+        logger.info(f"Saved {len(entries)} semantic cache entries to {self.snapshot_path}")
+
+    def load(self) -> None:
+        """Load the unexpired entries of the snapshot, if there is one."""
+        if self.snapshot_path is None or not (self.snapshot_path / _SNAPSHOT_FILE).exists():
+            return
+
+        try:
+            with np.load(self.snapshot_path / _SNAPSHOT_FILE) as snapshot:
+                metadata = json.loads(str(snapshot["metadata"]))
+                vectors = snapshot["vectors"]
+            if vectors.shape != (len(metadata["entries"]), metadata["dimensions"]):
+                raise ValueError(f"Vectors of shape {vectors.shape} don't match the entries")
+            if _checksum(vectors) != metadata["checksum"]:
+                raise ValueError("Vectors don't match the checksum saved with the entries")
+        except Exception as e:
+            logger.error(f"Unable to load the semantic cache snapshot from {self.snapshot_path}: {e}")
+            return
+
+        now = self._clock()
+        with self._lock:
+            if self._dimensions not in (None, metadata["dimensions"]):
+                logger.warning(f"Ignoring semantic cache snapshot of {metadata['dimensions']} dimensions")
+                return
+            self._dimensions = metadata["dimensions"]
+            for (namespace, prompt, reply, expires_at), vector in zip(metadata["entries"], vectors, strict=True):
+                if expires_at > now:
+                    self._add(tuple(namespace), prompt, reply, expires_at, vector)
+            self._evict()
+        logger.info(f"Loaded {len(self._entries)} semantic cache entries from {self.snapshot_path}")
+
+
+def _checksum(vectors: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(vectors).tobytes()).hexdigest()
+
+
+def _namespace(key: ResponseCacheKey) -> Namespace:
+    return key.personality, key.model, key.temperature
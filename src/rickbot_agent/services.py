@@ -1,16 +1,32 @@
 """This module contains service initialisation functions for the Rickbot agent."""
 
+from collections.abc import Callable
 from functools import cache
+from os import getenv
 
 from google.adk.artifacts import GcsArtifactService, InMemoryArtifactService
 from google.adk.sessions import BaseSessionService, InMemorySessionService
 from google.cloud import firestore  # type: ignore[attr-defined]
 
+from rickbot_agent.persona_tiers import PersonaTierTable, TierMap
+from rickbot_agent.repository import AccessRepository, FirestoreAccessRepository, UserMetadata
+from rickbot_agent.response_cache import RESPONSE_CACHE_ENABLED, InMemoryResponseCacheBackend, ResponseCache
+from rickbot_agent.semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, genai_embedder
+from rickbot_agent.user_sync import UserMetadataWriter
 from rickbot_utils.config import config
 from rickbot_utils.logging_utils import setup_logger
+from rickbot_utils.ttl_cache import TTLCache
 
 logger = setup_logger(config.agent_name)
 
+# Roles rarely change, so they are cached per user. The cache is also invalidated when a user's role changes
+# (see watch_user_role_changes), so the TTL only bounds staleness if change notifications are missed.
+USER_ROLE_CACHE_MAX_ENTRIES = int(getenv("USER_ROLE_CACHE_MAX_ENTRIES", "10000"))
+USER_ROLE_CACHE_TTL_SECONDS = float(getenv("USER_ROLE_CACHE_TTL_SECONDS", "600"))
+
+# (provider, user_id) -> role
+user_role_cache: TTLCache[tuple[str, str], str] = TTLCache("user_role_cache", max_entries=USER_ROLE_CACHE_MAX_ENTRIES)
+
 
 @cache
 def get_artifact_service():
@@ -32,54 +48,128 @@ def get_session_service() -> BaseSessionService:
     return InMemorySessionService()
 
 
+@cache
+def get_response_cache() -> ResponseCache | None:
+    """
+    Initialise and return the first-turn response cache, or None if it is not enabled (RESPONSE_CACHE_ENABLED).
+    Prompts with no exact match are also looked up by similarity if SEMANTIC_CACHE_ENABLED is set.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+
+    semantic = None
+    if SEMANTIC_CACHE_ENABLED:
+        logger.info("Using semantic cache for first-turn replies")
+        semantic = SemanticCache(genai_embedder())
+
+    logger.info("Using in-memory first-turn response cache")
+    return ResponseCache(InMemoryResponseCacheBackend(), semantic=semantic)
+
+
 @cache
 def _get_firestore_client() -> firestore.Client:
-    """Initialise and return the Firestore client."""
+    """
+    Initialise and return the synchronous Firestore client.
+    Only used by snapshot listeners and background reloads, which run on their own threads.
+    (Listeners are not available on the async client.)
+    """
     return firestore.Client(project=config.project_id)
 
 
-def get_user_role(user_id: str, provider: str) -> str:
+@cache
+def get_access_repository() -> AccessRepository:
+    """Initialise and return the repository used to read and write users and persona tiers on the request path."""
+    return FirestoreAccessRepository(firestore.AsyncClient(project=config.project_id))
+
+
+async def _load_user_role(user_id: str, provider: str) -> str:
+    role = await get_access_repository().get_user_role(user_id, provider)
+    if role is None:
+        logger.debug(f"No Firestore document found for user_id '{user_id}' ({provider})")
+        return "standard"
+    return role
+
+
+async def get_user_role(user_id: str, provider: str) -> str:
     """
-    Retrieve the role for a given user from Firestore.
-    Queries the 'users' collection for a document where both 'id' and 'provider' match.
+    Retrieve the role for a given user.
+    Served from the user role cache where possible. Otherwise, reads the user's document,
+    whose ID is derived from their 'provider' and 'id'. Concurrent lookups for the same user share one read.
     Defaults to 'standard' if the user is not found.
     """
     try:
-        db = _get_firestore_client()
-        # Query by the stable 'id' and 'provider' fields to prevent collisions
-        logger.debug(f"Firestore Query: collection='users', where id == '{user_id}' AND provider == '{provider}'")
-        from google.cloud.firestore_v1.base_query import FieldFilter
-        docs = (
-            db.collection("users")
-            .where(filter=FieldFilter("id", "==", user_id))
-            .where(filter=FieldFilter("provider", "==", provider))
-            .limit(1)
-            .get()
+        return await user_role_cache.get_or_load(
+            (provider, user_id),
+            lambda: _load_user_role(user_id, provider),
+            ttl=lambda _: USER_ROLE_CACHE_TTL_SECONDS,
         )
-
-        if docs:
-            role = docs[0].to_dict().get("role", "standard")
-            logger.debug(f"Retrieved role '{role}' for user_id '{user_id}' ({provider}) from doc '{docs[0].id}'")
-            return role
-        else:
-            logger.debug(f"No Firestore document found for user_id '{user_id}' ({provider})")
     except Exception as e:
         logger.error(f"Error retrieving role for user_id '{user_id}': {e}")
 
     return "standard"
 
 
-def get_required_role(persona_id: str) -> str:
+def invalidate_user_role(user_id: str, provider: str) -> None:
+    """Drop a user's cached role, so that it is read from Firestore on their next request."""
+    user_role_cache.invalidate((provider, user_id))
+
+
+def watch_user_role_changes() -> Callable[[], None]:
     """
-    Retrieve the required role for a given persona from Firestore.
+    Invalidate cached roles as soon as they change in Firestore. Returns a function that stops watching.
+
+    Rather than one listener per cached user, a single listener watches every user with a role above 'standard'.
+    A user being upgraded enters that result set, and a user being downgraded (or deleted) leaves it,
+    so either way we are told about the change.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    def on_snapshot(docs, changes, read_time) -> None:
+        for change in changes:
+            data = change.document.to_dict() or {}
+            if "id" in data and "provider" in data:
+                invalidate_user_role(data["id"], data["provider"])
+
+    query = _get_firestore_client().collection("users").where(filter=FieldFilter("role", "!=", "standard"))
+    watch = query.on_snapshot(on_snapshot)
+    return watch.unsubscribe
+
+
+def _load_persona_tiers() -> TierMap:
+    """Read the whole persona_tiers collection."""
+    db = _get_firestore_client()
+    return {doc.id: (doc.to_dict() or {}).get("required_role", "standard") for doc in db.collection("persona_tiers").stream()}
+
+
+def _subscribe_persona_tiers(on_change: Callable[[TierMap], None]) -> Callable[[], None]:
+    """Listen for changes to the persona_tiers collection. Returns a function that stops listening."""
+
+    def on_snapshot(docs, changes, read_time) -> None:
+        on_change({doc.id: (doc.to_dict() or {}).get("required_role", "standard") for doc in docs})
+
+    watch = _get_firestore_client().collection("persona_tiers").on_snapshot(on_snapshot)
+    return watch.unsubscribe
+
+
+@cache
+def get_persona_tier_table() -> PersonaTierTable:
+    """Return the in-memory persona tier table. Call start() on it to load it and keep it current."""
+    return PersonaTierTable(_load_persona_tiers, _subscribe_persona_tiers)
+
+
+async def get_required_role(persona_id: str) -> str:
+    """
+    Retrieve the required role for a given persona.
+    Served from the in-memory persona tier table; reads Firestore directly only until the table has loaded.
     Defaults to 'standard' if the persona is not found.
     """
+    required_role = get_persona_tier_table().get(persona_id)
+    if required_role is not None:
+        return required_role
+
     try:
-        db = _get_firestore_client()
-        doc_ref = db.collection("persona_tiers").document(persona_id.lower())
-        doc = doc_ref.get()
-        if doc.exists:
-            required_role = doc.to_dict().get("required_role", "standard")
+        required_role = await get_access_repository().get_required_role(persona_id)
+        if required_role is not None:
             logger.debug(f"Retrieved required role '{required_role}' for persona '{persona_id}'")
             return required_role
     except Exception as e:
@@ -88,42 +178,16 @@ def get_required_role(persona_id: str) -> str:
     return "standard"
 
 
+@cache
+def get_user_metadata_writer() -> UserMetadataWriter:
+    """Return the write-behind queue for user metadata. Its run() loop is started by the API on startup."""
+    return UserMetadataWriter(lambda users: get_access_repository().upsert_users(users))
+
+
 def sync_user_metadata(user_id: str, provider: str, email: str, name: str) -> None:
     """
     Ensures user metadata is up to date in Firestore.
-    If the user doesn't exist (queried by 'id' and 'provider' fields), 
-    creates a new document with ID format: {name}:{provider}:{id} for readability.
+    The write happens in the background: see UserMetadataWriter.
+    If the user doesn't exist, a new document is created with ID format: {provider}:{id}
     """
-    try:
-        db = _get_firestore_client()
-        from google.cloud.firestore_v1.base_query import FieldFilter
-        docs = (
-            db.collection("users")
-            .where(filter=FieldFilter("id", "==", user_id))
-            .where(filter=FieldFilter("provider", "==", provider))
-            .limit(1)
-            .get()
-        )
-
-        data = {
-            "id": user_id,
-            "provider": provider,
-            "email": email,
-            "name": name,
-            "last_logged_in": firestore.SERVER_TIMESTAMP
-        }
-
-        if docs:
-            # Update existing document
-            doc_ref = docs[0].reference
-            doc_ref.update(data)
-            logger.debug(f"Updated metadata for user {user_id} ({provider})")
-        else:
-            # Create new document with readable ID
-            # Clean name for ID use (alphanumeric only)
-            safe_name = "".join(c for c in name if c.isalnum()) or f"user-{user_id[:8]}"
-            doc_id = f"{safe_name}:{provider}:{user_id}"
-            data["role"] = "standard"
-            db.collection("users").document(doc_id).set(data)
-    except Exception as e:
-        logger.error(f"Error syncing metadata for user {user_id} ({provider}): {e}")
+    get_user_metadata_writer().enqueue(UserMetadata(user_id, provider, email, name))
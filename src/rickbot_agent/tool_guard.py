@@ -0,0 +1,167 @@
+"""
+Guards around the agent-as-a-tool sub-agents (RagAgent and SearchAgent).
+
+Each of these tools is a full extra model call, backed by File Search or Google Search. When either is slow
+or failing, every turn that calls it would wait on it, or fail with it. So each call goes through a ToolGuard:
+- A bulkhead caps the calls in progress to the tool, across all turns on the instance.
+- A timeout bounds how long one call can take.
+- A circuit breaker stops calling the tool for a while, once too many recent calls have failed or timed out.
+- The request's deadline (see rickbot_utils/deadline.py) caps the timeout, keeping back time for the persona to
+  answer afterwards. If too little time is left, the tool isn't called at all.
+
+A call the guard refuses, or that fails, returns a short "unavailable" result straight away,
+so the persona carries on and answers from its own knowledge, rather than the whole turn failing.
+"""
+
+import asyncio
+import functools
+from collections.abc import Awaitable, Callable
+from os import getenv
+from typing import Any
+
+from google.adk.agents import BaseAgent
+from google.adk.tools import AgentTool, ToolContext
+
+from rickbot_utils.config import logger
+from rickbot_utils.deadline import current_deadline
+from rickbot_utils.metrics import metrics
+from rickbot_utils.resilience import Bulkhead, BulkheadFullException, CircuitBreaker
+
+# The most calls in progress to one tool, across all turns
+TOOL_MAX_CONCURRENT_CALLS = int(getenv("TOOL_MAX_CONCURRENT_CALLS", "8"))
+# How long a call to a tool can take before it is abandoned, and counted as failed
+TOOL_CALL_TIMEOUT_SECONDS = float(getenv("TOOL_CALL_TIMEOUT_SECONDS", "30"))
+# The fraction of a tool's recent calls that must fail for its breaker to open
+TOOL_BREAKER_FAILURE_RATE = float(getenv("TOOL_BREAKER_FAILURE_RATE", "0.5"))
+# How long an open breaker refuses calls before letting a probe call through
+TOOL_BREAKER_OPEN_SECONDS = float(getenv("TOOL_BREAKER_OPEN_SECONDS", "30"))
+# Time kept back from the request's deadline for the persona to write its answer after a tool call
+TOOL_DEADLINE_RESERVE_SECONDS = float(getenv("TOOL_DEADLINE_RESERVE_SECONDS", "10"))
+# A tool isn't called if the request's deadline leaves it less time than this
+TOOL_MIN_CALL_SECONDS = float(getenv("TOOL_MIN_CALL_SECONDS", "3"))
+TOOL_BREAKER_MINIMUM_CALLS = 5
+TOOL_BREAKER_WINDOW_SIZE = 20
+
+
+class ToolUnavailableException(Exception):
+    """The guard refused the call, or the call failed."""
+
+
+class ToolGuard:
+    """Runs calls to one tool inside a bulkhead, with a timeout, behind a circuit breaker."""
+
+    def __init__(
+        self,
+        name: str,
+        bulkhead: Bulkhead,
+        breaker: CircuitBreaker,
+        timeout: float,
+        deadline_reserve: float = TOOL_DEADLINE_RESERVE_SECONDS,
+        min_call_time: float = TOOL_MIN_CALL_SECONDS,
+    ):
+        """
+        Args:
+            name: The tool's name, used in logs and metrics.
+            bulkhead: Caps the calls in progress.
+            breaker: Refuses calls while too many recent calls have failed.
+            timeout: Seconds a call can take before it is abandoned.
+            deadline_reserve: Seconds kept back from the request's deadline, for the answer after the call.
+            min_call_time: The fewest seconds worth starting a call with. With less left, the call is skipped.
+        """
+        self.name = name
+        self.bulkhead = bulkhead
+        self.breaker = breaker
+        self.timeout = timeout
+        self.deadline_reserve = deadline_reserve
+        self.min_call_time = min_call_time
+        self._failures = metrics.counter(f"tool.{name}.failures")
+        self._timeouts = metrics.counter(f"tool.{name}.timeouts")
+        self._skipped = metrics.counter(f"tool.{name}.skipped.deadline")
+
+    async def call[T](self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call fn, if the breaker and bulkhead allow it.
+
+        Raises:
+            ToolUnavailableException: The call was refused, skipped for lack of time, failed, or timed out.
+        """
+        timeout = self.timeout
+        cut_short = False  # Whether the request's deadline, rather than the tool's own timeout, bounds the call
+        if (deadline := current_deadline()) is not None:
+            budget = deadline.remaining() - self.deadline_reserve
+            if budget < self.min_call_time:
+                self._skipped.inc()
+                raise ToolUnavailableException(f"Too little time is left in the request to call {self.name}")
+            cut_short = budget < timeout
+            timeout = min(timeout, budget)
+
+        if not self.breaker.allow():
+            raise ToolUnavailableException(f"{self.name} circuit breaker is open")
+
+        succeeded = None
+        try:
+            async with self.bulkhead.slot(), asyncio.timeout(timeout):
+                result = await fn()
+            succeeded = True
+            return result
+        except BulkheadFullException as e:
+            raise ToolUnavailableException(str(e)) from e
+        except TimeoutError as e:
+            # A call cut short by the request's deadline says nothing about the tool's health
+            succeeded = None if cut_short else False
+            self._timeouts.inc()
+            raise ToolUnavailableException(f"{self.name} timed out after {timeout:.1f}s") from e
+        except Exception as e:
+            succeeded = False
+            self._failures.inc()
+            raise ToolUnavailableException(f"{self.name} failed: {e}") from e
+        finally:
+            self.breaker.record(succeeded)
+
+
+@functools.cache
+def get_tool_guard(name: str) -> ToolGuard:
+    """Return the guard for a tool, shared by every persona agent that uses it."""
+    metrics_name = f"tool.{name}"
+    return ToolGuard(
+        name,
+        Bulkhead(metrics_name, TOOL_MAX_CONCURRENT_CALLS),
+        CircuitBreaker(
+            metrics_name,
+            failure_rate_threshold=TOOL_BREAKER_FAILURE_RATE,
+            minimum_calls=TOOL_BREAKER_MINIMUM_CALLS,
+            window_size=TOOL_BREAKER_WINDOW_SIZE,
+            open_seconds=TOOL_BREAKER_OPEN_SECONDS,
+        ),
+        TOOL_CALL_TIMEOUT_SECONDS,
+    )
+
+
+def unavailable_result(tool_name: str) -> str:
+    """The result given to the model in place of a call that was refused or failed."""
+    return (
+        f"UNAVAILABLE: {tool_name} is temporarily unavailable. Do not call it again for this request. "
+        "Answer from your own knowledge instead, without mentioning this."
+    )
+
+
+class GuardedAgentTool(AgentTool):
+    """An AgentTool whose calls go through a ToolGuard. A refused or failed call returns unavailable_result()."""
+
+    def __init__(self, agent: BaseAgent, guard: ToolGuard | None = None, skip_summarization: bool = False):
+        """
+        Args:
+            agent: The agent to wrap.
+            guard: The guard for the tool's calls. Defaults to the shared guard for the agent's name.
+            skip_summarization: Whether to skip summarization of the agent output.
+        """
+        super().__init__(agent=agent, skip_summarization=skip_summarization)
+        self.guard = guard or get_tool_guard(agent.name)
+
+    async def run_async(self, *, args: dict[str, Any], tool_context: ToolContext) -> Any:
+        run = super().run_async
+        try:
+            return await self.guard.call(lambda: run(args=args, tool_context=tool_context))
+        except ToolUnavailableException as e:
+            logger.warning(f"Tool {self.name} unavailable, so the agent will answer without it: {e}")
+            return unavailable_result(self.name)
@@ -0,0 +1,178 @@
+"""
+Write-behind syncing of user metadata to Firestore.
+
+`/personas` records the user's latest details on every load, which mostly just bumps `last_logged_in`.
+Rather than writing to Firestore inside the request, the details are queued here and written in the background:
+- Only the newest details are kept per user, so a burst of reloads becomes a single write.
+- Each user is written at most once per USER_SYNC_WINDOW_SECONDS. Details arriving within the window are held
+  until it ends, so they are delayed rather than lost.
+- Due writes are flushed in batches every USER_SYNC_FLUSH_INTERVAL_SECONDS, and anything still queued is flushed
+  on shutdown.
+- Failed writes are retried with exponential backoff, from USER_SYNC_RETRY_BASE_SECONDS up to
+  USER_SYNC_RETRY_MAX_SECONDS, so an outage isn't met with a fixed-rate stream of retries.
+  After USER_SYNC_MAX_ATTEMPTS failed attempts, a user's details are dropped.
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from os import getenv
+
+from rickbot_agent.repository import UserMetadata
+from rickbot_utils.config import logger
+from rickbot_utils.metrics import metrics
+from rickbot_utils.ttl_cache import TTLCache
+
+USER_SYNC_WINDOW_SECONDS = float(getenv("USER_SYNC_WINDOW_SECONDS", "300"))
+USER_SYNC_FLUSH_INTERVAL_SECONDS = float(getenv("USER_SYNC_FLUSH_INTERVAL_SECONDS", "2"))
+USER_SYNC_MAX_BATCH_SIZE = 500  # Firestore's limit on writes per batch
+USER_SYNC_MAX_TRACKED_USERS = int(getenv("USER_SYNC_MAX_TRACKED_USERS", "100000"))
+USER_SYNC_RETRY_BASE_SECONDS = float(getenv("USER_SYNC_RETRY_BASE_SECONDS", "5"))
+USER_SYNC_RETRY_MAX_SECONDS = float(getenv("USER_SYNC_RETRY_MAX_SECONDS", "300"))
+USER_SYNC_MAX_ATTEMPTS = int(getenv("USER_SYNC_MAX_ATTEMPTS", "6"))
+
+
+# Writes a batch of users to the store
+BatchWriter = Callable[[list[UserMetadata]], Awaitable[None]]
+
+
+class UserMetadataWriter:
+    """Debounces and batches user metadata writes."""
+
+    def __init__(
+        self,
+        write_batch: BatchWriter,
+        window: float = USER_SYNC_WINDOW_SECONDS,
+        flush_interval: float = USER_SYNC_FLUSH_INTERVAL_SECONDS,
+        max_batch_size: int = USER_SYNC_MAX_BATCH_SIZE,
+        retry_base: float = USER_SYNC_RETRY_BASE_SECONDS,
+        retry_max: float = USER_SYNC_RETRY_MAX_SECONDS,
+        max_attempts: int = USER_SYNC_MAX_ATTEMPTS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            write_batch: Writes a batch of users to the store.
+            window: The minimum number of seconds between writes for the same user.
+            flush_interval: Seconds between background flushes.
+            max_batch_size: The maximum number of users written in one batch.
+            retry_base: Seconds before the first retry of a failed write. Each further retry waits twice as long.
+            retry_max: The longest wait between retries.
+            max_attempts: Failed attempts after which a user's details are dropped.
+            clock: Returns the current time in seconds.
+        """
+        self._write_batch = write_batch
+        self.window = window
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._pending: dict[tuple[str, str], tuple[float, UserMetadata]] = {}  # (provider, user_id) -> (due_at, metadata)
+        self._failed_attempts: dict[tuple[str, str], int] = {}  # (provider, user_id) -> failed writes in a row
+        # (provider, user_id) -> when the user was last written. Entries expire when the window ends.
+        self._last_written: TTLCache[tuple[str, str], float] = TTLCache(
+            "user_sync.recently_written", max_entries=USER_SYNC_MAX_TRACKED_USERS, clock=clock
+        )
+        self._flush_lock = asyncio.Lock()
+        self._coalesced = metrics.counter("user_sync.coalesced")
+        self._written = metrics.counter("user_sync.written")
+        self._failures = metrics.counter("user_sync.failures")
+        self._dropped = metrics.counter("user_sync.dropped")
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, user: UserMetadata) -> None:
+        """Queue the user's latest details for writing, replacing any details already queued for them."""
+        key = (user.provider, user.user_id)
+        if key in self._pending:
+            due_at, _ = self._pending[key]
+            self._coalesced.inc()
+        else:
+            last_written = self._last_written.get(key)
+            due_at = self._clock() if last_written is None else last_written + self.window
+
+        self._pending[key] = (due_at, user)
+
+    async def flush(self, force: bool = False) -> int:
+        """
+        Write every user whose write is due, in batches.
+
+        Args:
+            force: Write everything queued, whether due or not. Used on shutdown.
+
+        Returns:
+            The number of users written.
+        """
+        async with self._flush_lock:
+            now = self._clock()
+            due = [(key, entry) for key, entry in self._pending.items() if force or entry[0] <= now]
+            written = 0
+
+            for start in range(0, len(due), self.max_batch_size):
+                batch = due[start : start + self.max_batch_size]
+                # Mark as written before awaiting, so details queued during the write wait for the next window
+                written_at = self._clock()
+                for key, _ in batch:
+                    del self._pending[key]
+                    self._last_written.set(key, written_at, self.window)
+
+                try:
+                    await self._write_batch([user for _, (_, user) in batch])
+                except Exception as e:
+                    self._failures.inc()
+                    self._retry_later(batch, e)
+                    continue
+
+                for key, _ in batch:
+                    self._failed_attempts.pop(key, None)
+                written += len(batch)
+
+            self._written.inc(written)
+            return written
+
+    def _retry_later(self, batch: list[tuple[tuple[str, str], tuple[float, UserMetadata]]], error: Exception) -> None:
+        """Requeue the users of a failed batch, after a backoff, or drop those that have failed too many times."""
+        dropped = 0
+        retry_at = None
+        for key, (_, user) in batch:
+            self._last_written.invalidate(key)
+            attempts = self._failed_attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                self._failed_attempts.pop(key, None)
+                dropped += 1
+                # Newer details queued in the meantime are kept, and get attempts of their own
+                pending = self._pending.get(key)
+                if pending is not None and pending[1] is user:
+                    del self._pending[key]
+                continue
+
+            self._failed_attempts[key] = attempts
+            retry_at = self._clock() + min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            # Newer details queued in the meantime take precedence, but wait for the retry too
+            _, user = self._pending.get(key, (retry_at, user))
+            self._pending[key] = (retry_at, user)
+
+        if dropped:
+            self._dropped.inc(dropped)
+            logger.error(
+                f"Failed to sync metadata for {len(batch)} users: {error}. "
+                f"Dropped {dropped} after {self.max_attempts} attempts."
+            )
+        if retry_at is not None:
+            logger.error(f"Failed to sync metadata for {len(batch) - dropped} users. Will retry: {error}")
+
+    async def run(self) -> None:
+        """Flush due writes periodically, until cancelled."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded, so cancelling the loop on shutdown doesn't abandon a batch mid-write
+            await asyncio.shield(self.flush())
+
+    async def drain(self) -> None:
+        """Write everything still queued. Called on shutdown."""
+        if self._pending:
+            logger.info(f"Flushing metadata for {len(self._pending)} users before shutdown")
+            await self.flush(force=True)
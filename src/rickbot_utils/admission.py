@@ -0,0 +1,235 @@
+"""
+Admission control for agent runs.
+
+Without a limit, a burst of chat requests all run the agent at once: they compete for Gemini quota and memory,
+and every one of them slows down together. Instead, each agent run holds a permit from the AdmissionController
+for as long as it runs. Once the instance's concurrency limit is reached, further requests wait in a bounded queue,
+and are turned away with 503 and a Retry-After if the queue is full, or if they wait too long.
+
+The concurrency limit adapts to observed run latency, in the style of a gradient limiter: while runs are no slower
+than the long-term average, the limit grows (if it is being used); when runs slow down, which is the sign that the
+model or the instance is saturating, it shrinks in proportion. Failed runs also shrink it.
+
+Supporters are admitted ahead of anyone else waiting. When the queue is full, a supporter takes the place of the
+most recently queued standard request, which is turned away instead.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager, suppress
+from os import getenv
+
+from rickbot_utils.metrics import metrics
+
+ADMISSION_INITIAL_LIMIT = int(getenv("ADMISSION_INITIAL_LIMIT", "16"))
+ADMISSION_MIN_LIMIT = int(getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(getenv("ADMISSION_MAX_LIMIT", "64"))
+# Requests that can wait for a permit, beyond those running
+ADMISSION_QUEUE_MAX = int(getenv("ADMISSION_QUEUE_MAX", "32"))
+# How long a request waits for a permit before it is turned away
+ADMISSION_MAX_WAIT_SECONDS = float(getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+
+# How far the limit moves towards each new estimate
+_LIMIT_SMOOTHING = 0.2
+# How far the long-term latency average moves towards each new run's latency
+_LONG_LATENCY_SMOOTHING = 0.05
+# The most a single slow run can shrink the limit by, as a fraction
+_MIN_GRADIENT = 0.5
+# How much a failed run shrinks the limit by, as a fraction
+_FAILURE_BACKOFF = 0.9
+_RETRY_AFTER_MAX_SECONDS = 30
+
+
+class AdmissionRejectedException(Exception):
+    """The instance is too busy to run this request. It can be retried after retry_after seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Too busy to run the request ({reason}). Retry after {retry_after}s.")
+
+
+class Permit:
+    """Permission to run. Must be released when the run ends."""
+
+    __slots__ = ("_controller", "_released", "started")
+
+    def __init__(self, controller: "AdmissionController", started: float):
+        self._controller = controller
+        self._released = False
+        self.started = started
+
+    def release(self, succeeded: bool | None = True) -> None:
+        """
+        Give up the permit, so the next request can run. Releasing a permit more than once does nothing.
+
+        Args:
+            succeeded: Whether the run succeeded, which adjusts the limit. None if the run says nothing about
+                the model's capacity (e.g. it was cancelled), so the limit is left alone.
+        """
+        if not self._released:
+            self._released = True
+            self._controller._release(self, succeeded)
+
+
+class AdmissionController:
+    """Limits the agent runs in progress on this instance, queueing the rest, with priority for supporters."""
+
+    def __init__(
+        self,
+        initial_limit: int = ADMISSION_INITIAL_LIMIT,
+        min_limit: int = ADMISSION_MIN_LIMIT,
+        max_limit: int = ADMISSION_MAX_LIMIT,
+        queue_max: int = ADMISSION_QUEUE_MAX,
+        max_wait: float = ADMISSION_MAX_WAIT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            initial_limit: The concurrency limit before any runs have been observed.
+            min_limit: The lowest the limit can adapt to.
+            max_limit: The highest the limit can adapt to.
+            queue_max: The most requests that can wait for a permit.
+            max_wait: Seconds a request waits for a permit before it is turned away.
+            clock: Returns the current time in seconds.
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.queue_max = queue_max
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.long_latency: float | None = None  # The long-term average run latency, in seconds
+        self._clock = clock
+        self._waiters: dict[bool, deque[asyncio.Future[Permit]]] = {True: deque(), False: deque()}  # By priority
+
+        self._admitted = metrics.counter("admission.admitted")
+        self._queued = metrics.counter("admission.queued")
+        self._rejected_queue_full = metrics.counter("admission.rejected.queue_full")
+        self._rejected_timeout = metrics.counter("admission.rejected.timeout")
+        self._displaced = metrics.counter("admission.rejected.displaced")
+        self._wait_time = metrics.histogram("admission.wait_seconds")
+
+    @property
+    def queued(self) -> int:
+        """The number of requests waiting for a permit."""
+        return sum(1 for waiters in self._waiters.values() for waiter in waiters if not waiter.done())
+
+    async def acquire(self, priority: bool = False) -> Permit:
+        """
+        Wait for a permit to run.
+
+        Args:
+            priority: Admit ahead of requests without priority.
+
+        Raises:
+            AdmissionRejectedException: The queue is full, or no permit was free within max_wait.
+        """
+        if self.in_flight < int(self.limit) and not self.queued:
+            return self._admit()
+
+        if self.queued >= self.queue_max:
+            standard_waiters = self._waiters[False]
+            if not (priority and _pop_pending(standard_waiters, self._displace, newest=True)):
+                self._rejected_queue_full.inc()
+                raise AdmissionRejectedException("queue full", self.retry_after())
+
+        waiter: asyncio.Future[Permit] = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[priority]
+        waiters.append(waiter)
+        self._queued.inc()
+        queued_at = self._clock()
+        try:
+            async with asyncio.timeout(self.max_wait):
+                permit = await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                waiter.result().release(None)  # Granted just as we gave up waiting
+            with suppress(ValueError):
+                waiters.remove(waiter)
+            if isinstance(e, TimeoutError):
+                self._rejected_timeout.inc()
+                raise AdmissionRejectedException("timed out waiting", self.retry_after()) from None
+            raise
+
+        self._wait_time.observe(self._clock() - queued_at)
+        return permit
+
+    @asynccontextmanager
+    async def admit(self, priority: bool = False) -> AsyncIterator[Permit]:
+        """Hold a permit while the context is open. A run that raises counts as failed."""
+        permit = await self.acquire(priority)
+        try:
+            yield permit
+        except asyncio.CancelledError:
+            permit.release(None)
+            raise
+        except Exception:
+            permit.release(False)
+            raise
+        finally:
+            permit.release(True)
+
+    def retry_after(self) -> int:
+        """Seconds a turned-away request should wait before retrying: roughly how long the queue takes to drain."""
+        latency = self.long_latency or 1.0
+        drain = (self.queued + 1) * latency / max(self.limit, 1)
+        return max(1, min(_RETRY_AFTER_MAX_SECONDS, math.ceil(drain)))
+
+    def _admit(self) -> Permit:
+        self.in_flight += 1
+        self._admitted.inc()
+        return Permit(self, self._clock())
+
+    def _displace(self, waiter: asyncio.Future[Permit]) -> None:
+        self._displaced.inc()
+        waiter.set_exception(AdmissionRejectedException("displaced by a supporter", self.retry_after()))
+
+    def _release(self, permit: Permit, succeeded: bool | None) -> None:
+        self.in_flight -= 1
+        if succeeded is not None:
+            self._update_limit(self._clock() - permit.started, succeeded)
+
+        # Hand the freed permits straight to the longest waiting requests, supporters first
+        while self.in_flight < int(self.limit):
+            if not (_pop_pending(self._waiters[True], self._grant) or _pop_pending(self._waiters[False], self._grant)):
+                break
+
+    def _grant(self, waiter: asyncio.Future[Permit]) -> None:
+        waiter.set_result(self._admit())
+
+    def _update_limit(self, latency: float, succeeded: bool) -> None:
+        if not succeeded:
+            self.limit = max(self.min_limit, self.limit * _FAILURE_BACKOFF)
+            return
+
+        if self.long_latency is None:
+            self.long_latency = latency
+        else:
+            self.long_latency += (latency - self.long_latency) * _LONG_LATENCY_SMOOTHING
+
+        # Runs slower than the long-term average mean we're past the model's (or the instance's) capacity
+        gradient = max(_MIN_GRADIENT, min(1.0, self.long_latency / latency)) if latency > 0 else 1.0
+        # Only grow a limit that is being used, or it can grow without bound while the instance is quiet
+        headroom = math.sqrt(self.limit) if self.in_flight + 1 >= self.limit / 2 else 0.0
+        estimate = self.limit * gradient + headroom
+        limit = self.limit + (estimate - self.limit) * _LIMIT_SMOOTHING
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+
+def _pop_pending(
+    waiters: deque[asyncio.Future[Permit]], action: Callable[[asyncio.Future[Permit]], None], newest: bool = False
+) -> bool:
+    """
+    Remove the oldest (or newest) waiter that is still waiting, and apply action to it.
+    Waiters that have given up are discarded on the way. Returns whether there was one.
+    """
+    while waiters:
+        waiter = waiters.pop() if newest else waiters.popleft()
+        if not waiter.done():
+            action(waiter)
+            return True
+    return False
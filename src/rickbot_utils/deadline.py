@@ -0,0 +1,57 @@
+"""
+Request deadlines.
+
+A turn can chain several model calls: the persona, then RagAgent, then SearchAgent, then the persona again.
+Each call has its own timeout, but nothing bounded the turn as a whole. So each request is given a deadline
+when it arrives, and the agent run is stopped when it passes. The deadline is carried through the run in a
+context variable, so that code further down, such as the tool guards, can check how much time is left before
+starting more work, and cap how long that work can take.
+"""
+
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class Deadline:
+    """A point in time by which a request must be answered."""
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            seconds: The time budget, from now.
+            clock: Returns the current time in seconds. Injectable for tests.
+        """
+        self.seconds = seconds
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left until the deadline, or 0 once it has passed."""
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current_deadline: ContextVar[Deadline | None] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Deadline | None:
+    """The deadline of the request being handled, or None if it has none."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline | None) -> Iterator[None]:
+    """
+    Make deadline the current deadline while the context is open.
+    Tasks created inside the context, e.g. an agent run in the background, carry it with them.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
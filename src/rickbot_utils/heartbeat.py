@@ -0,0 +1,113 @@
+"""
+One heartbeat scheduler for all open SSE streams.
+
+Proxies (and Cloud Run's frontend) close connections that go quiet, so a stream waiting on a long tool call
+is sent a `: heartbeat` comment once it has been idle for SSE_HEARTBEAT_INTERVAL_SECONDS.
+Rather than each stream running its own timer task, streams register here, and a single ticker
+posts heartbeats to just the streams that are due.
+
+Streams are held in order of when they were last active, so each tick only looks at the streams that are due.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from os import getenv
+from typing import Any
+
+from rickbot_utils.config import logger
+from rickbot_utils.metrics import metrics
+
+# Send a heartbeat to a stream once it has sent nothing for this many seconds
+SSE_HEARTBEAT_INTERVAL_SECONDS = float(getenv("SSE_HEARTBEAT_INTERVAL_SECONDS", "15"))
+# How often the ticker checks for due streams, which bounds how late a heartbeat can be
+SSE_HEARTBEAT_TICK_SECONDS = 1.0
+
+HEARTBEAT = "heartbeat"  # Posted to a stream's queue when it is due a heartbeat
+
+
+class HeartbeatStream:
+    """A stream registered for heartbeats."""
+
+    __slots__ = ("_scheduler", "last_active", "queue")
+
+    def __init__(self, scheduler: "HeartbeatScheduler", queue: asyncio.Queue[Any], now: float):
+        self._scheduler = scheduler
+        self.queue = queue
+        self.last_active = now
+
+    def touch(self) -> None:
+        """Record that the stream has just sent something, so it isn't due a heartbeat."""
+        self._scheduler._touch(self)
+
+
+class HeartbeatScheduler:
+    """Posts HEARTBEAT to the queue of each registered stream that has been idle for the interval."""
+
+    def __init__(
+        self,
+        interval: float = SSE_HEARTBEAT_INTERVAL_SECONDS,
+        tick: float = SSE_HEARTBEAT_TICK_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            interval: Seconds a stream can be idle before it is sent a heartbeat.
+            tick: Seconds between checks for due streams.
+            clock: Returns the current time in seconds.
+        """
+        self.interval = interval
+        self.tick_interval = tick
+        self._clock = clock
+        # Least recently active first. Insertion order is kept up to date by moving touched streams to the end.
+        self._streams: OrderedDict[int, HeartbeatStream] = OrderedDict()
+        self._sent = metrics.counter("sse.heartbeats_sent")
+        self._skipped = metrics.counter("sse.heartbeats_skipped")
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    @contextmanager
+    def register(self, queue: asyncio.Queue[Any]) -> Iterator[HeartbeatStream]:
+        """Send heartbeats to this queue while the context is open. The stream is unregistered on exit."""
+        stream = HeartbeatStream(self, queue, self._clock())
+        self._streams[id(stream)] = stream
+        try:
+            yield stream
+        finally:
+            self._streams.pop(id(stream), None)
+
+    def _touch(self, stream: HeartbeatStream) -> None:
+        stream.last_active = self._clock()
+        if id(stream) in self._streams:
+            self._streams.move_to_end(id(stream))
+
+    def tick(self) -> int:
+        """Post a heartbeat to every stream that is due one. Returns the number posted."""
+        now = self._clock()
+        due: list[HeartbeatStream] = []
+        for stream in self._streams.values():
+            if now - stream.last_active < self.interval:
+                break  # The rest were active more recently
+            due.append(stream)
+
+        posted = 0
+        for stream in due:
+            try:
+                stream.queue.put_nowait(HEARTBEAT)
+                posted += 1
+            except asyncio.QueueFull:
+                self._skipped.inc()  # The stream has events waiting to be sent, so doesn't need a heartbeat
+            self._touch(stream)
+
+        self._sent.inc(posted)
+        return posted
+
+    async def run(self) -> None:
+        """Post heartbeats to due streams, until cancelled."""
+        logger.debug(f"Heartbeat scheduler started, interval={self.interval}s")
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.tick()
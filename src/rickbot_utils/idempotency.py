@@ -0,0 +1,84 @@
+"""
+Deduplication of repeated submissions.
+
+If a user double-submits, or a client retries a request that timed out, the same prompt would run twice:
+paying for the model twice, and interleaving two runs on the same session. So a client can send an idempotency
+key with a submission. The first submission with a key runs, and any repeat of it with the same key, whether
+it arrives while the first is running or within IDEMPOTENCY_KEY_TTL_SECONDS after, gets the first one's result
+instead of running again.
+
+Keys are scoped to the user, and bound to the request they were first sent with:
+reusing a key for a different request is an error, rather than silently returning the wrong result.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from os import getenv
+
+from rickbot_utils.metrics import metrics
+from rickbot_utils.ttl_cache import TTLCache
+
+# How long a completed submission is remembered, so that a repeat of it can be answered
+IDEMPOTENCY_KEY_TTL_SECONDS = float(getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "300"))
+IDEMPOTENCY_MAX_KEYS = int(getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+
+class IdempotencyKeyReusedException(Exception):
+    """An idempotency key was sent again, with a different request."""
+
+
+class IdempotencyRegistry[V]:
+    """Runs each (owner, key) submission once, and gives repeats of it the same result."""
+
+    def __init__(self, name: str, ttl: float = IDEMPOTENCY_KEY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        """
+        Args:
+            name: Used as the prefix for this registry's metrics.
+            ttl: Seconds a submission is remembered for, from when it was first sent.
+            max_keys: The most submissions remembered. Past this, the least recently used are forgotten.
+        """
+        self.ttl = ttl
+        # (owner, key) -> (fingerprint, task)
+        self._submissions: TTLCache[tuple[str, str], tuple[Hashable, asyncio.Future[V]]] = TTLCache(
+            name, max_entries=max_keys
+        )
+        self._duplicates = metrics.counter(f"{name}.duplicates")
+
+    def __len__(self) -> int:
+        return len(self._submissions)
+
+    async def run_once(self, owner: str, key: str, fingerprint: Hashable, fn: Callable[[], Awaitable[V]]) -> V:
+        """
+        Return the result of fn, running it only if this is the first submission of the key.
+
+        The run is shielded, so a submitter that goes away doesn't cancel it for the repeats waiting on it.
+        If it fails, the key is forgotten, so the submission can be retried.
+
+        Args:
+            owner: The user the key belongs to.
+            key: The idempotency key sent with the submission.
+            fingerprint: Identifies the request. Repeats must have the same fingerprint.
+            fn: Runs the submission.
+
+        Raises:
+            IdempotencyKeyReusedException: The key was first sent with a different request.
+        """
+        submission_key = (owner, key)
+        submission = self._submissions.get(submission_key)
+        if submission is not None:
+            first_fingerprint, task = submission
+            if first_fingerprint != fingerprint:
+                raise IdempotencyKeyReusedException(f"Idempotency key '{key}' was already used for a different request")
+            self._duplicates.inc()
+        else:
+            task = asyncio.ensure_future(fn())
+            self._submissions.set(submission_key, (fingerprint, task), self.ttl)
+            task.add_done_callback(lambda t: self._forget_failed(submission_key, t))
+
+        return await asyncio.shield(task)
+
+    def _forget_failed(self, submission_key: tuple[str, str], task: asyncio.Future[V]) -> None:
+        if task.cancelled() or task.exception() is not None:  # Marks the exception retrieved
+            submission = self._submissions.get(submission_key)
+            if submission is not None and submission[1] is task:
+                self._submissions.invalidate(submission_key)
@@ -0,0 +1,85 @@
+"""
+One asyncio lock per key, e.g. per chat session.
+
+Two turns running at once on one session would interleave their reads and writes of its state, and each would
+be answered without the other's exchange in its history. Holding the session's lock for the whole turn makes
+turns for one session run one after another, in the order they arrived, while turns for different sessions
+still run concurrently. Locks are created on demand, and dropped once nothing holds or waits for them.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator, Callable, Hashable
+from contextlib import asynccontextmanager
+
+from rickbot_utils.metrics import metrics
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0  # Holding or waiting for the lock
+
+
+class KeyedLock[K: Hashable]:
+    """Serialises work per key."""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Used as the prefix for this lock's metrics.
+        """
+        self._entries: dict[K, _Entry] = {}
+        self._waits = metrics.counter(f"{name}.waits")
+
+    def __len__(self) -> int:
+        """The number of keys held or waited for."""
+        return len(self._entries)
+
+    def locked(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    async def acquire(self, key: K) -> Callable[[], None]:
+        """
+        Wait for the lock for key. Returns a function that releases it, which can be called from any task,
+        e.g. a background task that carries on the work. Calling it more than once does nothing.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.users += 1
+        if entry.lock.locked():
+            self._waits.inc()
+
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._leave(key, entry)
+            raise
+
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                entry.lock.release()
+                self._leave(key, entry)
+
+        return release
+
+    @asynccontextmanager
+    async def hold(self, key: K) -> AsyncIterator[None]:
+        """Hold the lock for key while the context is open."""
+        release = await self.acquire(key)
+        try:
+            yield
+        finally:
+            release()
+
+    def _leave(self, key: K, entry: _Entry) -> None:
+        entry.users -= 1
+        if not entry.users and self._entries.get(key) is entry:
+            del self._entries[key]
@@ -0,0 +1,94 @@
+"""Lightweight in-process metrics.
+
+Metrics are held in memory per instance and exposed as JSON via the API's `/metrics` endpoint.
+They are deliberately simple: we only need cheap counters and histograms on the hot path, not a full metrics stack.
+"""
+
+import bisect
+import threading
+from typing import Any
+
+# Upper bounds, in seconds, for latency histograms
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """A thread-safe, monotonically increasing counter."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        """Increment the counter by the given amount."""
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Histogram:
+    """A thread-safe histogram of observed values, with cumulative bucket counts (as per Prometheus)."""
+
+    def __init__(self, name: str, buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # The final slot counts values above the largest bucket
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record a single observed value."""
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the observation count, sum, and cumulative count per bucket."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative: dict[str, int] = {}
+        running = 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], counts, strict=True):
+            running += count
+            cumulative[bound] = running
+
+        return {"count": running, "sum": total, "buckets": cumulative}
+
+
+class MetricsRegistry:
+    """Holds all metrics for this process, keyed by name."""
+
+    def __init__(self) -> None:
+        self._counters: dict[str, Counter] = {}
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        """Return the counter with the given name, creating it if it doesn't exist."""
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter(name)
+            return self._counters[name]
+
+    def histogram(self, name: str, buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        """Return the histogram with the given name, creating it if it doesn't exist."""
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, buckets)
+            return self._histograms[name]
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the current value of every metric."""
+        with self._lock:
+            counters = {name: counter.value for name, counter in sorted(self._counters.items())}
+            histograms = dict(sorted(self._histograms.items()))
+        return {"counters": counters, "histograms": {name: h.snapshot() for name, h in histograms.items()}}
+
+
+metrics = MetricsRegistry()
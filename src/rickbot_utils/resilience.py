@@ -0,0 +1,166 @@
+"""
+Bulkheads and circuit breakers, for isolating calls to dependencies that can be slow or fail.
+
+A Bulkhead caps the calls in progress to one dependency, so that when it slows down,
+calls pile up against their own limit rather than tying up everything else.
+
+A CircuitBreaker watches the outcomes of recent calls. Once the failure rate over the last `window_size` calls
+reaches `failure_rate_threshold`, it opens, and calls are refused straight away rather than waiting on a
+dependency that is failing. After `open_seconds` it half-opens, letting `half_open_probes` calls through:
+if they succeed it closes again, and if any fails it re-opens.
+"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from enum import StrEnum
+
+from rickbot_utils.config import logger
+from rickbot_utils.metrics import metrics
+
+
+class BulkheadFullException(Exception):
+    """Every slot of a bulkhead is in use."""
+
+
+class Bulkhead:
+    """Limits the calls in progress to one dependency."""
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float = 0.0):
+        """
+        Args:
+            name: Used as the prefix for this bulkhead's metrics.
+            max_concurrent: The most calls in progress at once.
+            max_wait: Seconds a call waits for a slot before it is refused. 0 refuses it straight away.
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._rejected = metrics.counter(f"{name}.bulkhead_rejected")
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Hold a slot while the context is open.
+
+        Raises:
+            BulkheadFullException: No slot was free within max_wait.
+        """
+        if self._semaphore.locked() and self.max_wait <= 0:
+            self._rejected.inc()
+            raise BulkheadFullException(f"{self.name} has {self.max_concurrent} calls in progress")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait or None)
+        except TimeoutError:
+            self._rejected.inc()
+            raise BulkheadFullException(f"No free slot for {self.name} within {self.max_wait}s") from None
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Refuses calls to a dependency while too many recent calls to it have failed."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        minimum_calls: int = 5,
+        window_size: int = 20,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            name: Used in logs, and as the prefix for this breaker's metrics.
+            failure_rate_threshold: The fraction of failed calls, over the window, at which the breaker opens.
+            minimum_calls: The fewest calls in the window before the failure rate is acted on.
+            window_size: The number of most recent calls the failure rate is measured over.
+            open_seconds: How long the breaker stays open before letting probe calls through.
+            half_open_probes: The number of successful probe calls needed to close the breaker.
+            clock: Returns the current time in seconds.
+        """
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._state = CircuitState.CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=window_size)  # True for each success
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        self._opened = metrics.counter(f"{name}.breaker_opened")
+        self._rejected = metrics.counter(f"{name}.breaker_rejected")
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state is CircuitState.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = CircuitState.HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        return self._state
+
+    @property
+    def failure_rate(self) -> float:
+        """The fraction of calls in the window that failed."""
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead. Every call allowed must have its outcome recorded."""
+        state = self.state
+        if state is CircuitState.CLOSED:
+            return True
+        if state is CircuitState.HALF_OPEN and self._probes_in_flight < self.half_open_probes - self._probe_successes:
+            self._probes_in_flight += 1
+            return True
+        self._rejected.inc()
+        return False
+
+    def record(self, succeeded: bool | None) -> None:
+        """
+        Record the outcome of an allowed call.
+
+        Args:
+            succeeded: Whether the call succeeded. None if it was abandoned (e.g. cancelled),
+                which counts towards neither rate.
+        """
+        state = self.state
+        if state is CircuitState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if succeeded is False:
+                self._open("a probe call failed")
+            elif succeeded:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    logger.info(f"Circuit breaker {self.name} closed")
+                    self._state = CircuitState.CLOSED
+                    self._outcomes.clear()
+        elif state is CircuitState.CLOSED and succeeded is not None:
+            self._outcomes.append(succeeded)
+            if len(self._outcomes) >= self.minimum_calls and self.failure_rate >= self.failure_rate_threshold:
+                self._open(f"{self.failure_rate:.0%} of the last {len(self._outcomes)} calls failed")
+        # Outcomes of calls that finish while the breaker is open are ignored
+
+    def _open(self, reason: str) -> None:
+        logger.warning(f"Circuit breaker {self.name} opened for {self.open_seconds}s: {reason}")
+        self._state = CircuitState.OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self._opened.inc()
@@ -0,0 +1,165 @@
+"""Encoding of Server-Sent Events (SSE) frames.
+
+Every frame sent by `/chat_stream` is a single `data:` line holding a JSON object, e.g. `data: {"chunk":"Hello"}`.
+Frames are encoded straight to bytes, using orjson where it is installed (the `speedups` extra),
+and falling back to the standard library otherwise.
+The fixed parts of the most frequent frames are precomputed, so a text chunk only needs its text serialising.
+
+Model text arrives a few tokens at a time. Rather than sending each fragment as its own frame,
+ChunkCoalescer buffers the text and sends it as one chunk once it is old enough, big enough,
+or reaches the end of a sentence.
+"""
+
+import json
+import re
+import time
+from collections.abc import Callable
+from os import getenv
+from typing import Any
+
+from rickbot_utils.metrics import metrics
+
+# Send buffered text once the oldest of it has waited this long. 0 sends every fragment as soon as it arrives.
+SSE_COALESCE_MAX_DELAY_MS = float(getenv("SSE_COALESCE_MAX_DELAY_MS", "50"))
+# Send buffered text once it reaches this many bytes (UTF-8)
+SSE_COALESCE_MAX_BYTES = int(getenv("SSE_COALESCE_MAX_BYTES", "1024"))
+# Send buffered text as soon as it completes a sentence or line
+SSE_COALESCE_ON_SENTENCE = getenv("SSE_COALESCE_ON_SENTENCE", "true").lower() == "true"
+
+# Matches up to the end of the last sentence: terminal punctuation (and any closing quotes or brackets)
+# followed by whitespace, or a newline
+_LAST_SENTENCE_END = re.compile(r"""(?s).*(?:[.!?\u2026]["')\]\u201d\u2019]*\s+|\n)""")
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        """Serialise to compact JSON bytes."""
+        return orjson.dumps(obj)
+
+except ImportError:  # pragma: no cover - depends on the environment
+
+    def dumps(obj: Any) -> bytes:
+        """Serialise to compact JSON bytes."""
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+DATA_PREFIX = b"data: "
+FRAME_END = b"\n\n"
+
+_CHUNK_PREFIX = b'data: {"chunk":'
+_ID_PREFIX = b"id: "
+_OBJECT_FRAME_END = b"}" + FRAME_END
+
+HEARTBEAT_FRAME = b": heartbeat" + FRAME_END
+DONE_FRAME = DATA_PREFIX + dumps({"done": True}) + FRAME_END
+
+
+def encode_event(payload: dict[str, Any]) -> bytes:
+    """Encode a JSON object as a `data:` frame."""
+    return DATA_PREFIX + dumps(payload) + FRAME_END
+
+
+def encode_chunk(text: str) -> bytes:
+    """Encode a text chunk frame: `data: {"chunk": text}`."""
+    return _CHUNK_PREFIX + dumps(text) + _OBJECT_FRAME_END
+
+
+def with_id(event_id: str, frame: bytes) -> bytes:
+    """Add an `id:` line to a frame, which the client sends back as Last-Event-ID when it reconnects."""
+    return _ID_PREFIX + event_id.encode() + b"\n" + frame
+
+
+class ChunkCoalescer:
+    """
+    Coalesces text fragments into fewer, larger chunk frames.
+
+    Buffered text is sent when the first of these happens:
+    - The oldest buffered text has waited `max_delay` seconds.
+    - The buffer reaches `max_bytes`.
+    - The buffer completes a sentence. Text up to the end of the last complete sentence is sent,
+      and the rest stays buffered.
+
+    The caller must call `flush()` when `time_until_flush()` has passed, even if no more text arrives,
+    and before sending any other frame (e.g. a tool call, or done), so that frames are never reordered.
+    """
+
+    def __init__(
+        self,
+        max_delay: float = SSE_COALESCE_MAX_DELAY_MS / 1000,
+        max_bytes: int = SSE_COALESCE_MAX_BYTES,
+        flush_on_sentence: bool = SSE_COALESCE_ON_SENTENCE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_delay: The maximum number of seconds text is held. 0 disables coalescing.
+            max_bytes: The buffer size, in UTF-8 bytes, at which text is sent.
+            flush_on_sentence: Send text as soon as it completes a sentence.
+            clock: Returns the current time in seconds.
+        """
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.flush_on_sentence = flush_on_sentence
+        self._clock = clock
+        self._buffer = ""
+        self._buffered_bytes = 0
+        self._fragments = 0  # Fragments in the buffer
+        self._deadline = 0.0  # When the buffered text must be sent
+        self._coalesced = metrics.counter("sse.fragments_coalesced")
+
+    def __len__(self) -> int:
+        """The number of bytes of text buffered."""
+        return self._buffered_bytes
+
+    def time_until_flush(self) -> float | None:
+        """Seconds until the buffered text is due, or None if nothing is buffered."""
+        if not self._buffer:
+            return None
+        return max(0.0, self._deadline - self._clock())
+
+    def chunk(self, text: str) -> bytes:
+        """Buffer a text fragment. Returns any chunk frame now due, or b"" if there is none."""
+        if self.max_delay <= 0:
+            return encode_chunk(text)
+
+        now = self._clock()
+        if not self._buffer:
+            self._deadline = now + self.max_delay
+        # A sentence end can straddle fragments, e.g. `."` then ` Next`, so rescan the tail of the previous text
+        scan_from = max(0, len(self._buffer) - 8)
+        self._buffer += text
+        self._buffered_bytes += len(text.encode())
+        self._fragments += 1
+
+        if self._buffered_bytes >= self.max_bytes or now >= self._deadline:
+            return self.flush()
+
+        if self.flush_on_sentence:
+            if sentences := _LAST_SENTENCE_END.match(self._buffer, scan_from):
+                return self._send(sentences.end(), now)
+
+        return b""
+
+    def flush(self) -> bytes:
+        """Returns all buffered text as a chunk frame, or b"" if nothing is buffered."""
+        return self._send(len(self._buffer), self._clock())
+
+    def _send(self, end: int, now: float) -> bytes:
+        """Returns a chunk frame for the first `end` characters of the buffer, and keeps the rest buffered."""
+        if end == 0:
+            return b""
+
+        text, self._buffer = self._buffer[:end], self._buffer[end:]
+        if self._fragments > 1:
+            self._coalesced.inc(self._fragments - 1)
+
+        if self._buffer:
+            # The remainder is a partial fragment, counted as a new one, and given a fresh delay
+            self._buffered_bytes = len(self._buffer.encode())
+            self._fragments = 1
+            self._deadline = now + self.max_delay
+        else:
+            self._buffered_bytes = 0
+            self._fragments = 0
+        return encode_chunk(text)
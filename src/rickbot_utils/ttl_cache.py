@@ -0,0 +1,126 @@
+"""Bounded in-process cache with per-entry expiry.
+
+Entries are evicted when they expire, or in least-recently-used order once the cache is full.
+`get_or_load()` also collapses concurrent loads for the same key into a single call (single-flight),
+so a burst of requests for an uncached key only pays the load cost once.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+from rickbot_utils.metrics import metrics
+
+
+class TTLCache[K: Hashable, V]:
+    """
+    A thread-safe LRU cache where every entry has its own time-to-live.
+
+    Hit, miss, coalesced-load and eviction counts are recorded in the metrics registry,
+    prefixed with the cache name (e.g. `auth_cache.hits`).
+    """
+
+    def __init__(self, name: str, max_entries: int, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            name: Used as the prefix for this cache's metrics.
+            max_entries: The maximum number of entries held before the least recently used is evicted.
+            clock: Returns the current time in seconds. Overridable for testing.
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._inflight: dict[K, asyncio.Task[V]] = {}
+
+        self._hits = metrics.counter(f"{name}.hits")
+        self._misses = metrics.counter(f"{name}.misses")
+        self._coalesced = metrics.counter(f"{name}.coalesced")
+        self._evictions = metrics.counter(f"{name}.evictions")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K, default: Any = None) -> V | Any:
+        """Return the cached value for key, or default if it is missing or has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self._hits.inc()
+                    return value
+                del self._entries[key]
+
+        self._misses.inc()
+        return default
+
+    def set(self, key: K, value: V, ttl: float) -> None:
+        """Store value against key for ttl seconds. A non-positive ttl means the value is not cached."""
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions.inc()
+
+    def invalidate(self, key: K) -> None:
+        """Remove key from the cache, if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def items(self) -> list[tuple[K, V]]:
+        """The unexpired (key, value) pairs, least recently used first. Listing them doesn't count as using them."""
+        now = self._clock()
+        with self._lock:
+            return [(key, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_load(self, key: K, loader: Callable[[], Awaitable[V]], ttl: Callable[[V], float]) -> V:
+        """
+        Return the cached value for key, calling loader to produce it on a miss.
+
+        If a load for the same key is already in progress, we wait for that load rather than starting another.
+        The load is shielded, so a cancelled caller does not cancel the load for everyone else.
+
+        Args:
+            key: The cache key.
+            loader: Coroutine function that produces the value.
+            ttl: Returns how long (in seconds) a loaded value may be cached for.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._coalesced.inc()
+        else:
+            task = asyncio.ensure_future(self._load(key, loader, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: K, task: asyncio.Task[V]) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved; any waiters have already been given the exception
+
+    async def _load(self, key: K, loader: Callable[[], Awaitable[V]], ttl: Callable[[V], float]) -> V:
+        value = await loader()
+        self.set(key, value, ttl(value))
+        return value
@@ -0,0 +1,192 @@
+"""
+Resumable SSE streams.
+
+Each `/chat_stream` turn writes its frames to a TurnStream, and each connection follows the TurnStream,
+rather than the connection running the turn itself. Every frame is numbered and sent with an `id:` of
+`{turn_id}:{seq}`. The last SSE_RESUME_BUFFER_FRAMES frames of a turn are held in a ring buffer,
+while it runs and for SSE_RESUME_RETENTION_SECONDS after it finishes.
+
+So if a connection drops mid-answer, the client can reconnect with a `Last-Event-ID` header,
+be sent just the frames it missed, and then follow the rest of the live turn,
+instead of running the whole turn (and every tool call in it) again.
+
+A turn never overwrites frames no connection has been sent: once the buffer is full of them,
+publishing waits for a connection to catch up.
+"""
+
+import asyncio
+import uuid
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from os import getenv
+from typing import Any
+
+from rickbot_utils.ttl_cache import TTLCache
+
+# Frames held per turn, for replay to a reconnecting client
+SSE_RESUME_BUFFER_FRAMES = int(getenv("SSE_RESUME_BUFFER_FRAMES", "256"))
+# How long a finished turn can still be resumed
+SSE_RESUME_RETENTION_SECONDS = float(getenv("SSE_RESUME_RETENTION_SECONDS", "120"))
+# The most turns held at once, live or finished. Past this, the least recently used can no longer be resumed.
+SSE_RESUME_MAX_TURNS = int(getenv("SSE_RESUME_MAX_TURNS", "1000"))
+# An upper bound on how long a live turn is held
+SSE_TURN_MAX_SECONDS = 3600
+
+WAKE = "wake"  # Posted to a follower's queue when new frames are published
+
+
+class StreamGoneException(Exception):
+    """The frames needed to resume a stream are no longer held."""
+
+
+class StreamStalledException(Exception):
+    """No connection caught up with a full stream in time."""
+
+
+def format_event_id(turn_id: str, seq: int) -> str:
+    return f"{turn_id}:{seq}"
+
+
+def parse_event_id(event_id: str) -> tuple[str, int] | None:
+    """Split an event ID into (turn_id, seq), or return None if it isn't one of ours."""
+    turn_id, _, seq = event_id.strip().rpartition(":")
+    if not turn_id or not seq.isdigit():
+        return None
+    return turn_id, int(seq)
+
+
+class TurnStream:
+    """The frames of one chat turn, held in a ring buffer for the connections following it."""
+
+    def __init__(self, turn_id: str, owner: str, capacity: int = SSE_RESUME_BUFFER_FRAMES):
+        """
+        Args:
+            turn_id: Identifies the turn in event IDs.
+            owner: The user the turn belongs to. Only they can resume it.
+            capacity: The number of frames held.
+        """
+        self.turn_id = turn_id
+        self.owner = owner
+        self.capacity = capacity
+        self.finished = False
+        self.last_seq = 0  # The seq of the last frame published
+        self.delivered = 0  # The highest seq sent to any connection
+        self._frames: deque[tuple[int, bytes]] = deque(maxlen=capacity)  # (seq, frame)
+        self._followers: set[asyncio.Queue[Any]] = set()
+        self._caught_up = asyncio.Event()
+
+    def _has_room(self) -> bool:
+        return self.last_seq - self.delivered < self.capacity
+
+    async def publish(self, frame: bytes, timeout: float | None = None) -> None:
+        """
+        Add a frame, first waiting until that won't overwrite a frame no connection has been sent.
+
+        Raises:
+            StreamStalledException: No connection caught up within the timeout.
+        """
+        while not self._has_room():
+            self._caught_up.clear()
+            try:
+                await asyncio.wait_for(self._caught_up.wait(), timeout)
+            except TimeoutError as e:
+                raise StreamStalledException(f"No connection has read turn {self.turn_id} for {timeout}s") from e
+        self.publish_nowait(frame)
+
+    def publish_nowait(self, frame: bytes) -> None:
+        """Add a frame, even if it overwrites a frame no connection has been sent."""
+        self.last_seq += 1
+        self._frames.append((self.last_seq, frame))
+        self._wake_followers()
+
+    def finish(self) -> None:
+        """Mark the turn finished, so its followers end once they have been sent every frame."""
+        self.finished = True
+        self._wake_followers()
+
+    def _wake_followers(self) -> None:
+        for queue in self._followers:
+            if queue.empty():
+                queue.put_nowait(WAKE)
+
+    def frames_after(self, seq: int) -> list[tuple[int, bytes]]:
+        """
+        Return the (seq, frame) of every frame after seq.
+
+        Raises:
+            StreamGoneException: Some of those frames have already been overwritten.
+        """
+        if seq >= self.last_seq:
+            return []
+        oldest = self._frames[0][0]
+        if seq + 1 < oldest:
+            raise StreamGoneException(f"Frames {seq + 1} to {oldest - 1} of turn {self.turn_id} are no longer held")
+        return list(self._frames)[seq + 1 - oldest :]
+
+    def ack(self, seq: int) -> None:
+        """Record that a connection has been sent every frame up to seq."""
+        if seq > self.delivered:
+            self.delivered = seq
+            self._caught_up.set()
+
+    @contextmanager
+    def follow(self, queue: asyncio.Queue[Any]) -> Iterator[None]:
+        """Post WAKE to the queue (if it is empty) whenever frames are published, while the context is open."""
+        self._followers.add(queue)
+        try:
+            yield
+        finally:
+            self._followers.discard(queue)
+
+
+class TurnStreamRegistry:
+    """Holds the streams of live and recently finished turns, so they can be resumed."""
+
+    def __init__(
+        self,
+        capacity: int = SSE_RESUME_BUFFER_FRAMES,
+        retention: float = SSE_RESUME_RETENTION_SECONDS,
+        max_turns: int = SSE_RESUME_MAX_TURNS,
+    ):
+        """
+        Args:
+            capacity: The number of frames held per turn.
+            retention: Seconds a finished turn can still be resumed.
+            max_turns: The most turns held at once.
+        """
+        self.capacity = capacity
+        self.retention = retention
+        self._turns: TTLCache[str, TurnStream] = TTLCache("sse_turns", max_entries=max_turns)
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def start(self, owner: str) -> TurnStream:
+        """Create the stream for a new turn."""
+        turn = TurnStream(uuid.uuid4().hex, owner, self.capacity)
+        self._turns.set(turn.turn_id, turn, SSE_TURN_MAX_SECONDS)
+        return turn
+
+    def finish(self, turn: TurnStream) -> None:
+        """Mark the turn finished. It can be resumed for the retention period."""
+        turn.finish()
+        self._turns.set(turn.turn_id, turn, self.retention)
+
+    def resume(self, last_event_id: str, owner: str) -> tuple[TurnStream, int]:
+        """
+        Find the turn to resume from a Last-Event-ID.
+
+        Returns:
+            The turn, and the seq of the last frame the client received.
+
+        Raises:
+            StreamGoneException: The turn is unknown, has expired, or belongs to someone else,
+                or the seq is of a frame it hasn't published (which would skip the frames up to it).
+        """
+        if parsed := parse_event_id(last_event_id):
+            turn_id, seq = parsed
+            turn = self._turns.get(turn_id)
+            if turn is not None and turn.owner == owner and seq <= turn.last_seq:
+                return turn, seq
+        raise StreamGoneException(f"No resumable stream for event ID '{last_event_id}'")
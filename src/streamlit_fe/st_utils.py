@@ -10,12 +10,18 @@ from limits.strategies import MovingWindowRateLimiter
 
 from rickbot_agent.agent import get_agent
 from rickbot_agent.personality import Personality
+from rickbot_agent.runners import RunnerRegistry
 from rickbot_agent.services import get_session_service
 from streamlit_fe.st_config import config, logger
 
+# Runners are shared by all Streamlit sessions in this process, one per agent
+_runner_registry = RunnerRegistry(
+    lambda agent: Runner(agent=agent, app_name=config.app_name, session_service=get_session_service())
+)
+
 
 async def initialize_adk_runner(personality: Personality) -> Runner:
-    """Initialise the ADK runner with the correct agent personality.
+    """Return the shared ADK runner for the agent personality.
     Here we create a new session whenever we initialise the runner.
     """
     rickbot_agent = get_agent(personality.name)
@@ -30,7 +36,7 @@ async def initialize_adk_runner(personality: Personality) -> Runner:
     except AlreadyExistsError:
         logger.debug(f"Session {st.session_state.session_id} already exists. Reusing it.")
 
-    return Runner(agent=rickbot_agent, app_name=config.app_name, session_service=session_service)
+    return _runner_registry.get(rickbot_agent)
 
 
 class RateLimiter:
@@ -87,7 +87,7 @@ def test_standard_user_cannot_access_supporter_persona(rbac_server):
     db = firestore.Client(project=os.environ.get("GOOGLE_CLOUD_PROJECT"))
     # Seed required data for the test
     db.collection("persona_tiers").document("yasmin").set({"required_role": "supporter"})
-    db.collection("users").document("StandardUser:mock:test-standard-user").set({
+    db.collection("users").document("mock:test-standard-user").set({
         "id": "test-standard-user",
         "provider": "mock",
         "name": "StandardUser",
@@ -112,7 +112,7 @@ def test_supporter_user_can_access_supporter_persona(rbac_server):
     can access a 'supporter' persona (id: yasmin).
     """
     db = firestore.Client(project=os.environ.get("GOOGLE_CLOUD_PROJECT"))
-    db.collection("users").document("Dazbo:mock:derailed-dash").set({
+    db.collection("users").document("mock:derailed-dash").set({
         "id": "derailed-dash",
         "provider": "mock",
         "name": "Dazbo",
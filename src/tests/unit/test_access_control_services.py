@@ -1,10 +1,26 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from src.rickbot_agent.services import get_required_role, get_user_role
+from src.rickbot_agent.repository import FirestoreAccessRepository, InMemoryAccessRepository, UserMetadata
+from src.rickbot_agent.services import (
+    get_required_role,
+    get_user_role,
+    invalidate_user_role,
+    sync_user_metadata,
+    user_role_cache,
+    watch_user_role_changes,
+)
+from src.rickbot_agent.user_sync import UserMetadataWriter
 
 
+@pytest.fixture
+def repo():
+    user_role_cache.clear()
+    repo = InMemoryAccessRepository()
+    with patch("src.rickbot_agent.services.get_access_repository", return_value=repo):
+        yield repo
+
 @pytest.fixture
 def mock_db():
     with patch("src.rickbot_agent.services._get_firestore_client") as mock:
@@ -12,52 +28,224 @@ def mock_db():
         mock.return_value = db
         yield db
 
-def test_get_user_role_found(mock_db):
-    # Setup mock for .where("id", "==", user_id).where("provider", "==", provider).limit(1).get()
-    mock_doc = MagicMock()
-    mock_doc.id = "ReadableName:mock:test-user"
-    mock_doc.to_dict.return_value = {"role": "supporter"}
+def add_user(repo, user_id, provider, role):
+    repo.users[f"{provider}:{user_id}"] = {"id": user_id, "provider": provider, "role": role}
 
-    # Mock chain: collection().where().where().limit().get()
-    mock_coll = mock_db.collection.return_value
-    mock_where1 = mock_coll.where.return_value
-    mock_where2 = mock_where1.where.return_value
-    mock_limit = mock_where2.limit.return_value
-    mock_limit.get.return_value = [mock_doc]
+@pytest.mark.asyncio
+async def test_get_user_role_found(repo):
+    add_user(repo, "test-user", "mock", "supporter")
 
-    role = get_user_role("test-user", "mock")
+    role = await get_user_role("test-user", "mock")
     assert role == "supporter"
-    mock_db.collection.assert_called_with("users")
 
-def test_get_user_role_not_found(mock_db):
-    # Setup mock for empty result
-    mock_coll = mock_db.collection.return_value
-    mock_where1 = mock_coll.where.return_value
-    mock_where2 = mock_where1.where.return_value
-    mock_limit = mock_where2.limit.return_value
-    mock_limit.get.return_value = []
+@pytest.mark.asyncio
+async def test_get_user_role_not_found(repo):
+    # Should default to 'standard'
+    role = await get_user_role("unknown-user", "google")
+    assert role == "standard"
 
+@pytest.mark.asyncio
+async def test_get_required_role_found(repo):
+    repo.persona_tiers["yasmin"] = {"required_role": "supporter"}
+
+    role = await get_required_role("Yasmin")
+    assert role == "supporter"
+
+@pytest.mark.asyncio
+async def test_get_required_role_not_found(repo):
     # Should default to 'standard'
-    role = get_user_role("unknown-user", "google")
+    role = await get_required_role("unknown-persona")
     assert role == "standard"
 
-def test_get_required_role_found(mock_db):
-    # Setup mock for persona_tiers
+@pytest.mark.asyncio
+async def test_sync_user_metadata_creates_then_updates(repo):
+    with patch("src.rickbot_agent.services.get_user_metadata_writer", return_value=UserMetadataWriter(repo.upsert_users)) as w:
+        writer = w.return_value
+        sync_user_metadata("new-user", "github", "new@example.com", "New User!")
+        assert repo.users == {}  # Written in the background
+
+        await writer.flush()
+        assert repo.users["github:new-user"]["role"] == "standard"
+
+        repo.users["github:new-user"]["role"] = "supporter"
+        sync_user_metadata("new-user", "github", "renamed@example.com", "Renamed User")
+        await writer.drain()
+
+    assert list(repo.users) == ["github:new-user"]
+    assert repo.users["github:new-user"]["email"] == "renamed@example.com"
+    assert repo.users["github:new-user"]["role"] == "supporter"
+
+@pytest.mark.asyncio
+async def test_get_user_role_is_cached(repo):
+    add_user(repo, "cached-user", "mock", "supporter")
+
+    with patch.object(repo, "get_user_role", wraps=repo.get_user_role) as spy:
+        assert await get_user_role("cached-user", "mock") == "supporter"
+        assert await get_user_role("cached-user", "mock") == "supporter"
+        assert await get_user_role("cached-user", "mock") == "supporter"
+        spy.assert_called_once()
+
+        # The same id from another provider is a different user
+        assert await get_user_role("cached-user", "github") == "standard"
+        assert spy.call_count == 2
+
+@pytest.mark.asyncio
+async def test_get_user_role_errors_are_not_cached(repo):
+    add_user(repo, "flaky-user", "mock", "supporter")
+
+    with patch.object(repo, "get_user_role", side_effect=RuntimeError("Firestore unavailable")):
+        assert await get_user_role("flaky-user", "mock") == "standard"
+
+    assert await get_user_role("flaky-user", "mock") == "supporter"
+
+@pytest.mark.asyncio
+async def test_invalidate_user_role(repo):
+    assert await get_user_role("upgraded-user", "google") == "standard"
+
+    add_user(repo, "upgraded-user", "google", "supporter")
+    assert await get_user_role("upgraded-user", "google") == "standard"  # Still cached
+
+    invalidate_user_role("upgraded-user", "google")
+    assert await get_user_role("upgraded-user", "google") == "supporter"
+
+@pytest.mark.asyncio
+async def test_role_change_notification_invalidates_cache(repo, mock_db):
+    assert await get_user_role("upgraded-user", "github") == "standard"
+
+    watch_user_role_changes()
+    on_snapshot = mock_db.collection.return_value.where.return_value.on_snapshot.call_args.args[0]
+
+    # The user is upgraded, so enters the set of non-standard users
+    add_user(repo, "upgraded-user", "github", "supporter")
+    mock_doc = MagicMock()
+    mock_doc.to_dict.return_value = repo.users["github:upgraded-user"]
+    on_snapshot([mock_doc], [MagicMock(document=mock_doc)], None)
+
+    assert await get_user_role("upgraded-user", "github") == "supporter"
+
+@pytest.mark.asyncio
+async def test_firestore_repository_get_user_role():
     mock_doc = MagicMock()
     mock_doc.exists = True
-    mock_doc.to_dict.return_value = {"required_role": "supporter"}
-    mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+    mock_doc.id = "mock:test-user"
+    mock_doc.to_dict.return_value = {"role": "supporter"}
 
-    role = get_required_role("yasmin")
-    assert role == "supporter"
-    mock_db.collection.assert_called_with("persona_tiers")
+    client = MagicMock()
+    # A point read of users/{provider}:{id}, rather than a query
+    mock_doc_ref = client.collection.return_value.document.return_value
+    mock_doc_ref.get = AsyncMock(return_value=mock_doc)
+
+    repo = FirestoreAccessRepository(client, legacy_fallback=False)
+    assert await repo.get_user_role("test-user", "mock") == "supporter"
+    client.collection.assert_called_with("users")
+    client.collection.return_value.document.assert_called_with("mock:test-user")
+    client.collection.return_value.where.assert_not_called()
+
+    mock_doc.exists = False
+    assert await repo.get_user_role("unknown-user", "mock") is None
 
-def test_get_required_role_not_found(mock_db):
-    # Setup mock for missing persona
+@pytest.mark.asyncio
+async def test_firestore_repository_get_required_role():
     mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {"required_role": "supporter"}
+
+    client = MagicMock()
+    mock_doc_ref = client.collection.return_value.document.return_value
+    mock_doc_ref.get = AsyncMock(return_value=mock_doc)
+
+    repo = FirestoreAccessRepository(client)
+    assert await repo.get_required_role("Yasmin") == "supporter"
+    client.collection.assert_called_with("persona_tiers")
+    client.collection.return_value.document.assert_called_with("yasmin")
+
     mock_doc.exists = False
-    mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+    assert await repo.get_required_role("unknown-persona") is None
 
-    # Should default to 'standard'
-    role = get_required_role("unknown-persona")
-    assert role == "standard"
+@pytest.mark.asyncio
+async def test_firestore_repository_upsert_users_in_one_batch():
+    client = MagicMock()
+    client.collection.return_value.document.side_effect = lambda doc_id: MagicMock(id=doc_id)
+
+    async def get_all(refs, field_paths=None):
+        for ref in refs:
+            yield MagicMock(id=ref.id, exists=ref.id == "google:existing-user")
+
+    client.get_all = get_all
+    batch = client.batch.return_value
+    batch.commit = AsyncMock()
+
+    repo = FirestoreAccessRepository(client, legacy_fallback=False)
+    await repo.upsert_users([
+        UserMetadata("existing-user", "google", "old@example.com", "Old User"),
+        UserMetadata("new-user", "github", "new@example.com", "New User"),
+    ])
+
+    assert batch.set.call_count == 2
+    (existing_ref, existing_data), (new_ref, new_data) = [c.args for c in batch.set.call_args_list]
+    assert existing_ref.id == "google:existing-user"
+    assert "role" not in existing_data  # Existing roles are left alone
+    assert new_ref.id == "github:new-user"
+    assert new_data["role"] == "standard"
+    assert all(c.kwargs == {"merge": True} for c in batch.set.call_args_list)
+    batch.commit.assert_awaited_once()
+
+
+def legacy_docs(*docs):
+    """A stream() for a query, yielding the given (document ID, data) pairs."""
+
+    async def stream():
+        for doc_id, data in docs:
+            yield MagicMock(id=doc_id, to_dict=MagicMock(return_value=data))
+
+    return stream
+
+
+@pytest.mark.asyncio
+async def test_firestore_repository_get_user_role_copies_legacy_role_forward():
+    client = MagicMock()
+    mock_doc_ref = client.collection.return_value.document.return_value
+    mock_doc_ref.get = AsyncMock(return_value=MagicMock(exists=False))
+    mock_doc_ref.set = AsyncMock()
+    query = client.collection.return_value.where.return_value.where.return_value
+    query.stream = legacy_docs(
+        ("Old_Name:github:legacy-user", {"id": "legacy-user", "provider": "github", "role": "standard"}),
+        ("New_Name:github:legacy-user", {"id": "legacy-user", "provider": "github", "role": "supporter"}),
+    )
+
+    repo = FirestoreAccessRepository(client)
+    assert await repo.get_user_role("legacy-user", "github") == "supporter"  # The highest of the legacy roles
+    client.collection.return_value.document.assert_called_with("github:legacy-user")
+    mock_doc_ref.set.assert_awaited_once_with(
+        {"id": "legacy-user", "provider": "github", "role": "supporter"}, merge=True
+    )
+
+    # A user with no legacy documents either is simply unknown
+    query.stream = legacy_docs()
+    mock_doc_ref.set.reset_mock()
+    assert await repo.get_user_role("unknown-user", "github") is None
+    mock_doc_ref.set.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_firestore_repository_upsert_users_takes_legacy_role_for_new_documents():
+    client = MagicMock()
+    client.collection.return_value.document.side_effect = lambda doc_id: MagicMock(id=doc_id)
+
+    async def get_all(refs, field_paths=None):
+        for ref in refs:
+            yield MagicMock(id=ref.id, exists=False)
+
+    client.get_all = get_all
+    client.collection.return_value.where.return_value.where.return_value.stream = legacy_docs(
+        ("Legacy_User:google:legacy-user", {"id": "legacy-user", "provider": "google", "role": "admin"}),
+    )
+    batch = client.batch.return_value
+    batch.commit = AsyncMock()
+
+    repo = FirestoreAccessRepository(client)
+    await repo.upsert_users([UserMetadata("legacy-user", "google", "legacy@example.com", "Legacy User")])
+
+    ref, data = batch.set.call_args.args
+    assert ref.id == "google:legacy-user"
+    assert data["role"] == "admin"
@@ -0,0 +1,183 @@
+import asyncio
+
+import pytest
+
+from rickbot_utils.admission import AdmissionController, AdmissionRejectedException
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_controller(**kwargs):
+    kwargs.setdefault("initial_limit", 2)
+    kwargs.setdefault("min_limit", 1)
+    kwargs.setdefault("max_limit", 10)
+    kwargs.setdefault("queue_max", 4)
+    kwargs.setdefault("max_wait", 5)
+    return AdmissionController(**kwargs)
+
+
+async def queue_request(controller, priority=False):
+    """Start waiting for a permit, returning the task once it is queued."""
+    task = asyncio.create_task(controller.acquire(priority))
+    await asyncio.sleep(0)
+    return task
+
+
+@pytest.mark.asyncio
+async def test_admits_up_to_the_limit_then_queues():
+    controller = make_controller()
+    first = await controller.acquire()
+    await controller.acquire()
+
+    waiting = await queue_request(controller)
+    assert controller.in_flight == 2
+    assert controller.queued == 1
+    assert not waiting.done()
+
+    first.release(None)
+    permit = await waiting
+    assert controller.in_flight == 2
+    assert controller.queued == 0
+    permit.release(None)
+    assert controller.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_supporters_are_admitted_first():
+    controller = make_controller(initial_limit=1)
+    running = await controller.acquire()
+    standard = await queue_request(controller)
+    supporter = await queue_request(controller, priority=True)
+
+    running.release(None)
+    await asyncio.sleep(0)
+
+    assert supporter.done()
+    assert not standard.done()
+    supporter.result().release(None)
+    (await standard).release(None)
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_the_queue_is_full():
+    controller = make_controller(initial_limit=1, queue_max=1)
+    await controller.acquire()
+    await queue_request(controller)
+
+    with pytest.raises(AdmissionRejectedException) as e:
+        await controller.acquire()
+    assert e.value.reason == "queue full"
+    assert e.value.retry_after >= 1
+
+
+@pytest.mark.asyncio
+async def test_supporter_displaces_the_newest_standard_request_when_full():
+    controller = make_controller(initial_limit=1, queue_max=2)
+    running = await controller.acquire()
+    oldest = await queue_request(controller)
+    newest = await queue_request(controller)
+
+    supporter = await queue_request(controller, priority=True)
+
+    with pytest.raises(AdmissionRejectedException, match="displaced"):
+        await newest
+    assert not oldest.done()
+    assert controller.queued == 2
+
+    running.release(None)
+    (await supporter).release(None)
+    (await oldest).release(None)
+
+
+@pytest.mark.asyncio
+async def test_rejects_after_waiting_too_long():
+    controller = make_controller(initial_limit=1, max_wait=0.01)
+    await controller.acquire()
+
+    with pytest.raises(AdmissionRejectedException) as e:
+        await controller.acquire()
+
+    assert e.value.reason == "timed out waiting"
+    assert controller.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_leave_the_queue():
+    controller = make_controller(initial_limit=1)
+    running = await controller.acquire()
+    waiting = await queue_request(controller)
+
+    waiting.cancel()
+    await asyncio.sleep(0)
+    running.release(None)
+
+    assert controller.queued == 0
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_limit_shrinks_when_runs_slow_down():
+    clock = FakeClock()
+    controller = make_controller(initial_limit=8, clock=clock)
+    for _ in range(5):  # Establish a baseline latency of 1s
+        permit = await controller.acquire()
+        clock.now += 1
+        permit.release()
+    baseline = controller.limit
+
+    for _ in range(5):  # Runs now take 4x as long
+        permit = await controller.acquire()
+        clock.now += 4
+        permit.release()
+
+    assert controller.limit < baseline
+
+
+@pytest.mark.asyncio
+async def test_limit_grows_only_while_it_is_being_used():
+    clock = FakeClock()
+    controller = make_controller(initial_limit=4, clock=clock)
+
+    permit = await controller.acquire()
+    clock.now += 1
+    permit.release()
+    assert controller.limit == 4  # One run in flight: the limit isn't the constraint
+
+    permits = [await controller.acquire() for _ in range(4)]
+    clock.now += 1
+    for permit in permits:
+        permit.release()
+    assert controller.limit > 4
+
+
+@pytest.mark.asyncio
+async def test_failures_shrink_the_limit():
+    controller = make_controller(initial_limit=8)
+
+    async with controller.admit():
+        pass
+    assert controller.limit == 8
+
+    with pytest.raises(RuntimeError):
+        async with controller.admit():
+            raise RuntimeError("quota exceeded")
+
+    assert controller.limit < 8
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_release_is_idempotent():
+    controller = make_controller()
+    permit = await controller.acquire()
+
+    permit.release()
+    permit.release()
+
+    assert controller.in_flight == 0
@@ -1,14 +1,17 @@
 """Unit tests for generic file search store support in the agent."""
 
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import cast
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 from google.adk.agents import Agent
 from google.adk.tools import AgentTool
 
-from rickbot_agent.agent import create_agent
+from rickbot_agent.agent import _get_cached_agent_for_personality, create_agent, get_agent
 from rickbot_agent.personality import Personality
+from rickbot_agent.tool_guard import GuardedAgentTool
 from rickbot_agent.tools_custom import FileSearchTool
 
 
@@ -52,6 +55,8 @@ def test_create_agent_attaches_file_search_tool_for_any_personality(mock_get_sto
     # 2. Check tools include AgentTool for RagAgent
     rag_agent_tool = next((t for t in agent.tools if isinstance(t, AgentTool) and t.agent.name == "RagAgent"), None)
     assert rag_agent_tool is not None
+    # Sub-agent calls go through a bulkhead and circuit breaker
+    assert all(isinstance(t, GuardedAgentTool) for t in agent.tools)
 
     # Check that the RagAgent has the FileSearchTool
     rag_agent = cast(Agent, rag_agent_tool.agent)
@@ -114,3 +119,35 @@ def test_create_agent_no_rag_agent_when_store_not_found(mock_get_store, mock_con
 
     # 3. Check description matches fallback
     assert "with access to a SearchAgent to perform Google Search." in agent.description
+
+
+def test_concurrent_first_calls_create_the_agent_once():
+    personality = Personality(
+        name="Yoda",
+        menu_name="Yoda",
+        title="Yoda",
+        overview="Wise one.",
+        welcome="Welcome.",
+        prompt_question="Query?",
+        temperature=0.7,
+    )
+    created = []
+
+    def slow_create_agent(personality):
+        time.sleep(0.1)
+        created.append(personality.name)
+        return MagicMock(name=f"agent-{personality.name}")
+
+    _get_cached_agent_for_personality.cache_clear()
+    try:
+        with (
+            patch("rickbot_agent.agent.get_personalities", return_value={"Yoda": personality}),
+            patch("rickbot_agent.agent.create_agent", side_effect=slow_create_agent),
+            ThreadPoolExecutor(max_workers=4) as pool,
+        ):
+            agents = list(pool.map(get_agent, ["Yoda"] * 4))
+    finally:
+        _get_cached_agent_for_personality.cache_clear()
+
+    assert created == ["Yoda"]
+    assert all(agent is agents[0] for agent in agents)
@@ -0,0 +1,41 @@
+import os
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client():
+    from src.main import app
+
+    return TestClient(app)
+
+
+def test_invalidate_role_cache(client):
+    with patch.dict(os.environ, {"ADMIN_API_KEY": "admin-secret"}), \
+         patch("src.main.invalidate_user_role") as mock_invalidate:
+        response = client.delete("/admin/role_cache/github/12345", headers={"X-Admin-Key": "admin-secret"})
+
+    assert response.status_code == 204
+    mock_invalidate.assert_called_once_with("12345", "github")
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Key": "wrong"}])
+def test_invalidate_role_cache_rejects_bad_key(client, headers):
+    with patch.dict(os.environ, {"ADMIN_API_KEY": "admin-secret"}), \
+         patch("src.main.invalidate_user_role") as mock_invalidate:
+        response = client.delete("/admin/role_cache/github/12345", headers=headers)
+
+    assert response.status_code == 403
+    mock_invalidate.assert_not_called()
+
+
+def test_admin_endpoints_disabled_without_key(client):
+    with patch.dict(os.environ, {}, clear=False) as env, \
+         patch("src.main.invalidate_user_role") as mock_invalidate:
+        env.pop("ADMIN_API_KEY", None)
+        response = client.delete("/admin/role_cache/github/12345", headers={"X-Admin-Key": ""})
+
+    assert response.status_code == 404
+    mock_invalidate.assert_not_called()
@@ -128,7 +128,7 @@ def test_chat_stream_endpoint(client):
     import json
 
     content = response.content.decode("utf-8")
-    lines = content.strip().split("\n\n")
+    lines = content.strip().splitlines()
 
     # We expect:
     # 1. session_id
@@ -149,9 +149,9 @@ def test_chat_stream_endpoint(client):
     assert "session_id" in events[0]
 
     # Look for chunks
+    # Chunks may be coalesced into fewer frames, but all the text arrives, in order
     chunks = [e["chunk"] for e in events if "chunk" in e]
-    assert "Chunk 1" in chunks
-    assert "Chunk 2" in chunks
+    assert "".join(chunks) == "Chunk 1Chunk 2"
 
     # Verify done event
     assert events[-1] == {"done": True}
@@ -198,7 +198,7 @@ def test_chat_stream_tool_events(client):
 
     import json
     content = response.content.decode("utf-8")
-    lines = content.strip().split("\n\n")
+    lines = content.strip().splitlines()
 
     events = []
     for line in lines:
@@ -219,3 +219,437 @@ def test_chat_stream_tool_events(client):
     # Verify chunk
     chunks = [e["chunk"] for e in events if "chunk" in e]
     assert "I found something." in chunks
+
+
+def test_chat_stream_partial_events_are_not_repeated(client):
+    c, mock_runner = client
+    run_kwargs = {}
+
+    def text_event(text, partial):
+        event = MagicMock()
+        event.actions = None
+        event.partial = partial
+        event.get_function_calls.return_value = []
+        event.get_function_responses.return_value = []
+        event.content.parts = [MockPart(text=text)]
+        return event
+
+    # Token-level partial events, then the final event with the aggregated text
+    async def mock_run_async(*args, **kwargs):
+        run_kwargs.update(kwargs)
+        yield text_event("Wubba ", True)
+        yield text_event("lubba ", True)
+        yield text_event("dub dub!", True)
+        yield text_event("Wubba lubba dub dub!", False)
+
+    mock_runner.run_async = mock_run_async
+
+    response = c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick"})
+    assert response.status_code == 200
+
+    import json
+
+    from google.adk.agents.run_config import StreamingMode
+
+    events = [json.loads(line[6:]) for line in response.content.decode("utf-8").splitlines() if line.startswith("data: ")]
+    chunks = [e["chunk"] for e in events if "chunk" in e]
+    assert "".join(chunks) == "Wubba lubba dub dub!"
+    assert run_kwargs["run_config"].streaming_mode == StreamingMode.SSE
+
+
+def test_chat_stream_debug_frames_are_opt_in(client):
+    c, mock_runner = client
+
+    async def mock_run_async(*args, **kwargs):
+        event = MagicMock()
+        event.actions = None
+        event.get_function_calls.return_value = []
+        event.get_function_responses.return_value = []
+        event.content.parts = [MockPart(text="Hello")]
+        yield event
+
+    mock_runner.run_async = mock_run_async
+
+    import json
+
+    def debug_frames(response):
+        lines = response.content.decode("utf-8").splitlines()
+        return [json.loads(line[6:]) for line in lines if line.startswith("data: ") and "debug" in line]
+
+    response = c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick"})
+    assert response.status_code == 200
+    assert debug_frames(response) == []
+
+    response = c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick", "debug": "true"})
+    assert response.status_code == 200
+    assert len(debug_frames(response)) == 1
+
+
+def test_chat_stream_coalesces_chunks(client):
+    import asyncio
+    import json
+
+    from rickbot_utils.sse import ChunkCoalescer
+
+    c, mock_runner = client
+
+    def event(text=None, tool=None):
+        event = MagicMock()
+        event.actions = None
+        event.partial = True
+        fc = MagicMock()
+        fc.name = tool
+        fc.args = {}
+        event.get_function_calls.return_value = [fc] if tool else []
+        event.get_function_responses.return_value = []
+        if text:
+            event.content.parts = [MockPart(text=text)]
+        else:
+            event.content = None
+        return event
+
+    async def mock_run_async(*args, **kwargs):
+        yield event("Wubba ")
+        yield event("lubba ")
+        await asyncio.sleep(0.1)  # Longer than the coalescing delay, so the text so far is sent
+        yield event("dub ")
+        yield event(tool="SearchAgent")  # Sends the buffered text first
+        yield event("dub!")
+
+    mock_runner.run_async = mock_run_async
+
+    with patch("src.main.ChunkCoalescer", lambda: ChunkCoalescer(max_delay=0.02, max_bytes=1024)):
+        response = c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick"})
+    assert response.status_code == 200
+
+    events = [json.loads(line[6:]) for line in response.content.decode("utf-8").splitlines() if line.startswith("data: ")]
+    assert [e for e in events if "chunk" in e or "tool_call" in e] == [
+        {"chunk": "Wubba lubba "},
+        {"chunk": "dub "},
+        {"tool_call": {"name": "SearchAgent", "args": {}}},
+        {"chunk": "dub!"},
+    ]
+
+
+def test_chat_stream_resumes_from_last_event_id(client):
+    import json
+
+    c, mock_runner = client
+    runs = []
+
+    async def mock_run_async(*args, **kwargs):
+        runs.append(kwargs)
+        for text in ["Wubba lubba dub dub! ", "I'm Pickle Rick!"]:
+            event = MagicMock()
+            event.actions = None
+            event.get_function_calls.return_value = []
+            event.get_function_responses.return_value = []
+            event.content.parts = [MockPart(text=text)]
+            yield event
+
+    mock_runner.run_async = mock_run_async
+
+    def frames(response):
+        """(id, payload) for each data frame."""
+        result = []
+        for frame in response.content.decode("utf-8").split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+            if "data" in fields:
+                result.append((fields.get("id"), json.loads(fields["data"])))
+        return result
+
+    request = {"prompt": "Hello", "personality": "Rick"}
+    response = c.post("/chat_stream", data=request)
+    assert response.status_code == 200
+    sent = frames(response)
+    assert all(event_id for event_id, _ in sent)
+    assert len({event_id for event_id, _ in sent}) == len(sent)
+
+    # The connection dropped after the first chunk. Resuming sends only the frames after it, without running the turn again.
+    response = c.post("/chat_stream", data=request, headers={"Last-Event-ID": sent[1][0]})
+    assert response.status_code == 200
+    assert frames(response) == sent[2:]
+    assert len(runs) == 1
+
+    # Unknown and malformed IDs can't be resumed, nor can a seq beyond the last frame of the turn
+    turn_id = sent[0][0].rpartition(":")[0]
+    for last_event_id in ["0123456789abcdef:1", "not-an-id", f"{turn_id}:{len(sent) + 5}"]:
+        response = c.post("/chat_stream", data=request, headers={"Last-Event-ID": last_event_id})
+        assert response.status_code == 410
+    assert len(runs) == 1
+
+
+@pytest.fixture
+def response_cache(client):
+    """Enable the response cache, with a real in-memory session service, so session history can be checked."""
+    from google.adk.sessions import InMemorySessionService
+
+    from rickbot_agent.response_cache import InMemoryResponseCacheBackend, ResponseCache
+
+    cache = ResponseCache(InMemoryResponseCacheBackend())
+    sessions = InMemorySessionService()
+    agent = MagicMock()
+    agent.name = "rickbot_Rick"
+    agent.model = "gemini-2.5-flash"
+    agent.generate_content_config.temperature = 1.0
+    with (
+        patch("src.main.get_agent", return_value=agent),
+        patch("src.main.response_cache", new=cache),
+        patch("src.main.session_service", new=sessions),
+        patch("src.main.RESPONSE_CACHE_STREAM_DELAY_MS", 0),
+    ):
+        yield cache, sessions
+
+
+def counting_run(mock_runner, text):
+    runs = []
+
+    async def mock_run_async(*args, **kwargs):
+        runs.append(kwargs)
+        event = MagicMock()
+        event.actions = None
+        event.partial = False
+        event.is_final_response.return_value = True
+        event.get_function_calls.return_value = []
+        event.get_function_responses.return_value = []
+        event.content.parts = [MockPart(text=text)]
+        yield event
+
+    mock_runner.run_async = mock_run_async
+    return runs
+
+
+def test_chat_serves_first_turns_from_cache(client, response_cache):
+    import asyncio
+
+    c, mock_runner = client
+    _, sessions = response_cache
+    runs = counting_run(mock_runner, "I'm Rick Sanchez.")
+
+    first = c.post("/chat", data={"prompt": "Who are you?", "personality": "Rick"})
+    assert first.json()["response"] == "I'm Rick Sanchez."
+    assert len(runs) == 1
+
+    # A new conversation opening the same way is served from cache, and still recorded in its session
+    second = c.post("/chat", data={"prompt": "who are you", "personality": "Rick"})
+    assert second.json()["response"] == "I'm Rick Sanchez."
+    assert len(runs) == 1
+
+    session = asyncio.run(
+        sessions.get_session(app_name="rickbot_api", user_id="test@example.com", session_id=second.json()["session_id"])
+    )
+    assert [e.author for e in session.events] == ["user", "rickbot_Rick"]
+    assert session.events[0].content.parts[0].text == "who are you"
+    assert session.events[1].content.parts[0].text == "I'm Rick Sanchez."
+
+    # Later turns of that conversation depend on its history, so always run the agent
+    c.post("/chat", data={"prompt": "Who are you?", "personality": "Rick", "session_id": second.json()["session_id"]})
+    assert len(runs) == 2
+
+
+def test_replies_with_attachments_are_not_cached(client, response_cache):
+    from google.genai.types import Part
+
+    c, mock_runner = client
+    runs = []
+
+    async def mock_run_async(*args, **kwargs):
+        runs.append(kwargs)
+        event = MagicMock()
+        event.actions = None
+        event.partial = False
+        event.is_final_response.return_value = True
+        event.get_function_calls.return_value = []
+        event.get_function_responses.return_value = []
+        event.content.parts = [
+            Part.from_text(text="Here's a portal gun."),
+            Part.from_bytes(data=b"png", mime_type="image/png"),
+        ]
+        yield event
+
+    mock_runner.run_async = mock_run_async
+
+    # A cached reply would be served to /chat as well, without the image
+    assert c.post("/chat_stream", data={"prompt": "Draw a portal gun", "personality": "Rick"}).status_code == 200
+    response = c.post("/chat", data={"prompt": "Draw a portal gun", "personality": "Rick"})
+    assert response.status_code == 200
+    assert len(runs) == 2
+
+
+def test_chat_stream_serves_first_turns_from_cache(client, response_cache):
+    import json
+
+    c, mock_runner = client
+    reply = "Wubba lubba dub dub! I'm Pickle Rick, and this reply is long enough to be streamed in pieces."
+    runs = counting_run(mock_runner, reply)
+
+    def chunks(response):
+        events = [json.loads(line[6:]) for line in response.content.decode("utf-8").splitlines() if line.startswith("data: ")]
+        return [e["chunk"] for e in events if "chunk" in e], events[-1]
+
+    first = c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick"})
+    assert "".join(chunks(first)[0]) == reply
+
+    second = c.post("/chat_stream", data={"prompt": "Hello!", "personality": "Rick"})
+    cached_chunks, last = chunks(second)
+    assert "".join(cached_chunks) == reply
+    assert len(cached_chunks) > 1  # Streamed, rather than sent all at once
+    assert last == {"done": True}
+    assert len(runs) == 1
+
+
+@pytest.mark.parametrize("endpoint", ["/chat", "/chat_stream"])
+def test_busy_instance_answers_503_with_retry_after(client, endpoint):
+    from rickbot_utils.admission import AdmissionController
+
+    c, mock_runner = client
+    runs = counting_run(mock_runner, "Hello from Rick")
+    busy = AdmissionController(initial_limit=1, min_limit=1, queue_max=0)
+    busy.in_flight = 1  # Every permit is taken, and nothing can queue
+
+    with patch("src.main.admission_controller", new=busy):
+        response = c.post(endpoint, data={"prompt": "Hello", "personality": "Rick"})
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert runs == []
+
+
+def test_chat_releases_its_admission_permit(client):
+    from rickbot_utils.admission import AdmissionController
+
+    c, mock_runner = client
+    counting_run(mock_runner, "Hello from Rick")
+    controller = AdmissionController(initial_limit=1, min_limit=1)
+
+    with patch("src.main.admission_controller", new=controller):
+        for endpoint in ["/chat", "/chat_stream"]:
+            assert c.post(endpoint, data={"prompt": "Hello", "personality": "Rick"}).status_code == 200
+
+    assert controller.in_flight == 0
+
+
+def test_chat_stream_releases_its_permit_if_the_turn_fails_to_start(client):
+    from rickbot_utils.admission import AdmissionController
+
+    c, mock_runner = client
+    mock_runner.run_async = MagicMock(side_effect=RuntimeError("Runner unavailable"))
+    controller = AdmissionController(initial_limit=1, min_limit=1)
+
+    with patch("src.main.admission_controller", new=controller), pytest.raises(RuntimeError):
+        c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick"})
+
+    assert controller.in_flight == 0
+
+
+@pytest.mark.parametrize("endpoint", ["/chat", "/chat_stream"])
+def test_turns_are_serialised_per_user_and_session(client, endpoint):
+    from rickbot_utils.keyed_lock import KeyedLock
+
+    keys = []
+
+    class RecordingLock(KeyedLock):
+        async def acquire(self, key):
+            keys.append(key)
+            return await super().acquire(key)
+
+    c, mock_runner = client
+    counting_run(mock_runner, "Hello from Rick")
+
+    with patch("src.main.session_locks", new=RecordingLock("test.session_locks")):
+        response = c.post(endpoint, data={"prompt": "Hello", "personality": "Rick", "session_id": "s1"})
+
+    assert response.status_code == 200
+    # Another user's session with the same ID doesn't hold this one up
+    assert keys == [("test@example.com", "s1")]
+
+
+@pytest.fixture
+def idempotency():
+    """Fresh idempotency registries, so that keys used by one test don't carry over to the next."""
+    from rickbot_utils.idempotency import IdempotencyRegistry
+
+    with (
+        patch("src.main.idempotent_chats", new=IdempotencyRegistry("test.chat")),
+        patch("src.main.idempotent_streams", new=IdempotencyRegistry("test.chat_stream")),
+    ):
+        yield
+
+
+@pytest.mark.parametrize("endpoint", ["/chat", "/chat_stream"])
+def test_repeated_idempotency_key_runs_the_turn_once(client, idempotency, endpoint):
+    c, mock_runner = client
+    runs = counting_run(mock_runner, "Hello from Rick")
+    data = {"prompt": "Hello", "personality": "Rick", "idempotency_key": "abc-123"}
+
+    first = c.post(endpoint, data=data)
+    second = c.post(endpoint, data=data)
+
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content  # The repeat is given the first request's reply
+    assert len(runs) == 1
+
+    # Without a key, or with a new one, the turn runs again
+    c.post(endpoint, data={**data, "idempotency_key": "abc-456"})
+    c.post(endpoint, data={"prompt": "Hello", "personality": "Rick"})
+    assert len(runs) == 3
+
+
+def test_idempotency_key_reused_for_a_different_prompt_is_rejected(client, idempotency):
+    c, mock_runner = client
+    runs = counting_run(mock_runner, "Hello from Rick")
+
+    c.post("/chat", data={"prompt": "Hello", "personality": "Rick", "idempotency_key": "abc-123"})
+    response = c.post("/chat", data={"prompt": "Goodbye", "personality": "Rick", "idempotency_key": "abc-123"})
+
+    assert response.status_code == 422
+    assert len(runs) == 1
+
+
+def slow_run(mock_runner, text):
+    """The agent sends some text, then takes far longer than the deadline to finish."""
+
+    async def mock_run_async(*args, **kwargs):
+        import asyncio
+
+        event = MagicMock()
+        event.actions = None
+        event.partial = False
+        event.is_final_response.return_value = True
+        event.get_function_calls.return_value = []
+        event.get_function_responses.return_value = []
+        event.content.parts = [MockPart(text=text)]
+        yield event
+        await asyncio.sleep(30)
+
+    mock_runner.run_async = mock_run_async
+
+
+def test_chat_past_its_deadline_returns_a_partial_answer(client):
+    from src.main import DEADLINE_EXCEEDED_NOTE
+
+    c, mock_runner = client
+    slow_run(mock_runner, "Listen, Morty,")
+
+    with patch("src.main.CHAT_DEADLINE_SECONDS", 0.05):
+        response = c.post("/chat", data={"prompt": "Hello", "personality": "Rick"})
+
+    assert response.status_code == 200
+    assert response.json()["response"] == f"Listen, Morty,\n\n_{DEADLINE_EXCEEDED_NOTE}_"
+
+
+def test_chat_stream_past_its_deadline_ends_with_a_partial_answer(client):
+    import json
+
+    from src.main import DEADLINE_EXCEEDED_NOTE
+
+    c, mock_runner = client
+    slow_run(mock_runner, "Listen, Morty,")
+
+    with patch("src.main.CHAT_STREAM_DEADLINE_SECONDS", 0.05):
+        response = c.post("/chat_stream", data={"prompt": "Hello", "personality": "Rick"})
+
+    events = [json.loads(line[6:]) for line in response.content.decode("utf-8").splitlines() if line.startswith("data: ")]
+    text = "".join(e["chunk"] for e in events if "chunk" in e)
+    assert text == f"Listen, Morty,\n\n_{DEADLINE_EXCEEDED_NOTE}_"
+    assert events[-1] == {"done": True}
@@ -0,0 +1,76 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from rickbot_agent import auth
+from rickbot_agent.auth import VerificationResult, authenticate
+from rickbot_agent.auth_models import AuthUser
+
+GITHUB_USER = AuthUser(id="42", email="octo@example.com", name="Octo", provider="github")
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    auth.credential_cache.clear()
+    yield
+    auth.credential_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_authenticate_caches_successful_verification():
+    with patch("rickbot_agent.auth._verify", return_value=VerificationResult(GITHUB_USER, 300)) as mock_verify:
+        assert await authenticate("gho_token") == GITHUB_USER
+        assert await authenticate("gho_token") == GITHUB_USER
+
+    mock_verify.assert_called_once_with("gho_token", "github")
+
+
+@pytest.mark.asyncio
+async def test_authenticate_negative_caches_rejected_token():
+    with patch("rickbot_agent.auth._verify", return_value=VerificationResult(None, 30)) as mock_verify:
+        assert await authenticate("gho_bad") is None
+        assert await authenticate("gho_bad") is None
+
+    mock_verify.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_authenticate_does_not_cache_transient_failures():
+    with patch("rickbot_agent.auth._verify", return_value=VerificationResult(None, 0)) as mock_verify:
+        await authenticate("gho_flaky")
+        await authenticate("gho_flaky")
+
+    assert mock_verify.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_authenticate_collapses_concurrent_lookups():
+    async def slow_verify(token, provider):
+        await asyncio.sleep(0.05)
+        return VerificationResult(GITHUB_USER, 300)
+
+    with patch("rickbot_agent.auth._verify", side_effect=slow_verify) as mock_verify:
+        results = await asyncio.gather(*(authenticate("gho_token") for _ in range(10)))
+
+    assert results == [GITHUB_USER] * 10
+    mock_verify.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_authenticate_does_not_cache_mock_tokens():
+    await authenticate("mock:123:test@example.com:Tester")
+    assert len(auth.credential_cache) == 0
+
+
+def test_cache_key_is_not_the_raw_token():
+    assert "gho_token" not in auth._token_cache_key("gho_token")
+
+
+@pytest.mark.asyncio
+async def test_authenticate_rejects_unclassifiable_token_without_verifying():
+    with patch("rickbot_agent.auth._verify") as mock_verify:
+        assert await authenticate("not-a-real-token") is None
+
+    mock_verify.assert_not_called()
+    assert len(auth.credential_cache) == 0
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+
+import pytest
+import pytest_asyncio
+
+from rickbot_agent.auth_github import GitHubTokenRejected, GitHubTokenVerifier
+
+USERS = {
+    "gho_public_email": {"id": 1, "login": "rick", "name": "Rick Sanchez", "email": "rick@example.com"},
+    "gho_private_email": {"id": 2, "login": "morty", "name": None, "email": None},
+    "gho_slow": {"id": 3, "login": "jerry", "name": "Jerry", "email": "jerry@example.com"},
+}
+
+
+class StubGitHubHandler(BaseHTTPRequestHandler):
+    """Stands in for the GitHub REST API, recording every request it serves."""
+
+    requests: ClassVar[list[str]] = []
+
+    def do_GET(self):
+        token = self.headers.get("Authorization", "").removeprefix("token ")
+        self.requests.append(f"{self.path} {token}")
+        user = USERS.get(token)
+
+        if token == "gho_slow":
+            time.sleep(1)
+        if not user:
+            self._respond(401, {"message": "Bad credentials"})
+        elif self.path == "/user":
+            self._respond(200, user)
+        elif self.path == "/user/emails":
+            emails = [{"email": "backup@example.com", "primary": False}, {"email": "morty@example.com", "primary": True}]
+            self._respond(200, emails)
+        else:
+            self._respond(404, {})
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_github():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGitHubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest_asyncio.fixture
+async def verifier(stub_github):
+    StubGitHubHandler.requests = []
+    verifier = GitHubTokenVerifier(base_url=stub_github, timeout=0.5)
+    yield verifier
+    await verifier.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_user_with_public_email(verifier):
+    user = await verifier.get_user("gho_public_email")
+
+    assert user.id == "1"
+    assert user.email == "rick@example.com"
+    assert user.name == "Rick Sanchez"
+    assert user.provider == "github"
+    assert StubGitHubHandler.requests == ["/user gho_public_email"]
+
+
+@pytest.mark.asyncio
+async def test_private_email_is_fetched_once(verifier):
+    for _ in range(3):
+        user = await verifier.get_user("gho_private_email")
+        assert user.email == "morty@example.com"
+        assert user.name == "morty"
+
+    assert StubGitHubHandler.requests.count("/user/emails gho_private_email") == 1
+    assert StubGitHubHandler.requests.count("/user gho_private_email") == 3
+
+
+@pytest.mark.asyncio
+async def test_rejected_token(verifier):
+    with pytest.raises(GitHubTokenRejected):
+        await verifier.get_user("gho_unknown")
+
+
+@pytest.mark.asyncio
+async def test_slow_github_hits_deadline(verifier):
+    with pytest.raises(TimeoutError):
+        await verifier.get_user("gho_slow")
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused(verifier):
+    await verifier.get_user("gho_public_email")
+    client = verifier.client
+    await verifier.get_user("gho_public_email")
+    assert verifier.client is client
@@ -0,0 +1,134 @@
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+
+from rickbot_agent.auth_google import GoogleTokenVerifier
+
+CLIENT_ID = "test-client-id.apps.googleusercontent.com"
+
+
+def _generate_key() -> tuple[str, str]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private_pem, public_pem
+
+
+@pytest.fixture(scope="module")
+def key_set():
+    """A local stand-in for Google's signing certs: key ID -> (private key, public key)."""
+    return {"key-1": _generate_key(), "key-2": _generate_key()}
+
+
+class FakeCertsFetcher:
+    """Serves the public half of a local key set, counting how often it is called."""
+
+    def __init__(self, key_set, key_ids, max_age=3600):
+        self.key_set = key_set
+        self.key_ids = list(key_ids)
+        self.max_age = max_age
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {kid: self.key_set[kid][1] for kid in self.key_ids}, self.max_age
+
+
+def make_token(key_set, kid="key-1", **overrides):
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": CLIENT_ID,
+        "sub": "1234567890",
+        "email": "rick@example.com",
+        "name": "Rick Sanchez",
+        "iat": now,
+        "exp": now + 3600,
+    }
+    claims.update(overrides)
+    signer = crypt.RSASigner.from_string(key_set[kid][0], key_id=kid)
+    return jwt.encode(signer, claims).decode()
+
+
+def test_verify_valid_token(key_set):
+    fetcher = FakeCertsFetcher(key_set, ["key-1"])
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=fetcher)
+
+    claims = verifier.verify(make_token(key_set))
+
+    assert claims["sub"] == "1234567890"
+    assert claims["email"] == "rick@example.com"
+
+
+def test_certs_are_fetched_once(key_set):
+    fetcher = FakeCertsFetcher(key_set, ["key-1"])
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=fetcher)
+
+    for _ in range(5):
+        verifier.verify(make_token(key_set))
+
+    assert fetcher.calls == 1
+
+
+def test_rejects_wrong_audience(key_set):
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=FakeCertsFetcher(key_set, ["key-1"]))
+    with pytest.raises(ValueError):
+        verifier.verify(make_token(key_set, aud="someone-else"))
+
+
+def test_rejects_wrong_issuer(key_set):
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=FakeCertsFetcher(key_set, ["key-1"]))
+    with pytest.raises(ValueError):
+        verifier.verify(make_token(key_set, iss="https://evil.example.com"))
+
+
+def test_rejects_expired_token(key_set):
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=FakeCertsFetcher(key_set, ["key-1"]))
+    now = int(time.time())
+    with pytest.raises(ValueError):
+        verifier.verify(make_token(key_set, iat=now - 7200, exp=now - 3600))
+
+
+def test_rejects_bad_signature(key_set):
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=FakeCertsFetcher(key_set, ["key-1"]))
+    header, payload, _ = make_token(key_set).split(".")
+    forged = ".".join([header, payload, make_token(key_set, kid="key-2").split(".")[2]])
+    with pytest.raises(ValueError):
+        verifier.verify(forged)
+
+
+def test_rejects_malformed_token(key_set):
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=FakeCertsFetcher(key_set, ["key-1"]))
+    with pytest.raises(ValueError):
+        verifier.verify("gho_notajwt")
+
+
+def test_unknown_key_id_triggers_refresh(key_set):
+    fetcher = FakeCertsFetcher(key_set, ["key-1"])
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=fetcher)
+    verifier.verify(make_token(key_set))
+
+    # Google rotates in a new key
+    fetcher.key_ids.append("key-2")
+    verifier._last_refresh = 0  # Allow an immediate forced refresh
+
+    claims = verifier.verify(make_token(key_set, kid="key-2"))
+    assert claims["sub"] == "1234567890"
+    assert fetcher.calls == 2
+
+
+def test_refresh_schedule_honours_max_age(key_set):
+    now = 1_000_000.0
+    verifier = GoogleTokenVerifier(
+        CLIENT_ID, fetch_certs=FakeCertsFetcher(key_set, ["key-1"], max_age=7200), clock=lambda: now
+    )
+    verifier.refresh()
+    # Refreshed ahead of expiry, by the refresh margin
+    assert verifier.seconds_until_refresh == 7200 - 300
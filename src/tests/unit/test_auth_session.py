@@ -0,0 +1,149 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from rickbot_agent.auth_middleware import AuthMiddleware
+from rickbot_agent.auth_models import AuthUser
+from rickbot_agent.auth_session import SESSION_TOKEN_HEADER, SessionTokenSigner, parse_session_keys
+
+USER = AuthUser(id="123", email="rick@example.com", name="Rick Sanchez", provider="google")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_issue_and_verify_round_trip():
+    signer = SessionTokenSigner({"k1": b"secret"}, ttl=900)
+    user, expires_at = signer.verify(signer.issue(USER))
+
+    assert user == USER
+    assert expires_at > 0
+
+
+def test_expired_token_is_rejected():
+    clock = FakeClock()
+    signer = SessionTokenSigner({"k1": b"secret"}, ttl=900, clock=clock)
+    token = signer.issue(USER)
+
+    clock.now += 901
+    assert signer.verify(token) is None
+
+
+def test_tampered_token_is_rejected():
+    signer = SessionTokenSigner({"k1": b"secret"})
+    version, key_id, _, signature = signer.issue(USER).split(".")
+    other = signer.issue(USER.model_copy(update={"id": "evil"})).split(".")[2]
+
+    assert signer.verify(f"{version}.{key_id}.{other}.{signature}") is None
+    assert signer.verify("rbs1.k1.garbage") is None
+
+
+def test_key_rotation():
+    old_signer = SessionTokenSigner({"old": b"old-secret"})
+    old_token = old_signer.issue(USER)
+
+    # New key added at the front; old key still accepted
+    rotated = SessionTokenSigner({"new": b"new-secret", "old": b"old-secret"})
+    assert rotated.verify(old_token)[0] == USER
+    assert rotated.issue(USER).split(".")[1] == "new"
+
+    # Old key retired
+    retired = SessionTokenSigner({"new": b"new-secret"})
+    assert retired.verify(old_token) is None
+
+
+def test_needs_renewal():
+    clock = FakeClock()
+    signer = SessionTokenSigner({"k1": b"secret"}, ttl=900, clock=clock)
+    _, expires_at = signer.verify(signer.issue(USER))
+
+    assert not signer.needs_renewal(expires_at)
+    clock.now += 500
+    assert signer.needs_renewal(expires_at)
+
+
+def test_parse_session_keys():
+    assert parse_session_keys("k2:two, k1:one") == {"k2": b"two", "k1": b"one"}
+    assert parse_session_keys("") == {}
+    assert parse_session_keys("no-secret") == {}
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware)
+
+    @app.get("/whoami")
+    def whoami(request: Request):
+        user = request.scope.get("user")
+        return {"id": user.id if user else None}
+
+    signer = SessionTokenSigner({"k1": b"secret"})
+    with patch("rickbot_agent.auth_middleware.get_session_signer", return_value=signer):
+        yield TestClient(app), signer
+
+
+def test_middleware_issues_session_token_after_provider_verification(client):
+    c, signer = client
+    response = c.get("/whoami", headers={"Authorization": "Bearer mock:123:test@example.com:Tester"})
+
+    assert response.json() == {"id": "123"}
+    assert signer.verify(response.headers[SESSION_TOKEN_HEADER])[0].id == "123"
+
+
+def test_middleware_accepts_session_token_without_provider_verification(client):
+    c, signer = client
+    with patch("rickbot_agent.auth_middleware.authenticate") as mock_authenticate:
+        response = c.get(
+            "/whoami",
+            headers={
+                "Authorization": "Bearer gho_providertoken",
+                SESSION_TOKEN_HEADER: signer.issue(USER, "gho_providertoken"),
+            },
+        )
+
+    assert response.json() == {"id": "123"}
+    mock_authenticate.assert_not_called()
+    assert SESSION_TOKEN_HEADER not in response.headers  # Still fresh, so not renewed
+
+
+def test_middleware_falls_back_to_provider_on_invalid_session_token(client):
+    c, _ = client
+    response = c.get(
+        "/whoami",
+        headers={"Authorization": "Bearer mock:456:test@example.com:Tester", SESSION_TOKEN_HEADER: "rbs1.k1.bad.token"},
+    )
+
+    assert response.json() == {"id": "456"}
+
+
+def test_middleware_ignores_a_session_token_issued_for_another_bearer_token(client):
+    c, signer = client
+    # Rick's session token, sent with a different user's bearer token
+    response = c.get(
+        "/whoami",
+        headers={
+            "Authorization": "Bearer mock:456:other@example.com:Other",
+            SESSION_TOKEN_HEADER: signer.issue(USER, "gho_ricks_token"),
+        },
+    )
+
+    assert response.json() == {"id": "456"}  # The bearer token is verified, and wins
+    assert signer.verify(response.headers[SESSION_TOKEN_HEADER])[0].id == "456"
+
+
+def test_session_token_is_bound_to_its_bearer_token():
+    signer = SessionTokenSigner({"k1": b"secret"})
+    token = signer.issue(USER, "gho_one")
+
+    assert signer.verify(token, "gho_one")[0] == USER
+    assert signer.verify(token) is not None  # Sent on its own
+    assert signer.verify(token, "gho_two") is None
+    assert signer.verify(signer.issue(USER), "gho_one") is None  # Unbound tokens can't be paired with one
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from google.genai.types import Part
+
+from main import _follow_turn, _prepare_turn, _pump_events, _start_saving_artifacts, turn_streams
+from rickbot_agent.auth_models import AuthUser, PersonaAccessDeniedException
+from rickbot_utils.metrics import metrics
+
+STAGE_SECONDS = 0.2
+
+user = AuthUser(id="user123", email="user@example.com", name="Test User", provider="mock")
+
+
+def upload(filename, data=b"data", content_type="text/plain"):
+    f = MagicMock()
+    f.filename = filename
+    f.content_type = content_type
+    f.read = AsyncMock(return_value=data)
+    return f
+
+
+async def slow_check(personality, user):
+    await asyncio.sleep(STAGE_SECONDS)
+
+
+def slow_get_agent(personality):
+    time.sleep(STAGE_SECONDS)
+    return MagicMock(name=f"agent-{personality}")
+
+
+@pytest.fixture
+def session_service():
+    service = AsyncMock()
+
+    async def get_session(**kwargs):
+        await asyncio.sleep(STAGE_SECONDS)
+        return None
+
+    service.get_session.side_effect = get_session
+    with patch("main.session_service", new=service):
+        yield service
+
+
+@pytest.mark.asyncio
+async def test_stages_run_concurrently(session_service):
+    with patch("main.check_persona_access", side_effect=slow_check), \
+         patch("main.get_agent", side_effect=slow_get_agent):
+        started = time.perf_counter()
+        turn = await _prepare_turn("Hello", None, "Rick", user, [upload("a.txt", b"aaa"), upload("b.txt", b"bbb")])
+        elapsed = time.perf_counter() - started
+
+    # The access check then the session lookup, with the agent load and file reads alongside, not the sum of the stages
+    assert elapsed < STAGE_SECONDS * 3
+    session_service.create_session.assert_awaited_once()
+    assert turn.session_id == session_service.create_session.call_args.kwargs["session_id"]
+    assert [name for name, _ in turn.uploads] == ["user:a.txt", "user:b.txt"]
+    assert turn.new_message.parts[0].text == "Hello"
+    assert [p.inline_data.data for p in turn.new_message.parts[1:]] == [b"aaa", b"bbb"]
+
+
+@pytest.mark.asyncio
+async def test_access_denied_cancels_other_stages(session_service):
+    file_reads_finished = asyncio.Event()
+
+    async def slow_read_files(files):
+        await asyncio.sleep(5)
+        file_reads_finished.set()
+
+    async def slow_denial(personality, user):
+        await asyncio.sleep(STAGE_SECONDS)
+        raise PersonaAccessDeniedException(personality, "supporter")
+
+    with patch("main.check_persona_access", side_effect=slow_denial), \
+         patch("main._read_files", side_effect=slow_read_files), \
+         patch("main.get_agent"):
+        started = time.perf_counter()
+        with pytest.raises(PersonaAccessDeniedException):
+            await _prepare_turn("Hello", "session-1", "Dazbo", user, [])
+
+    assert time.perf_counter() - started < 1
+    assert not file_reads_finished.is_set()
+    # The session isn't looked up until access has been granted, so a denied request doesn't create one
+    session_service.get_session.assert_not_called()
+    session_service.create_session.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_artifacts_are_saved_in_background():
+    saved = []
+
+    async def save_artifact(**kwargs):
+        await asyncio.sleep(STAGE_SECONDS)
+        saved.append(kwargs["filename"])
+
+    artifact_service = MagicMock()
+    artifact_service.save_artifact.side_effect = save_artifact
+    uploads = [("user:a.txt", Part.from_bytes(data=b"a", mime_type="text/plain"))]
+
+    with patch("main.artifact_service", new=artifact_service):
+        task = _start_saving_artifacts(uploads, "user@example.com", "session-1")
+        assert saved == []  # Returns straight away, so the model run isn't held up
+        await task
+
+    assert saved == ["user:a.txt"]
+    assert _start_saving_artifacts([], "user@example.com", "session-1") is None
+
+
+def run_events(count, closed):
+    """An agent run yielding `count` events, recording when it is closed."""
+
+    async def events():
+        try:
+            for i in range(count):
+                yield f"event-{i}"
+        finally:
+            closed.set()
+
+    return events()
+
+
+@pytest.mark.asyncio
+async def test_pump_events_completes():
+    closed = asyncio.Event()
+    queue: asyncio.Queue[object] = asyncio.Queue(maxsize=2)
+    received = []
+
+    async def consume():
+        while (item := await queue.get()) is not None:
+            received.append(item)
+
+    await asyncio.gather(_pump_events(run_events(5, closed), queue, "s1"), consume())
+
+    assert received == [f"event-{i}" for i in range(5)]
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_pump_events_cancels_run_for_slow_client():
+    closed = asyncio.Event()
+    queue: asyncio.Queue[object] = asyncio.Queue(maxsize=2)
+    aborted_before = metrics.counter("chat_stream.aborted.slow_client").value
+
+    with patch("main.SSE_SLOW_CLIENT_TIMEOUT_SECONDS", 0.05):
+        pump = asyncio.create_task(_pump_events(run_events(1000, closed), queue, "s1"))
+        await asyncio.wait_for(closed.wait(), 1)  # Nobody reads, so the run is cancelled once the queue stays full
+
+    # The queue never grows past its limit, and the client is told the stream was stopped once it catches up
+    assert queue.qsize() == 2
+    assert [queue.get_nowait(), queue.get_nowait()] == ["event-0", "event-1"]
+    await asyncio.wait_for(pump, 1)
+    assert queue.get_nowait() == "aborted"
+    assert metrics.counter("chat_stream.aborted.slow_client").value == aborted_before + 1
+
+
+@pytest.mark.asyncio
+async def test_pump_events_passes_on_run_errors():
+    async def failing_run():
+        yield "event-0"
+        raise RuntimeError("model overloaded")
+
+    queue: asyncio.Queue[object] = asyncio.Queue(maxsize=4)
+    await _pump_events(failing_run(), queue, "s1")
+
+    assert queue.get_nowait() == "event-0"
+    assert isinstance(queue.get_nowait(), RuntimeError)
+
+
+@pytest.mark.asyncio
+async def test_follow_turn_replays_then_follows_live_turn():
+    turn = turn_streams.start(owner=user.email)
+    turn.publish_nowait(b"data: 1\n\n")
+    turn.publish_nowait(b"data: 2\n\n")
+    received = []
+
+    async def follow():
+        async for frame in _follow_turn(turn, after_seq=1):  # Reconnected having received frame 1
+            received.append(frame)
+
+    follower = asyncio.create_task(follow())
+    await asyncio.sleep(0.01)
+    assert received == [f"id: {turn.turn_id}:2\ndata: 2\n\n".encode()]
+    assert turn.delivered == 2
+
+    turn.publish_nowait(b"data: 3\n\n")
+    turn_streams.finish(turn)
+    await asyncio.wait_for(follower, 1)
+    assert received[1:] == [f"id: {turn.turn_id}:3\ndata: 3\n\n".encode()]
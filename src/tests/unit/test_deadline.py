@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from rickbot_utils.deadline import Deadline, current_deadline, deadline_scope
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_remaining_counts_down_to_zero():
+    clock = FakeClock()
+    deadline = Deadline(10, clock=clock)
+
+    clock.now = 4
+    assert deadline.remaining() == 6
+    assert not deadline.expired
+
+    clock.now = 11
+    assert deadline.remaining() == 0
+    assert deadline.expired
+
+
+@pytest.mark.asyncio
+async def test_scope_is_carried_into_tasks_and_reset_on_exit():
+    deadline = Deadline(10)
+
+    async def seen_by_task():
+        return current_deadline()
+
+    with deadline_scope(deadline):
+        task = asyncio.create_task(seen_by_task())
+    assert current_deadline() is None
+
+    assert await task is deadline
@@ -0,0 +1,103 @@
+import asyncio
+from contextlib import ExitStack
+
+import pytest
+
+from rickbot_utils.heartbeat import HEARTBEAT, HeartbeatScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_heartbeats_only_idle_streams():
+    clock = FakeClock()
+    scheduler = HeartbeatScheduler(interval=15, clock=clock)
+    idle: asyncio.Queue[object] = asyncio.Queue()
+    busy: asyncio.Queue[object] = asyncio.Queue()
+
+    with scheduler.register(idle), scheduler.register(busy) as busy_stream:
+        clock.now += 10
+        busy_stream.touch()
+        clock.now += 5
+
+        assert scheduler.tick() == 1
+        assert drain(idle) == [HEARTBEAT]
+        assert drain(busy) == []
+
+        # Each stream is next due an interval after it was last active, or last sent a heartbeat
+        clock.now += 10
+        assert scheduler.tick() == 1
+        assert drain(busy) == [HEARTBEAT]
+        clock.now += 5
+        assert scheduler.tick() == 1
+        assert drain(idle) == [HEARTBEAT]
+
+
+def test_streams_unregister_on_exit():
+    clock = FakeClock()
+    scheduler = HeartbeatScheduler(interval=15, clock=clock)
+    queue: asyncio.Queue[object] = asyncio.Queue()
+
+    with pytest.raises(RuntimeError), scheduler.register(queue):
+        assert len(scheduler) == 1
+        raise RuntimeError("client disconnected")
+
+    assert len(scheduler) == 0
+    clock.now += 60
+    assert scheduler.tick() == 0
+    assert queue.empty()
+
+
+def test_full_queue_is_skipped():
+    clock = FakeClock()
+    scheduler = HeartbeatScheduler(interval=15, clock=clock)
+    queue: asyncio.Queue[object] = asyncio.Queue(maxsize=1)
+    queue.put_nowait("event")
+
+    with scheduler.register(queue):
+        clock.now += 15
+        assert scheduler.tick() == 0  # Never blocks the ticker
+
+    assert drain(queue) == ["event"]
+
+
+def test_many_streams():
+    clock = FakeClock()
+    scheduler = HeartbeatScheduler(interval=15, clock=clock)
+    queues: list[asyncio.Queue[object]] = [asyncio.Queue() for _ in range(100)]
+
+    with ExitStack() as stack:
+        streams = [stack.enter_context(scheduler.register(q)) for q in queues]
+        clock.now += 15
+        for stream in streams[1:]:
+            stream.touch()
+
+        assert scheduler.tick() == 1
+        assert [q.qsize() for q in queues] == [1] + [0] * 99
+
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_posts_heartbeats():
+    scheduler = HeartbeatScheduler(interval=0.05, tick=0.01)
+    queue: asyncio.Queue[object] = asyncio.Queue()
+
+    with scheduler.register(queue):
+        task = asyncio.create_task(scheduler.run())
+        try:
+            assert await asyncio.wait_for(queue.get(), 1) == HEARTBEAT
+        finally:
+            task.cancel()
@@ -0,0 +1,171 @@
+"""Runs long conversations through a real ADK Runner, with a fake model, to check the prompt sent stays bounded."""
+
+from collections.abc import AsyncGenerator, Sequence
+
+import pytest
+from google.adk.agents import Agent
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService, Session
+from google.genai.types import Content, Part
+from pydantic import Field
+
+from rickbot_agent.history import (
+    SUMMARIZED_TURNS_STATE_KEY,
+    SUMMARY_STATE_KEY,
+    HistoryCompactor,
+    HistoryPolicy,
+    estimate_tokens,
+    split_turns,
+)
+
+# Each reply is about 100 tokens
+REPLY = "Wubba lubba dub dub! " * 20
+
+
+class FakeLlm(BaseLlm):
+    """Records the tokens and system instruction of every request, and gives the same long reply to each."""
+
+    requests: list[tuple[int, str]] = Field(default_factory=list)
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        self.requests.append((estimate_tokens(llm_request.contents), str(llm_request.config.system_instruction)))
+        yield LlmResponse(content=Content(role="model", parts=[Part.from_text(text=REPLY)]))
+
+
+class FakeSummarizer:
+    def __init__(self):
+        self.calls: list[tuple[str | None, int]] = []
+
+    async def __call__(self, summary, contents):
+        self.calls.append((summary, len(contents)))
+        return f"Summary {len(self.calls)}"
+
+
+def user_message(text: str) -> Content:
+    return Content(role="user", parts=[Part.from_text(text=text)])
+
+
+async def get_session(sessions: InMemorySessionService, user_id: str) -> Session:
+    session = await sessions.get_session(app_name="test", user_id=user_id, session_id="s1")
+    assert session is not None
+    return session
+
+
+async def converse(
+    compactor: HistoryCompactor | None, turns: int, user_ids: Sequence[str] = ("morty",), prompt: str = "Question {i}?"
+) -> tuple[FakeLlm, InMemorySessionService]:
+    """Hold a conversation of the given turns with each user, in turn, all in sessions with the same ID."""
+    llm = FakeLlm(model="fake")
+    agent = Agent(
+        name="rickbot_Rick",
+        model=llm,
+        instruction="You are Rick.",
+        before_model_callback=compactor.before_model if compactor else None,
+    )
+    sessions = InMemorySessionService()
+    runner = Runner(agent=agent, app_name="test", session_service=sessions)
+
+    for user_id in user_ids:
+        await sessions.create_session(app_name="test", user_id=user_id, session_id="s1")
+        for i in range(turns):
+            message = user_message(prompt.format(i=i, user_id=user_id))
+            async for _ in runner.run_async(user_id=user_id, session_id="s1", new_message=message):
+                pass
+            if compactor:
+                await compactor.wait_for_summaries()  # Written between turns
+    return llm, sessions
+
+
+@pytest.mark.asyncio
+async def test_prompt_tokens_grow_without_compaction():
+    llm, _ = await converse(None, 30)
+
+    tokens = [t for t, _ in llm.requests]
+    assert tokens[-1] > 2800  # 29 earlier replies of 100 tokens each
+
+
+@pytest.mark.asyncio
+async def test_window_policy_bounds_prompt_tokens():
+    llm, _ = await converse(HistoryCompactor(HistoryPolicy.WINDOW, max_turns=5), 30)
+
+    tokens = [t for t, _ in llm.requests]
+    assert max(tokens) == max(tokens[4:])  # Stops growing once the window is full
+    assert max(tokens) < 5 * 110
+
+
+@pytest.mark.asyncio
+async def test_summary_policy_bounds_prompt_tokens_and_keeps_a_rolling_summary():
+    summarizer = FakeSummarizer()
+    compactor = HistoryCompactor(HistoryPolicy.SUMMARY, summarizer, max_turns=20, threshold_tokens=500, keep_turns=2)
+    llm, sessions = await converse(compactor, 30)
+
+    tokens = [t for t, _ in llm.requests]
+    assert max(tokens) < 500 + 110  # The threshold, plus the turn in progress
+    assert max(tokens) == max(tokens[10:20]) == max(tokens[20:])  # Flat from turn to turn
+
+    # Each summary folds the previous one into it
+    assert len(summarizer.calls) > 1
+    assert summarizer.calls[0][0] is None
+    assert summarizer.calls[1][0] == "Summary 1"
+
+    # The summary is sent in the system instruction, and saved in the session
+    assert "Summary" in llm.requests[-1][1]
+    session = await get_session(sessions, "morty")
+    assert session.state[SUMMARY_STATE_KEY].startswith("Summary")
+    assert session.state[SUMMARIZED_TURNS_STATE_KEY] > 0
+    assert len(session.events) == 60  # The session itself keeps every turn
+
+
+@pytest.mark.asyncio
+async def test_failed_summaries_fall_back_to_the_window():
+    async def failing_summarizer(summary, contents):
+        raise RuntimeError("Model unavailable")
+
+    compactor = HistoryCompactor(HistoryPolicy.SUMMARY, failing_summarizer, max_turns=5, threshold_tokens=200, keep_turns=1)
+    llm, _ = await converse(compactor, 15)
+
+    assert max(t for t, _ in llm.requests) < 5 * 110
+
+
+@pytest.mark.asyncio
+async def test_summaries_are_kept_per_user_session():
+    async def folding_summarizer(summary, contents):
+        questions = [part.text for content in contents if content.role == "user" for part in content.parts if part.text]
+        return " ".join([summary, *questions] if summary else questions)
+
+    # Summarises on every turn, so Morty's last summary is still pending when Summer starts
+    compactor = HistoryCompactor(HistoryPolicy.SUMMARY, folding_summarizer, max_turns=20, threshold_tokens=0, keep_turns=1)
+    _, sessions = await converse(compactor, 5, user_ids=("morty", "summer"), prompt="{user_id} asks {i}?")
+
+    # Summer's session has the same ID as Morty's, but none of his conversation
+    session = await get_session(sessions, "summer")
+    assert "summer asks 0?" in session.state[SUMMARY_STATE_KEY]
+    assert "morty" not in session.state[SUMMARY_STATE_KEY]
+
+
+@pytest.mark.asyncio
+async def test_drain_saves_pending_summaries_to_their_sessions():
+    summarizer = FakeSummarizer()
+    # Summarises on every turn, so the last summary is still waiting for the session's next request
+    compactor = HistoryCompactor(HistoryPolicy.SUMMARY, summarizer, max_turns=20, threshold_tokens=0, keep_turns=1)
+    _, sessions = await converse(compactor, 5)
+    session = await get_session(sessions, "morty")
+    assert session.state[SUMMARY_STATE_KEY] != f"Summary {len(summarizer.calls)}"
+
+    await compactor.drain(sessions)
+
+    session = await get_session(sessions, "morty")
+    assert session.state[SUMMARY_STATE_KEY] == f"Summary {len(summarizer.calls)}"
+    assert session.state[SUMMARIZED_TURNS_STATE_KEY] == 3  # All but the last turn kept, and the turn in progress
+    assert len(session.events) == 11  # The conversation, and the event saving the summary
+
+
+def test_split_turns_keeps_tool_calls_with_their_turn():
+    tool_call = Content(role="model", parts=[Part.from_function_call(name="RagAgent", args={"request": "GKE"})])
+    tool_response = Content(role="user", parts=[Part.from_function_response(name="RagAgent", response={"result": "x"})])
+    reply = Content(role="model", parts=[Part.from_text(text="GKE is...")])
+
+    turns = split_turns([user_message("Hi"), reply, user_message("GKE?"), tool_call, tool_response, reply])
+
+    assert [len(turn) for turn in turns] == [2, 4]
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from rickbot_utils.idempotency import IdempotencyKeyReusedException, IdempotencyRegistry
+
+
+class Submission:
+    """Counts its runs, and blocks until released."""
+
+    def __init__(self, result="reply"):
+        self.result = result
+        self.runs = 0
+        self.release = asyncio.Event()
+        self.error: Exception | None = None
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.asyncio
+async def test_concurrent_repeats_share_one_run():
+    registry = IdempotencyRegistry("test")
+    submission = Submission()
+
+    waiting = [asyncio.create_task(registry.run_once("rick", "key", "Hello", submission)) for _ in range(3)]
+    await asyncio.sleep(0)
+    submission.release.set()
+
+    assert await asyncio.gather(*waiting) == ["reply"] * 3
+    assert submission.runs == 1
+
+
+@pytest.mark.asyncio
+async def test_later_repeats_get_the_remembered_result():
+    registry = IdempotencyRegistry("test")
+    submission = Submission()
+    submission.release.set()
+
+    assert await registry.run_once("rick", "key", "Hello", submission) == "reply"
+    assert await registry.run_once("rick", "key", "Hello", submission) == "reply"
+    assert submission.runs == 1
+
+
+@pytest.mark.asyncio
+async def test_keys_are_scoped_to_the_owner():
+    registry = IdempotencyRegistry("test")
+    submission = Submission()
+    submission.release.set()
+
+    await registry.run_once("rick", "key", "Hello", submission)
+    await registry.run_once("morty", "key", "Hello", submission)
+    assert submission.runs == 2
+
+
+@pytest.mark.asyncio
+async def test_reusing_a_key_for_a_different_request_raises():
+    registry = IdempotencyRegistry("test")
+    submission = Submission()
+    submission.release.set()
+
+    await registry.run_once("rick", "key", "Hello", submission)
+    with pytest.raises(IdempotencyKeyReusedException):
+        await registry.run_once("rick", "key", "Goodbye", submission)
+
+
+@pytest.mark.asyncio
+async def test_failed_runs_are_forgotten_so_they_can_be_retried():
+    registry = IdempotencyRegistry("test")
+    submission = Submission()
+    submission.error = RuntimeError("Model unavailable")
+    submission.release.set()
+
+    with pytest.raises(RuntimeError):
+        await registry.run_once("rick", "key", "Hello", submission)
+    assert len(registry) == 0
+
+    submission.error = None
+    assert await registry.run_once("rick", "key", "Hello", submission) == "reply"
+    assert submission.runs == 2
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_submitter_does_not_cancel_the_run_for_its_repeats():
+    registry = IdempotencyRegistry("test")
+    submission = Submission()
+
+    first = asyncio.create_task(registry.run_once("rick", "key", "Hello", submission))
+    repeat = asyncio.create_task(registry.run_once("rick", "key", "Hello", submission))
+    await asyncio.sleep(0)
+    first.cancel()
+    submission.release.set()
+
+    assert await repeat == "reply"
+    assert submission.runs == 1
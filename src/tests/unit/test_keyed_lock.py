@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from rickbot_utils.keyed_lock import KeyedLock
+
+
+@pytest.mark.asyncio
+async def test_work_for_one_key_runs_in_order():
+    lock = KeyedLock("test")
+    order = []
+
+    async def turn(name, seconds):
+        async with lock.hold("session"):
+            order.append(f"{name} start")
+            await asyncio.sleep(seconds)
+            order.append(f"{name} end")
+
+    await asyncio.gather(turn("first", 0.01), turn("second", 0))
+
+    assert order == ["first start", "first end", "second start", "second end"]
+    assert len(lock) == 0  # Dropped once unused
+
+
+@pytest.mark.asyncio
+async def test_different_keys_run_concurrently():
+    lock = KeyedLock("test")
+
+    async with lock.hold("a"):
+        async with asyncio.timeout(1):
+            async with lock.hold("b"):
+                assert lock.locked("a")
+                assert lock.locked("b")
+
+
+@pytest.mark.asyncio
+async def test_release_can_be_called_from_another_task_and_only_once():
+    lock = KeyedLock("test")
+    release = await lock.acquire("session")
+
+    waiter = asyncio.create_task(lock.acquire("session"))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    async def background():
+        release()
+
+    await asyncio.create_task(background())
+    release_waiter = await waiter
+    release()  # Already released: does nothing to the waiter's hold
+    assert lock.locked("session")
+
+    release_waiter()
+    assert len(lock) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_no_entry():
+    lock = KeyedLock("test")
+    release = await lock.acquire("session")
+
+    waiter = asyncio.create_task(lock.acquire("session"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    release()
+    assert len(lock) == 0
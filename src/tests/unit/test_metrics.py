@@ -0,0 +1,21 @@
+from rickbot_utils.metrics import MetricsRegistry
+
+
+def test_counter():
+    registry = MetricsRegistry()
+    registry.counter("requests").inc()
+    registry.counter("requests").inc(2)
+
+    assert registry.snapshot()["counters"] == {"requests": 3}
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value)
+
+    snapshot = registry.snapshot()["histograms"]["latency"]
+    assert snapshot["count"] == 4
+    assert snapshot["sum"] == 4.05
+    assert snapshot["buckets"] == {"0.1": 1, "1.0": 3, "+Inf": 4}
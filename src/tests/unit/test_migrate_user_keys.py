@@ -0,0 +1,190 @@
+"""Runs scripts/migrate_user_keys.py against an in-memory fake of the synchronous Firestore client."""
+
+import importlib.util
+from datetime import UTC, datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+_SCRIPT = Path(__file__).parents[3] / "scripts" / "migrate_user_keys.py"
+_spec = importlib.util.spec_from_file_location("migrate_user_keys", _SCRIPT)
+assert _spec and _spec.loader
+migrate = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(migrate)
+
+EARLIER = datetime(2025, 1, 1, tzinfo=UTC)
+LATER = datetime(2025, 6, 1, tzinfo=UTC)
+
+
+class FakeSnapshot:
+    def __init__(self, db, doc_id):
+        self.id = doc_id
+        self.reference = FakeRef(db, doc_id)
+        self.exists = doc_id in db.users
+        self._data = dict(db.users[doc_id]) if self.exists else None
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeRef:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+
+class FakeQuery:
+    def __init__(self, db, limit=None, after=None):
+        self.db = db
+        self._limit = limit
+        self._after = after
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, n):
+        return FakeQuery(self.db, n, self._after)
+
+    def start_after(self, fields):
+        (ref,) = fields.values()
+        return FakeQuery(self.db, self._limit, ref.id)
+
+    def stream(self):
+        doc_ids = sorted(doc_id for doc_id in self.db.users if self._after is None or doc_id > self._after)
+        return iter([FakeSnapshot(self.db, doc_id) for doc_id in doc_ids[: self._limit]])
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref.id, data))
+
+    def delete(self, ref):
+        self.writes.append((ref.id, None))
+
+    def commit(self):
+        self.db.commits += 1
+        if self.db.fail_on_commit == self.db.commits:
+            raise RuntimeError("Deadline exceeded")
+        for doc_id, data in self.writes:
+            if data is None:
+                self.db.users.pop(doc_id, None)
+            else:
+                self.db.users[doc_id] = data
+
+
+class FakeDb:
+    def __init__(self, users):
+        self.users = dict(users)
+        self.commits = 0
+        self.fail_on_commit = None
+
+    def collection(self, name):
+        assert name == "users"
+        query = FakeQuery(self)
+        query.document = lambda doc_id: FakeRef(self, doc_id)  # type: ignore[attr-defined]
+        return query
+
+    def get_all(self, refs):
+        return [FakeSnapshot(self, ref.id) for ref in refs]
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def legacy(name, provider, user_id, role="standard", last_logged_in=EARLIER):
+    data = {"id": user_id, "provider": provider, "name": name, "role": role, "last_logged_in": last_logged_in}
+    return f"{name.replace(' ', '_')}:{provider}:{user_id}", data
+
+
+@pytest.fixture
+def run(monkeypatch, tmp_path):
+    """Runs the migration against a FakeDb, returning the checkpoint path."""
+    checkpoint = tmp_path / "checkpoint"
+
+    def run(db, batch_size=2, dry_run=False):
+        monkeypatch.setattr(migrate, "firestore", SimpleNamespace(Client=lambda project: db))
+        migrate.migrate_user_keys("test-project", batch_size, checkpoint, dry_run)
+        return checkpoint
+
+    return run
+
+
+def test_merge_user_keeps_highest_role_and_latest_login():
+    older = {"name": "Old Name", "role": "supporter", "last_logged_in": EARLIER}
+    newer = {"name": "New Name", "role": "standard", "last_logged_in": LATER}
+
+    for merged in (migrate.merge_user(older, newer), migrate.merge_user(newer, older)):
+        assert merged["role"] == "supporter"
+        assert merged["name"] == "New Name"
+        assert merged["last_logged_in"] == LATER
+
+    assert migrate.merge_user(None, newer) == newer
+
+
+def test_merge_user_treats_a_missing_login_as_oldest():
+    merged = migrate.merge_user({"name": "Logged In", "last_logged_in": EARLIER}, {"name": "Never Logged In"})
+
+    assert merged["name"] == "Logged In"
+
+
+def test_migrate_page_merges_legacy_documents_and_existing_target():
+    db = FakeDb([
+        legacy("Old Name", "github", "123", role="supporter"),
+        legacy("New Name", "github", "123", last_logged_in=LATER),
+        ("github:123", {"id": "123", "provider": "github", "role": "standard", "email": "rick@example.com"}),
+        ("no-provider", {"id": "456"}),
+    ])
+
+    snapshots = [FakeSnapshot(db, doc_id) for doc_id in sorted(db.users)]
+    assert migrate.migrate_page(db, snapshots, dry_run=False) == 2
+
+    assert sorted(db.users) == ["github:123", "no-provider"]  # Documents it can't migrate are left alone
+    user = db.users["github:123"]
+    assert user["role"] == "supporter"
+    assert user["name"] == "New Name"
+    assert user["email"] == "rick@example.com"
+    assert db.commits == 1  # The sets and deletes are written together
+
+
+def test_migrate_page_dry_run_writes_nothing():
+    db = FakeDb([legacy("Rick", "google", "c137")])
+
+    assert migrate.migrate_page(db, [FakeSnapshot(db, doc_id) for doc_id in db.users], dry_run=True) == 1
+    assert db.commits == 0
+    assert "google:c137" not in db.users
+
+
+def test_migrate_user_keys_pages_through_every_document(run):
+    db = FakeDb([legacy(f"User {i}", "google", str(i)) for i in range(5)])
+
+    checkpoint = run(db)
+
+    assert sorted(db.users) == [f"google:{i}" for i in range(5)]
+    assert not checkpoint.exists()  # Removed once the migration is complete
+
+
+def test_migrate_user_keys_resumes_from_checkpoint(run, tmp_path):
+    db = FakeDb([legacy(f"User {i}", "google", str(i)) for i in range(6)])
+    db.fail_on_commit = 2
+
+    with pytest.raises(RuntimeError):
+        run(db)
+
+    assert (tmp_path / "checkpoint").read_text() == "User_1:google:1"  # The last document of the first page
+    first_page = sorted(doc_id for doc_id in db.users if doc_id.startswith("google:"))
+    assert first_page == ["google:0", "google:1"]
+
+    db.fail_on_commit = None
+    commits = db.commits
+    checkpoint = run(db)
+
+    assert sorted(db.users) == [f"google:{i}" for i in range(6)]
+    assert not checkpoint.exists()
+    # The second run starts after the first page, rather than reading it again; the migrated documents sort after the
+    # legacy ones, so are read (and skipped, being already migrated) on the last page
+    assert db.commits - commits == 2
@@ -0,0 +1,106 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from rickbot_agent.persona_tiers import PersonaTierTable
+
+
+class FakeListener:
+    """Stands in for a Firestore snapshot listener, letting tests push changes."""
+
+    def __init__(self, initial=None):
+        self.initial = initial
+        self.callback = None
+        self.unsubscribed = False
+
+    def __call__(self, callback):
+        self.callback = callback
+        if self.initial is not None:
+            callback(self.initial)
+        return self.unsubscribe
+
+    def push(self, tiers):
+        self.callback(tiers)
+
+    def unsubscribe(self):
+        self.unsubscribed = True
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for condition"
+        time.sleep(0.01)
+
+
+def test_not_loaded_until_started():
+    table = PersonaTierTable(loader=lambda: {"dazbo": "supporter"})
+    assert not table.loaded
+    assert table.get("dazbo") is None
+
+
+def test_listener_pushes_changes_without_reloading():
+    loads: list[int] = []
+
+    def loader() -> dict[str, str]:
+        loads.append(1)
+        return {}
+
+    listener = FakeListener(initial={"rick": "standard", "dazbo": "supporter"})
+    table = PersonaTierTable(loader=loader, subscriber=listener, poll_interval=60)
+    table.start()
+    try:
+        assert table.get("Dazbo") == "supporter"
+        assert table.get("Rick") == "standard"
+
+        listener.push({"rick": "standard", "dazbo": "standard", "yasmin": "supporter"})
+        assert table.get("Dazbo") == "standard"
+        assert table.get("Yasmin") == "supporter"
+
+        # Reads are served from memory
+        for _ in range(100):
+            table.get("Rick")
+        assert loads == []
+    finally:
+        table.stop()
+
+    assert listener.unsubscribed
+
+
+def test_unknown_persona_defaults_to_standard():
+    table = PersonaTierTable(loader=dict)
+    table.replace({"dazbo": "supporter"})
+    assert table.get("Morty") == "standard"
+
+
+def test_polls_when_listener_unavailable():
+    def broken_listener(callback):
+        raise RuntimeError("listen failed")
+
+    tiers = {"dazbo": "supporter"}
+    table = PersonaTierTable(loader=lambda: dict(tiers), subscriber=broken_listener, poll_interval=0.05)
+    table.start()
+    try:
+        wait_for(lambda: table.get("dazbo") == "supporter")
+
+        tiers["dazbo"] = "standard"
+        wait_for(lambda: table.get("dazbo") == "standard")
+    finally:
+        table.stop()
+
+
+@pytest.mark.asyncio
+async def test_get_required_role_reads_from_table():
+    from rickbot_agent import services
+
+    table = PersonaTierTable(loader=dict)
+    table.replace({"dazbo": "supporter"})
+    repo = MagicMock()
+
+    with patch("rickbot_agent.services.get_persona_tier_table", return_value=table), \
+         patch("rickbot_agent.services.get_access_repository", return_value=repo):
+        assert await services.get_required_role("Dazbo") == "supporter"
+        assert await services.get_required_role("Rick") == "standard"
+
+    repo.get_required_role.assert_not_called()
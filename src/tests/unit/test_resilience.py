@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from rickbot_utils.resilience import Bulkhead, BulkheadFullException, CircuitBreaker, CircuitState
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_breaker(clock, **kwargs):
+    kwargs.setdefault("failure_rate_threshold", 0.5)
+    kwargs.setdefault("minimum_calls", 4)
+    kwargs.setdefault("window_size", 10)
+    kwargs.setdefault("open_seconds", 30)
+    return CircuitBreaker("test", clock=clock, **kwargs)
+
+
+def test_breaker_opens_at_the_failure_rate():
+    breaker = make_breaker(FakeClock())
+
+    for succeeded in (True, False, True):
+        assert breaker.allow()
+        breaker.record(succeeded)
+    assert breaker.state is CircuitState.CLOSED  # Too few calls to act on
+
+    breaker.record(False)  # 2 of 4 failed
+    assert breaker.state is CircuitState.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_ignores_abandoned_calls():
+    breaker = make_breaker(FakeClock())
+
+    for _ in range(4):
+        breaker.record(None)
+
+    assert breaker.state is CircuitState.CLOSED
+    assert breaker.failure_rate == 0
+
+
+def test_breaker_failure_rate_is_over_the_window():
+    breaker = make_breaker(FakeClock(), window_size=4, failure_rate_threshold=0.75)
+
+    for succeeded in (False, False, True, True, True, False, False):
+        breaker.record(succeeded)
+
+    # Only the last 4 calls count: 2 of them failed
+    assert breaker.state is CircuitState.CLOSED
+    assert breaker.failure_rate == 0.5
+
+
+def test_breaker_half_opens_after_open_seconds_and_closes_on_a_successful_probe():
+    clock = FakeClock()
+    breaker = make_breaker(clock, minimum_calls=1)
+    breaker.record(False)
+    assert breaker.state is CircuitState.OPEN
+
+    clock.now += 30
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # Only one probe at a time
+
+    breaker.record(True)
+    assert breaker.state is CircuitState.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_on_a_failed_probe():
+    clock = FakeClock()
+    breaker = make_breaker(clock, minimum_calls=1)
+    breaker.record(False)
+    clock.now += 30
+
+    assert breaker.allow()
+    breaker.record(False)
+
+    assert breaker.state is CircuitState.OPEN
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_abandoned_probe_frees_the_probe_slot():
+    clock = FakeClock()
+    breaker = make_breaker(clock, minimum_calls=1)
+    breaker.record(False)
+    clock.now += 30
+
+    assert breaker.allow()
+    breaker.record(None)
+
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_bulkhead_refuses_calls_past_its_limit():
+    bulkhead = Bulkhead("test", max_concurrent=1)
+
+    async with bulkhead.slot():
+        with pytest.raises(BulkheadFullException):
+            async with bulkhead.slot():
+                pass
+
+    async with bulkhead.slot():  # Released
+        pass
+
+
+@pytest.mark.asyncio
+async def test_bulkhead_waits_up_to_max_wait():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_wait=1)
+    entered = []
+
+    async def hold(seconds):
+        async with bulkhead.slot():
+            entered.append(seconds)
+            await asyncio.sleep(seconds)
+
+    await asyncio.gather(hold(0.01), hold(0))
+    assert entered == [0.01, 0]
+
+    bulkhead.max_wait = 0.01
+    with pytest.raises(BulkheadFullException):
+        await asyncio.gather(hold(0.1), hold(0))
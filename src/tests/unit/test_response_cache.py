@@ -0,0 +1,97 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from rickbot_agent.response_cache import (
+    InMemoryResponseCacheBackend,
+    ResponseCache,
+    ResponseCacheKey,
+    normalize_prompt,
+    stream_pieces,
+)
+
+
+def agent(name="rickbot_Rick", model="gemini-2.5-flash", temperature=1.0):
+    a = MagicMock()
+    a.name = name
+    a.model = model
+    a.generate_content_config.temperature = temperature
+    return a
+
+
+@pytest.mark.parametrize("prompt", ["Who are you?", "who are you", "  WHO   are you?!  ", "Who are you..."])
+def test_normalize_prompt(prompt):
+    assert normalize_prompt(prompt) == "who are you"
+
+
+def test_key_for():
+    cache = ResponseCache(InMemoryResponseCacheBackend())
+
+    key = cache.key_for(agent(temperature=0.73), "Who are you?")
+    assert key == ResponseCacheKey("rickbot_Rick", "who are you", "gemini-2.5-flash", 0.7)
+
+    # Anything that changes the reply changes the key
+    assert cache.key_for(agent(name="rickbot_Yoda"), "Who are you?") != cache.key_for(agent(), "Who are you?")
+    assert cache.key_for(agent(model="gemini-2.5-pro"), "Who are you?") != cache.key_for(agent(), "Who are you?")
+    assert cache.key_for(agent(temperature=0.2), "Who are you?") != cache.key_for(agent(), "Who are you?")
+
+
+def test_key_for_skips_empty_and_long_prompts():
+    cache = ResponseCache(InMemoryResponseCacheBackend(), max_prompt_chars=20)
+
+    assert cache.key_for(agent(), "?") is None
+    assert cache.key_for(agent(), "Tell me everything about portal fluid") is None
+
+
+@pytest.mark.asyncio
+async def test_cache_round_trip():
+    cache = ResponseCache(InMemoryResponseCacheBackend())
+    key = cache.key_for(agent(), "Hello")
+
+    assert await cache.get(key) is None
+    await cache.put(key, "Wubba lubba dub dub!")
+    assert await cache.get(key) == "Wubba lubba dub dub!"
+
+
+@pytest.mark.asyncio
+async def test_empty_replies_are_not_cached():
+    cache = ResponseCache(InMemoryResponseCacheBackend())
+    key = cache.key_for(agent(), "Hello")
+
+    await cache.put(key, "  ")
+    assert await cache.get(key) is None
+
+
+@pytest.mark.asyncio
+async def test_in_memory_backend_evicts_least_recently_used():
+    backend = InMemoryResponseCacheBackend(max_entries=2)
+    cache = ResponseCache(backend)
+    keys = [cache.key_for(agent(), prompt) for prompt in ["one", "two", "three"]]
+
+    await cache.put(keys[0], "1")
+    await cache.put(keys[1], "2")
+    await cache.get(keys[0])
+    await cache.put(keys[2], "3")
+
+    assert len(backend) == 2
+    assert await cache.get(keys[1]) is None
+    assert await cache.get(keys[0]) == "1"
+
+
+@pytest.mark.asyncio
+async def test_entries_expire():
+    cache = ResponseCache(InMemoryResponseCacheBackend(), ttl=0)
+    key = cache.key_for(agent(), "Hello")
+
+    await cache.put(key, "Wubba lubba dub dub!")
+    assert await cache.get(key) is None
+
+
+def test_stream_pieces():
+    text = "Wubba lubba dub dub! I'm Pickle Rick, Morty.\nAnd that's the waaaay the news goes!"
+    pieces = stream_pieces(text, piece_chars=16)
+
+    assert "".join(pieces) == text
+    assert len(pieces) > 1
+    assert all(len(piece) < 16 + 10 for piece in pieces)
+    assert stream_pieces("") == []
@@ -0,0 +1,74 @@
+import threading
+from unittest.mock import MagicMock
+
+from rickbot_agent.runners import RunnerRegistry
+
+
+def make_agent(name="rickbot_Rick"):
+    agent = MagicMock()
+    agent.name = name
+    return agent
+
+
+def test_runner_is_shared_per_agent():
+    build = MagicMock(side_effect=lambda agent: MagicMock(agent=agent))
+    registry = RunnerRegistry(build)
+    rick, yoda = make_agent("rickbot_Rick"), make_agent("rickbot_Yoda")
+
+    assert registry.get(rick) is registry.get(rick)
+    assert registry.get(yoda) is not registry.get(rick)
+    assert build.call_count == 2
+    assert len(registry) == 2
+
+
+def test_runner_is_rebuilt_when_agent_changes():
+    build = MagicMock(side_effect=lambda agent: MagicMock(agent=agent))
+    registry = RunnerRegistry(build)
+    old_agent = make_agent()
+
+    old_runner = registry.get(old_agent)
+
+    # e.g. the agent cache was cleared, and the agent recreated with the same name
+    new_agent = make_agent()
+    new_runner = registry.get(new_agent)
+
+    assert new_runner is not old_runner
+    assert new_runner.agent is new_agent
+    assert registry.get(new_agent) is new_runner
+    assert len(registry) == 1
+
+
+def test_clear_rebuilds_runners():
+    build = MagicMock(side_effect=lambda agent: MagicMock(agent=agent))
+    registry = RunnerRegistry(build)
+    agent = make_agent()
+
+    runner = registry.get(agent)
+    registry.clear()
+
+    assert registry.get(agent) is not runner
+    assert build.call_count == 2
+
+
+def test_concurrent_gets_build_one_runner():
+    build_started = threading.Event()
+    release = threading.Event()
+
+    def build(agent):
+        build_started.set()
+        release.wait(timeout=2)
+        return MagicMock(agent=agent)
+
+    registry = RunnerRegistry(build)
+    agent = make_agent()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get(agent))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    build_started.wait(timeout=2)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 8
+    assert all(r is results[0] for r in results)
@@ -0,0 +1,181 @@
+import numpy as np
+import pytest
+
+from rickbot_agent.response_cache import InMemoryResponseCacheBackend, ResponseCache, ResponseCacheKey
+from rickbot_agent.semantic_cache import SemanticCache, hashing_embedder
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def key(prompt, personality="rickbot_Dazbo", model="gemini-2.5-flash", temperature=1.0):
+    return ResponseCacheKey(personality, prompt, model, temperature)
+
+
+def axis_embedder(dimensions=8):
+    """Embeds prompts named 'p<n>' as the unit vector along axis n, so no two prompts are similar."""
+
+    async def embed(text):
+        vector = [0.0] * dimensions
+        vector[int(text[1:])] = 1.0
+        return vector
+
+    return embed
+
+
+def make_cache(**kwargs):
+    kwargs.setdefault("embedder", hashing_embedder())
+    kwargs.setdefault("threshold", 0.8)
+    kwargs.setdefault("personas", frozenset())
+    kwargs.setdefault("snapshot_path", None)
+    return SemanticCache(**kwargs)
+
+
+@pytest.mark.asyncio
+async def test_similar_prompts_match():
+    cache = make_cache()
+    await cache.put(key("how do i create a gcs bucket"), "Use gcloud storage buckets create.", ttl=60)
+
+    assert await cache.get(key("how can i create a gcs bucket")) == "Use gcloud storage buckets create."
+    assert await cache.get(key("what is cloud run")) is None
+
+
+@pytest.mark.asyncio
+async def test_namespaces_are_separate():
+    cache = make_cache()
+    await cache.put(key("how do i create a gcs bucket"), "Use gcloud.", ttl=60)
+
+    assert await cache.get(key("how do i create a gcs bucket", personality="rickbot_Rick")) is None
+    assert await cache.get(key("how do i create a gcs bucket", model="gemini-2.5-pro")) is None
+    assert await cache.get(key("how do i create a gcs bucket", temperature=0.2)) is None
+
+
+@pytest.mark.asyncio
+async def test_only_configured_personas_are_cached():
+    cache = make_cache(personas=frozenset({"rickbot_Dazbo"}))
+    await cache.put(key("hello", personality="rickbot_Rick"), "Wubba lubba dub dub!", ttl=60)
+    await cache.put(key("hello"), "Hi there.", ttl=60)
+
+    assert len(cache) == 1
+    assert await cache.get(key("hello", personality="rickbot_Rick")) is None
+    assert await cache.get(key("hello")) == "Hi there."
+
+
+@pytest.mark.asyncio
+async def test_put_replaces_a_matching_prompt():
+    cache = make_cache()
+    await cache.put(key("how do i create a gcs bucket"), "Old reply.", ttl=60)
+    await cache.put(key("how can i create a gcs bucket"), "New reply.", ttl=60)
+
+    assert len(cache) == 1
+    assert await cache.get(key("how do i create a gcs bucket")) == "New reply."
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_not_served():
+    clock = FakeClock()
+    cache = make_cache(clock=clock)
+    await cache.put(key("hello"), "Hi there.", ttl=60)
+
+    clock.now += 61
+    assert await cache.get(key("hello")) is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_evicts_least_recently_used_past_memory_budget():
+    entry_bytes = 8 * 4 + len("p0") + len("r0")  # float32 vector, prompt and reply
+    cache = make_cache(embedder=axis_embedder(), threshold=0.99, max_bytes=3 * entry_bytes)
+    for i in range(3):
+        await cache.put(key(f"p{i}"), f"r{i}", ttl=60)
+    assert cache.memory_bytes == 3 * entry_bytes
+
+    assert await cache.get(key("p0")) == "r0"  # p1 is now the least recently used
+    await cache.put(key("p3"), "r3", ttl=60)
+
+    assert len(cache) == 3
+    assert cache.memory_bytes == 3 * entry_bytes
+    assert await cache.get(key("p1")) is None
+    assert [await cache.get(key(f"p{i}")) for i in (0, 2, 3)] == ["r0", "r2", "r3"]
+
+
+@pytest.mark.asyncio
+async def test_removing_entries_keeps_rows_consistent():
+    clock = FakeClock()
+    cache = make_cache(embedder=axis_embedder(), threshold=0.99, clock=clock)
+    await cache.put(key("p0"), "r0", ttl=10)
+    await cache.put(key("p1"), "r1", ttl=60)
+    await cache.put(key("p2"), "r2", ttl=60)
+
+    clock.now += 11
+    assert await cache.get(key("p0")) is None  # Expired and removed, moving p2 into its row
+    assert await cache.get(key("p2")) == "r2"
+    assert await cache.get(key("p1")) == "r1"
+
+
+@pytest.mark.asyncio
+async def test_embedding_errors_are_misses():
+    async def broken(text):
+        raise RuntimeError("quota exceeded")
+
+    cache = make_cache(embedder=broken)
+    await cache.put(key("hello"), "Hi there.", ttl=60)
+
+    assert await cache.get(key("hello")) is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(tmp_path):
+    clock = FakeClock()
+    cache = make_cache(snapshot_path=str(tmp_path), clock=clock)
+    await cache.put(key("how do i create a gcs bucket"), "Use gcloud.", ttl=60)
+    await cache.put(key("hello", personality="rickbot_Rick"), "Wubba lubba dub dub!", ttl=10)
+    cache.save()
+
+    clock.now += 11
+    restored = make_cache(snapshot_path=str(tmp_path), clock=clock)
+    restored.load()
+
+    assert len(restored) == 1  # The expired entry isn't loaded
+    assert await restored.get(key("how can i create a gcs bucket")) == "Use gcloud."
+
+
+def test_load_ignores_a_corrupt_snapshot(tmp_path):
+    (tmp_path / "snapshot.npz").write_bytes(b"not a snapshot")
+    cache = make_cache(snapshot_path=str(tmp_path))
+
+    cache.load()
+
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_load_ignores_vectors_saved_with_other_entries(tmp_path):
+    cache = make_cache(snapshot_path=str(tmp_path))
+    await cache.put(key("how do i create a gcs bucket"), "Use gcloud.", ttl=60)
+    cache.save()
+
+    # Vectors of the right shape, but not the ones the entries were saved with
+    with np.load(tmp_path / "snapshot.npz") as snapshot:
+        metadata, vectors = snapshot["metadata"], snapshot["vectors"]
+    np.savez(tmp_path / "snapshot.npz", vectors=np.roll(vectors, 1, axis=1), metadata=metadata)
+
+    restored = make_cache(snapshot_path=str(tmp_path))
+    restored.load()
+
+    assert len(restored) == 0
+
+
+@pytest.mark.asyncio
+async def test_response_cache_falls_back_to_semantic_match():
+    cache = ResponseCache(InMemoryResponseCacheBackend(), semantic=make_cache())
+    await cache.put(key("how do i create a gcs bucket"), "Use gcloud.")
+
+    assert await cache.get(key("how can i create a gcs bucket")) == "Use gcloud."
+    assert await cache.get(key("what is cloud run")) is None
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from rickbot_utils import sse
+
+
+def parse(frame: bytes):
+    text = frame.decode()
+    assert text.startswith("data: ")
+    assert text.endswith("\n\n")
+    return json.loads(text[len("data: ") : -2])
+
+
+@pytest.mark.parametrize("text", ["Hello", "", 'Quotes " and \\ backslashes', "Line\nbreaks", "Wubba lubba 🥒 dub dub"])
+def test_encode_chunk(text):
+    assert parse(sse.encode_chunk(text)) == {"chunk": text}
+
+
+def test_encode_event():
+    payload = {"tool_call": {"name": "SearchAgent", "args": {"query": "portal gun"}}}
+    assert parse(sse.encode_event(payload)) == payload
+
+
+def test_fixed_frames():
+    assert parse(sse.DONE_FRAME) == {"done": True}
+    assert sse.HEARTBEAT_FRAME == b": heartbeat\n\n"
+
+
+def test_with_id():
+    frame = sse.with_id("abc:3", sse.encode_chunk("Hi"))
+    assert frame == b'id: abc:3\ndata: {"chunk":"Hi"}\n\n'
+
+
+def test_frames_are_single_lines():
+    # A newline inside a data: line would split the event
+    frame = sse.encode_chunk("one\ntwo\r\nthree")
+    assert frame.count(b"\n") == 2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def chunks(frames: bytes) -> list[str]:
+    """The text of each chunk frame in a run of frames."""
+    return [parse(frame + b"\n\n")["chunk"] for frame in frames.split(b"\n\n") if frame]
+
+
+def test_coalescer_holds_text_until_delay():
+    clock = FakeClock()
+    coalescer = sse.ChunkCoalescer(max_delay=0.05, max_bytes=1024, clock=clock)
+
+    assert coalescer.time_until_flush() is None
+    assert coalescer.chunk("Wubba ") == b""
+    clock.now += 0.03
+    assert coalescer.chunk("lubba ") == b""
+    assert coalescer.time_until_flush() == pytest.approx(0.02)  # Timed from the oldest buffered text
+
+    clock.now += 0.02
+    assert coalescer.time_until_flush() == 0
+    assert chunks(coalescer.flush()) == ["Wubba lubba "]
+    assert coalescer.time_until_flush() is None
+    assert coalescer.flush() == b""
+
+
+def test_coalescer_sends_late_fragment_immediately():
+    clock = FakeClock()
+    coalescer = sse.ChunkCoalescer(max_delay=0.05, clock=clock)
+
+    coalescer.chunk("Wubba ")
+    clock.now += 0.06  # The caller was busy and missed the deadline
+    assert chunks(coalescer.chunk("lubba ")) == ["Wubba lubba "]
+
+
+def test_coalescer_flushes_at_max_bytes():
+    coalescer = sse.ChunkCoalescer(max_delay=10, max_bytes=10, flush_on_sentence=False, clock=FakeClock())
+
+    assert coalescer.chunk("🥒🥒") == b""  # 8 bytes
+    assert len(coalescer) == 8
+    assert chunks(coalescer.chunk("ab")) == ["🥒🥒ab"]
+    assert len(coalescer) == 0
+
+
+@pytest.mark.parametrize(
+    "fragments, expected_sent, expected_held",
+    [
+        (["Hello Morty. ", "How"], ["Hello Morty. "], "How"),
+        (["Hello Morty.", " How"], ["Hello Morty. "], "How"),  # Sentence end straddles fragments
+        (['"Wubba lubba dub dub!"', " he said"], ['"Wubba lubba dub dub!" '], "he said"),
+        (["First line\nSecond"], ["First line\n"], "Second"),
+        (["One. Two. Thr"], ["One. Two. "], "Thr"),  # Up to the last complete sentence
+        (["Version 3.14 is out"], [], "Version 3.14 is out"),  # Not a sentence end
+    ],
+)
+def test_coalescer_flushes_at_sentence_end(fragments, expected_sent, expected_held):
+    coalescer = sse.ChunkCoalescer(max_delay=10, max_bytes=1024, clock=FakeClock())
+
+    sent = []
+    for fragment in fragments:
+        sent += chunks(coalescer.chunk(fragment))
+
+    assert sent == expected_sent
+    assert chunks(coalescer.flush()) == ([expected_held] if expected_held else [])
+
+
+def test_coalescer_remainder_gets_fresh_delay():
+    clock = FakeClock()
+    coalescer = sse.ChunkCoalescer(max_delay=0.05, clock=clock)
+
+    coalescer.chunk("Hi")
+    clock.now += 0.04
+    coalescer.chunk(". Bye")
+    assert coalescer.time_until_flush() == pytest.approx(0.05)
+
+
+def test_coalescer_disabled():
+    coalescer = sse.ChunkCoalescer(max_delay=0)
+
+    assert coalescer.chunk("Wubba") == sse.encode_chunk("Wubba")
+    assert coalescer.time_until_flush() is None
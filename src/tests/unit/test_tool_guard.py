@@ -0,0 +1,170 @@
+"""Failure-injection tests for the guards around the agent-as-a-tool sub-agents."""
+
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+from google.adk.agents import Agent
+from google.adk.tools import AgentTool
+
+from rickbot_agent.tool_guard import GuardedAgentTool, ToolGuard, unavailable_result
+from rickbot_utils.deadline import Deadline, deadline_scope
+from rickbot_utils.resilience import Bulkhead, CircuitBreaker, CircuitState
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class InjectedTool:
+    """Stands in for AgentTool.run_async: fails, hangs or answers, as the test says."""
+
+    def __init__(self):
+        self.calls = 0
+        self.mode = "ok"
+        self.release = asyncio.Event()
+
+    async def __call__(self, tool, *, args, tool_context):
+        self.calls += 1
+        if self.mode == "error":
+            raise RuntimeError("File Search returned 500")
+        if self.mode == "hang":
+            await asyncio.sleep(60)
+        if self.mode == "block":
+            await self.release.wait()
+        return f"facts about {args['request']}"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def injected():
+    tool = InjectedTool()
+    with patch.object(AgentTool, "run_async", new=lambda self, **kwargs: tool(self, **kwargs)):
+        yield tool
+
+
+def make_tool(clock, max_concurrent=4, timeout=1.0):
+    agent = Agent(model="gemini-2.0-flash", name="RagAgent", instruction="Return facts.")
+    breaker = CircuitBreaker("test.RagAgent", minimum_calls=3, window_size=10, open_seconds=30, clock=clock)
+    guard = ToolGuard("RagAgent", Bulkhead("test.RagAgent", max_concurrent), breaker, timeout)
+    return GuardedAgentTool(agent=agent, guard=guard)
+
+
+async def call(tool, request="GKE"):
+    return await tool.run_async(args={"request": request}, tool_context=MagicMock())
+
+
+@pytest.mark.asyncio
+async def test_healthy_calls_pass_through(clock, injected):
+    tool = make_tool(clock)
+
+    assert await call(tool) == "facts about GKE"
+    assert tool.guard.breaker.state is CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_failures_return_unavailable_and_open_the_breaker(clock, injected):
+    tool = make_tool(clock)
+    injected.mode = "error"
+
+    for _ in range(3):
+        assert await call(tool) == unavailable_result("RagAgent")
+    assert tool.guard.breaker.state is CircuitState.OPEN
+
+    # While open, calls return straight away, without calling the tool
+    assert await call(tool) == unavailable_result("RagAgent")
+    assert injected.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_closes_the_breaker_once_the_tool_recovers(clock, injected):
+    tool = make_tool(clock)
+    injected.mode = "error"
+    for _ in range(3):
+        await call(tool)
+
+    clock.now += 30
+    assert await call(tool) == unavailable_result("RagAgent")  # The probe fails, so the breaker re-opens
+    assert tool.guard.breaker.state is CircuitState.OPEN
+
+    injected.mode = "ok"
+    clock.now += 30
+    assert await call(tool) == "facts about GKE"
+    assert tool.guard.breaker.state is CircuitState.CLOSED
+    assert injected.calls == 5
+
+
+@pytest.mark.asyncio
+async def test_slow_calls_time_out_and_count_as_failures(clock, injected):
+    tool = make_tool(clock, timeout=0.01)
+    injected.mode = "hang"
+
+    for _ in range(3):
+        assert await call(tool) == unavailable_result("RagAgent")
+
+    assert tool.guard.breaker.state is CircuitState.OPEN
+
+
+@pytest.mark.asyncio
+async def test_bulkhead_refuses_calls_past_the_limit(clock, injected):
+    tool = make_tool(clock, max_concurrent=1)
+    injected.mode = "block"
+
+    first = asyncio.create_task(call(tool, "GKE"))
+    await asyncio.sleep(0)
+    assert await call(tool, "Cloud Run") == unavailable_result("RagAgent")
+
+    injected.release.set()
+    assert await first == "facts about GKE"
+    assert injected.calls == 1
+    # Refusals by the bulkhead aren't failures of the tool
+    assert tool.guard.breaker.failure_rate == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_calls_are_not_failures(clock, injected):
+    tool = make_tool(clock)
+    injected.mode = "block"
+
+    task = asyncio.create_task(call(tool))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert tool.guard.breaker.failure_rate == 0
+
+
+@pytest.mark.asyncio
+async def test_calls_are_skipped_when_the_request_deadline_leaves_too_little_time(clock, injected):
+    tool = make_tool(clock)
+    tool.guard.deadline_reserve = 10
+
+    with deadline_scope(Deadline(11)):
+        assert await call(tool) == unavailable_result("RagAgent")
+
+    assert injected.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_calls_are_cut_short_by_the_request_deadline_without_counting_as_failures(clock, injected):
+    tool = make_tool(clock, timeout=30)
+    tool.guard.deadline_reserve = 0
+    tool.guard.min_call_time = 0
+    injected.mode = "hang"
+
+    with deadline_scope(Deadline(0.01)):
+        for _ in range(3):
+            assert await call(tool) == unavailable_result("RagAgent")
+
+    assert injected.calls == 3
+    assert tool.guard.breaker.state is CircuitState.CLOSED
+    assert tool.guard.breaker.failure_rate == 0
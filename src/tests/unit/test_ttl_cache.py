@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from rickbot_utils.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_returns_value_until_expiry():
+    clock = FakeClock()
+    cache = TTLCache("test_expiry", max_entries=10, clock=clock)
+    cache.set("key", "value", ttl=60)
+
+    assert cache.get("key") == "value"
+
+    clock.now += 61
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_non_positive_ttl_is_not_cached():
+    cache = TTLCache("test_no_ttl", max_entries=10)
+    cache.set("key", "value", ttl=0)
+    assert cache.get("key") is None
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache("test_lru", max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")  # 'b' is now least recently used
+    cache.set("c", 3, ttl=60)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_invalidate():
+    cache = TTLCache("test_invalidate", max_entries=10)
+    cache.set("key", "value", ttl=60)
+    cache.invalidate("key")
+    assert cache.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_get_or_load_single_flight():
+    cache = TTLCache("test_single_flight", max_entries=10)
+    calls = 0
+    release = asyncio.Event()
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "loaded"
+
+    waiters = [asyncio.create_task(cache.get_or_load("key", loader, ttl=lambda v: 60)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == ["loaded"] * 5
+    assert calls == 1
+
+    # Subsequent lookups are served from the cache
+    assert await cache.get_or_load("key", loader, ttl=lambda v: 60) == "loaded"
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_get_or_load_does_not_cache_errors():
+    cache = TTLCache("test_load_error", max_entries=10)
+
+    async def failing_loader():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("key", failing_loader, ttl=lambda v: 60)
+
+    async def loader():
+        return "recovered"
+
+    assert await cache.get_or_load("key", loader, ttl=lambda v: 60) == "recovered"
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from rickbot_utils.turn_stream import (
+    WAKE,
+    StreamGoneException,
+    StreamStalledException,
+    TurnStream,
+    TurnStreamRegistry,
+    format_event_id,
+    parse_event_id,
+)
+
+
+def test_event_ids_round_trip():
+    assert parse_event_id(format_event_id("abc123", 7)) == ("abc123", 7)
+
+
+@pytest.mark.parametrize("event_id", ["", "abc123", "abc123:", ":7", "abc123:seven", "abc123:-1"])
+def test_parse_event_id_rejects_other_ids(event_id):
+    assert parse_event_id(event_id) is None
+
+
+def test_frames_after():
+    turn = TurnStream("t1", "rick@example.com", capacity=8)
+    for i in range(1, 4):
+        turn.publish_nowait(f"frame {i}".encode())
+
+    assert turn.frames_after(0) == [(1, b"frame 1"), (2, b"frame 2"), (3, b"frame 3")]
+    assert turn.frames_after(2) == [(3, b"frame 3")]
+    assert turn.frames_after(3) == []
+
+
+def test_overwritten_frames_are_gone():
+    turn = TurnStream("t1", "rick@example.com", capacity=2)
+    for i in range(1, 5):
+        turn.publish_nowait(f"frame {i}".encode())
+
+    assert turn.frames_after(2) == [(3, b"frame 3"), (4, b"frame 4")]
+    with pytest.raises(StreamGoneException):
+        turn.frames_after(1)
+
+
+@pytest.mark.asyncio
+async def test_publish_waits_for_a_connection_to_catch_up():
+    turn = TurnStream("t1", "rick@example.com", capacity=2)
+    await turn.publish(b"frame 1")
+    await turn.publish(b"frame 2")
+
+    # The buffer is full of frames no connection has been sent
+    publishing = asyncio.create_task(turn.publish(b"frame 3", timeout=1))
+    await asyncio.sleep(0.01)
+    assert not publishing.done()
+
+    turn.ack(1)
+    await asyncio.wait_for(publishing, 1)
+    assert turn.frames_after(1) == [(2, b"frame 2"), (3, b"frame 3")]
+
+
+@pytest.mark.asyncio
+async def test_publish_gives_up_when_nobody_reads():
+    turn = TurnStream("t1", "rick@example.com", capacity=1)
+    await turn.publish(b"frame 1")
+
+    with pytest.raises(StreamStalledException):
+        await turn.publish(b"frame 2", timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_followers_are_woken():
+    turn = TurnStream("t1", "rick@example.com")
+    queue: asyncio.Queue[object] = asyncio.Queue(maxsize=1)
+
+    with turn.follow(queue):
+        turn.publish_nowait(b"frame 1")
+        turn.publish_nowait(b"frame 2")  # Wakes are not queued up
+        assert queue.get_nowait() == WAKE
+        assert queue.empty()
+
+        turn.finish()
+        assert queue.get_nowait() == WAKE
+
+    turn.publish_nowait(b"frame 3")
+    assert queue.empty()
+
+
+def test_registry_resume():
+    registry = TurnStreamRegistry()
+    turn = registry.start(owner="rick@example.com")
+    turn.publish_nowait(b"frame 1")
+
+    assert registry.resume(format_event_id(turn.turn_id, 1), owner="rick@example.com") == (turn, 1)
+
+    # Only the owner can resume a turn
+    with pytest.raises(StreamGoneException):
+        registry.resume(format_event_id(turn.turn_id, 1), owner="morty@example.com")
+    with pytest.raises(StreamGoneException):
+        registry.resume(format_event_id("unknown", 1), owner="rick@example.com")
+    # A seq beyond the last frame published would skip the live frames up to it
+    with pytest.raises(StreamGoneException):
+        registry.resume(format_event_id(turn.turn_id, 2), owner="rick@example.com")
+
+
+def test_finished_turns_expire():
+    registry = TurnStreamRegistry(retention=0.01)
+    turn = registry.start(owner="rick@example.com")
+    registry.finish(turn)
+    assert turn.finished
+
+    assert registry.resume(format_event_id(turn.turn_id, 0), owner="rick@example.com") == (turn, 0)
+    time.sleep(0.02)
+    with pytest.raises(StreamGoneException):
+        registry.resume(format_event_id(turn.turn_id, 0), owner="rick@example.com")
@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+
+from rickbot_agent.repository import UserMetadata
+from rickbot_agent.user_sync import UserMetadataWriter
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingStore:
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+        self.attempts = 0
+        self.during_write = None  # Called once, while the next batch is being written
+
+    async def write(self, users):
+        self.attempts += 1
+        if self.during_write:
+            self.during_write, during_write = None, self.during_write
+            during_write()
+        if self.fail:
+            raise RuntimeError("Firestore unavailable")
+        self.batches.append(list(users))
+
+
+def user(user_id="u1", name="Rick", provider="github"):
+    return UserMetadata(user_id, provider, f"{user_id}@example.com", name)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def store():
+    return RecordingStore()
+
+
+@pytest.mark.asyncio
+async def test_keeps_only_newest_metadata_per_user(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, clock=clock)
+
+    for name in ("Rick", "Rick S", "Rick Sanchez"):
+        writer.enqueue(user(name=name))
+    writer.enqueue(user("u2"))
+
+    assert await writer.flush() == 2
+    assert store.batches == [[user(name="Rick Sanchez"), user("u2")]]
+
+
+@pytest.mark.asyncio
+async def test_writes_each_user_at_most_once_per_window(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, clock=clock)
+
+    writer.enqueue(user())
+    await writer.flush()
+
+    # Reloads within the window are held, not written
+    clock.now += 10
+    writer.enqueue(user(name="Renamed"))
+    assert await writer.flush() == 0
+
+    clock.now += 49
+    assert await writer.flush() == 0
+
+    # Once the window has passed, only the newest details are written
+    clock.now += 1
+    assert await writer.flush() == 1
+    assert store.batches == [[user()], [user(name="Renamed")]]
+
+
+@pytest.mark.asyncio
+async def test_flushes_in_batches(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, max_batch_size=2, clock=clock)
+    for i in range(5):
+        writer.enqueue(user(f"u{i}"))
+
+    assert await writer.flush() == 5
+    assert [len(batch) for batch in store.batches] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_failed_batches_are_retried_with_backoff(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, retry_base=5, clock=clock)
+    writer.enqueue(user())
+
+    store.fail = True
+    assert await writer.flush() == 0
+    assert len(writer) == 1
+
+    # Each retry waits twice as long as the one before
+    for attempts, delay in enumerate((5, 10), start=2):
+        clock.now += delay - 1
+        await writer.flush()
+        assert store.attempts == attempts - 1
+        clock.now += 1
+        await writer.flush()
+        assert store.attempts == attempts
+
+    store.fail = False
+    clock.now += 19
+    assert await writer.flush() == 0
+    clock.now += 1
+    assert await writer.flush() == 1
+    assert store.batches == [[user()]]
+
+
+@pytest.mark.asyncio
+async def test_users_are_dropped_after_max_attempts(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, retry_base=1, retry_max=1, max_attempts=3, clock=clock)
+    writer.enqueue(user())
+    store.fail = True
+
+    for _ in range(5):
+        await writer.flush()
+        clock.now += 1
+
+    assert store.attempts == 3
+    assert len(writer) == 0
+
+
+@pytest.mark.asyncio
+async def test_newer_details_survive_dropping_failed_ones(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, retry_base=1, retry_max=1, max_attempts=2, clock=clock)
+    writer.enqueue(user())
+    store.fail = True
+    await writer.flush()
+    clock.now += 1
+
+    # The user signs in again while their last attempt is being written
+    store.during_write = lambda: writer.enqueue(user(name="Rick Sanchez"))
+    await writer.flush()
+
+    # The failed details are dropped, but the newer ones are kept, with attempts of their own
+    assert len(writer) == 1
+    clock.now += 60
+    await writer.flush()
+    assert len(writer) == 1
+    store.fail = False
+    clock.now += 1
+    assert await writer.flush() == 1
+    assert store.batches == [[user(name="Rick Sanchez")]]
+
+
+@pytest.mark.asyncio
+async def test_drain_writes_everything_on_shutdown(clock, store):
+    writer = UserMetadataWriter(store.write, window=60, clock=clock)
+    writer.enqueue(user())
+    await writer.flush()
+
+    clock.now += 1
+    writer.enqueue(user(name="Renamed"))  # Not due for another 59s
+    await writer.drain()
+
+    assert store.batches == [[user()], [user(name="Renamed")]]
+    assert len(writer) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_flushes_in_background(store):
+    writer = UserMetadataWriter(store.write, window=60, flush_interval=0.01)
+    task = asyncio.create_task(writer.run())
+    try:
+        writer.enqueue(user())
+        for _ in range(100):
+            if store.batches:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+
+    assert store.batches == [[user()]]